@@ -164,7 +164,7 @@ def qmark(sql: str, conn=None) -> str:
     """Adapt a SQL string to the active backend.
 
     Call sites write one Postgres-flavoured SQL string (``%s`` placeholders,
-    ``::jsonb`` casts, ``FOR UPDATE``) and this helper rewrites it to the
+    ``::jsonb`` casts, ``FOR UPDATE [SKIP LOCKED]``) and this helper rewrites it to the
     SQLite dialect when the runtime connection is SQLite. Passing ``conn``
     is preferred; when omitted the module-level ``_USE_SQLITE`` flag is used.
     """
@@ -174,5 +174,5 @@ def qmark(sql: str, conn=None) -> str:
     sql = sql.replace("%s", "?")
     sql = re.sub(r"::jsonb\b", "", sql)
     sql = re.sub(r"::json\b", "", sql)
-    sql = sql.replace("FOR UPDATE", "")
+    sql = re.sub(r"FOR UPDATE(?:\s+(?:SKIP LOCKED|NOWAIT))?", "", sql)
     return sql
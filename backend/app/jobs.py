@@ -0,0 +1,153 @@
+"""Durable OCR job queue stored in the ocr_jobs table.
+
+`POST /submissions/upload?wait=false` enqueues the image here and returns 202
+straight away; background runners in main.py claim jobs, run OCR and write the
+pending_review submission. Because the queue lives in the database, queued
+jobs survive a restart, and a job whose runner died mid-way is reclaimed once
+its claim is older than OCR_JOB_STALE_SECONDS. A runner only settles a job
+while it still holds the claim, so a slow runner whose job was reclaimed
+cannot write a second submission or overwrite the other runner's outcome.
+
+On Postgres a claim is `FOR UPDATE SKIP LOCKED`, so several API processes can
+drain one queue without double-claiming. On SQLite the same single UPDATE
+flips status and claimed_by atomically under the database write lock.
+
+Helpers take (cur, conn) like the other query helpers; the caller commits.
+Timestamps are written from Python in UTC so both backends store the same
+values.
+"""
+
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from app.database import qmark
+
+JOB_STALE_SECONDS = int(os.getenv("OCR_JOB_STALE_SECONDS", "900"))
+JOB_MAX_ATTEMPTS = int(os.getenv("OCR_JOB_MAX_ATTEMPTS", "3"))
+
+_JOB_COLUMNS = "id, status, submission_id, error, attempts, created_at, finished_at"
+
+
+def _utc_now(offset_seconds: int = 0) -> str:
+    ts = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
+    return ts.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def enqueue_job(cur, conn, image_bytes: bytes) -> str:
+    """Insert a queued job holding the raw upload; returns the job id."""
+    job_id = str(uuid.uuid4())
+    cur.execute(
+        qmark(
+            "INSERT INTO ocr_jobs (id, status, image_bytes, created_at) VALUES (%s, %s, %s, %s)",
+            conn,
+        ),
+        (job_id, "queued", image_bytes, _utc_now()),
+    )
+    return job_id
+
+
+def claim_next_job(cur, conn, worker_id: str) -> Optional[Dict[str, Any]]:
+    """Claim the oldest runnable job for `worker_id`, or return None.
+
+    Runnable means queued, or running under a claim older than
+    JOB_STALE_SECONDS (its runner died). Stale jobs that have used up
+    JOB_MAX_ATTEMPTS are failed instead of being retried forever.
+    """
+    stale_before = _utc_now(-JOB_STALE_SECONDS)
+    cur.execute(
+        qmark(
+            "UPDATE ocr_jobs SET status = 'failed', error = %s, finished_at = %s, image_bytes = NULL "
+            "WHERE status = 'running' AND claimed_at < %s AND attempts >= %s",
+            conn,
+        ),
+        ("worker lost the job too many times", _utc_now(), stale_before, JOB_MAX_ATTEMPTS),
+    )
+    cur.execute(
+        qmark(
+            "UPDATE ocr_jobs SET status = 'running', claimed_by = %s, claimed_at = %s, "
+            "attempts = attempts + 1 "
+            "WHERE id = ("
+            "SELECT id FROM ocr_jobs "
+            "WHERE status = 'queued' OR (status = 'running' AND claimed_at < %s) "
+            "ORDER BY created_at LIMIT 1 FOR UPDATE SKIP LOCKED"
+            ") RETURNING id, image_bytes, attempts",
+            conn,
+        ),
+        (worker_id, _utc_now(), stale_before),
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    return {"id": str(row["id"]), "image_bytes": bytes(row["image_bytes"]), "attempts": row["attempts"]}
+
+
+def complete_job(cur, conn, job_id: str, worker_id: str) -> bool:
+    """Mark a job done and drop its image, if `worker_id` still holds its claim.
+
+    Returns False when the claim went stale and another runner took the job
+    (or already finished it); the caller then drops its result. Call this
+    before writing the submission, in the same transaction, and link the two
+    with `set_job_submission`.
+    """
+    cur.execute(
+        qmark(
+            "UPDATE ocr_jobs SET status = 'done', finished_at = %s, image_bytes = NULL, error = NULL "
+            "WHERE id = %s AND claimed_by = %s AND status = 'running'",
+            conn,
+        ),
+        (_utc_now(), job_id, worker_id),
+    )
+    return cur.rowcount == 1
+
+
+def set_job_submission(cur, conn, job_id: str, submission_id: str) -> None:
+    """Point a completed job at the submission that now holds its result."""
+    cur.execute(
+        qmark("UPDATE ocr_jobs SET submission_id = %s WHERE id = %s", conn),
+        (submission_id, job_id),
+    )
+
+
+def fail_job(cur, conn, job_id: str, worker_id: str, error: str) -> bool:
+    """Mark a job failed if `worker_id` still holds its claim; returns whether it did."""
+    cur.execute(
+        qmark(
+            "UPDATE ocr_jobs SET status = 'failed', error = %s, finished_at = %s, image_bytes = NULL "
+            "WHERE id = %s AND claimed_by = %s AND status = 'running'",
+            conn,
+        ),
+        (error[:500], _utc_now(), job_id, worker_id),
+    )
+    return cur.rowcount == 1
+
+
+def release_job(cur, conn, job_id: str, worker_id: str, undo_attempt: bool = False) -> bool:
+    """Put a job `worker_id` still holds back in the queue; returns whether it did.
+
+    `undo_attempt` gives the attempt back when the job never ran (OCR
+    capacity was full), so it does not count towards JOB_MAX_ATTEMPTS.
+    """
+    attempts = "attempts - 1" if undo_attempt else "attempts"
+    cur.execute(
+        qmark(
+            "UPDATE ocr_jobs SET status = 'queued', claimed_by = NULL, claimed_at = NULL, "
+            f"attempts = {attempts} WHERE id = %s AND claimed_by = %s AND status = 'running'",
+            conn,
+        ),
+        (job_id, worker_id),
+    )
+    return cur.rowcount == 1
+
+
+def get_job(cur, conn, job_id: str) -> Optional[Dict[str, Any]]:
+    cur.execute(qmark(f"SELECT {_JOB_COLUMNS} FROM ocr_jobs WHERE id = %s", conn), (job_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["id"] = str(job["id"])
+    if job.get("submission_id") is not None:
+        job["submission_id"] = str(job["submission_id"])
+    return job
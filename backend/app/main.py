@@ -5,25 +5,28 @@ and password recovery, submission CRUD and approval, invoice and product
 reads, analytics, and the image upload that runs the OCR pipeline.
 """
 
+import asyncio
 import io
 import json
 import logging
 import os
+import socket
 import time
 import uuid
 from contextvars import ContextVar
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import psycopg2
 from fastapi import Depends, FastAPI, File, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from PIL import Image, UnidentifiedImageError
 from pydantic import BaseModel, Field
 from starlette.middleware.base import BaseHTTPMiddleware
 
-from app.schemas import InvoiceOut, ProductOut, SubmissionOut
+from app.schemas import InvoiceOut, JobOut, JobQueuedOut, ProductOut, SubmissionOut
 from app.database import ACTIVE_DB, get_connection, is_sqlite_conn, qmark
 from app.auth import (
     RESET_TOKEN_TTL_MINUTES,
@@ -46,6 +49,16 @@ from app.auth import (
     verify_password,
 )
 from app.email import render_reset_email, send_email
+from app.jobs import (
+    JOB_MAX_ATTEMPTS,
+    claim_next_job,
+    complete_job,
+    enqueue_job,
+    fail_job,
+    get_job,
+    release_job,
+    set_job_submission,
+)
 
 
 # Each request gets a short id that is attached to every log line produced
@@ -171,35 +184,111 @@ def _to_int(val) -> Optional[int]:
 
 @app.on_event("startup")
 def _warmup_ocr_models() -> None:
-    """Load the TrOCR weights once at startup so the first upload does not
-    have to wait for the model to load."""
-    if os.getenv("SKIP_OCR_WARMUP") == "1":
-        return
-    try:
-        from app.ocr.handwriting import _load_handwritten
-        _load_handwritten()
-        logger.info("TrOCR handwritten model pre-loaded at startup")
-    except Exception:
-        logger.exception("OCR warmup failed. Uploads will load the model on first use.")
+    """Start the OCR worker processes, or with OCR_WORKERS=0 a warm-up thread
+    in this process, so TrOCR, EasyOCR and Tesseract are loaded and have read
+    a first cell before any upload. GET /ready reports when that is done."""
+    from app.ocr.workers import get_ocr_pool
+
+    get_ocr_pool().start()
+
+
+@app.on_event("shutdown")
+def _stop_ocr_workers() -> None:
+    from app.ocr.workers import get_ocr_pool
+    get_ocr_pool().shutdown()
 
 
 @app.get("/health", tags=["System"])
 def health():
-    """Report the liveness of the API and which database is serving requests."""
+    """Report the liveness of the API, which database is serving requests and
+    the memory of the API and OCR worker processes."""
+    from app.ocr.workers import get_ocr_pool
+
     uptime_seconds = int((datetime.now(timezone.utc) - _STARTED_AT).total_seconds())
-    try:
-        from app.ocr.handwriting import _hw_model
-        model_loaded = _hw_model is not None
-    except Exception:
-        model_loaded = False
+    pool = get_ocr_pool()
+    if pool.workers:
+        model_loaded = bool(pool.ready_workers)
+    else:
+        try:
+            from app.ocr.handwriting import get_hw_registry
+            model_loaded = get_hw_registry().active is not None
+        except Exception:
+            model_loaded = False
     return {
         "status": "ok",
         "db": ACTIVE_DB,
         "uptime_seconds": uptime_seconds,
         "ocr_model_loaded": model_loaded,
+        "ocr_ready": pool.ready,
+        "ocr_workers": pool.workers,
+        "ocr_workers_ready": len(pool.ready_workers),
+        "ocr_pending": pool.pending,
+        "memory": pool.memory(),
     }
 
 
+@app.get("/ready", tags=["System"])
+def ready():
+    """Readiness for the load balancer: 200 once every OCR engine is warm, 503 until then."""
+    from app.ocr.workers import get_ocr_pool
+
+    pool = get_ocr_pool()
+    return JSONResponse(
+        status_code=200 if pool.ready else 503,
+        content={
+            "ready": pool.ready,
+            "ocr_workers": pool.workers,
+            "ocr_workers_ready": len(pool.ready_workers),
+            "warmup_errors": list(pool.warmup_errors),
+        },
+    )
+
+
+class ModelSwapPayload(BaseModel):
+    model: str = Field(..., min_length=1, max_length=512, description="Checkpoint directory or Hub model id")
+
+
+@app.get("/admin/model", tags=["System"])
+def ocr_model_status(_user=Depends(require_manager)):
+    """Which TrOCR checkpoint is requested and how far the swap to it has got."""
+    from app.ocr.workers import get_ocr_pool
+    return get_ocr_pool().model_status()
+
+
+@app.post("/admin/model", tags=["System"])
+def swap_ocr_model(payload: ModelSwapPayload, current=Depends(require_manager)):
+    """Hot-swap the TrOCR checkpoint, e.g. to the output of finetune_trocr.py.
+
+    Returns 202 straight away; the checkpoint loads and warms in the
+    background while the current one keeps serving, and pages already being
+    read finish on the checkpoint they started with. Poll GET /admin/model.
+    """
+    from app.ocr.handwriting import check_checkpoint
+    from app.ocr.model_registry import ModelSwapInProgress
+    from app.ocr.workers import get_ocr_pool
+
+    try:
+        check_checkpoint(payload.model)
+        get_ocr_pool().request_model(payload.model)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    except ModelSwapInProgress as exc:
+        raise HTTPException(status_code=409, detail=f"A model swap is already running: {exc}")
+
+    logger.info("User %s requested TrOCR checkpoint %s", current.get("sub"), payload.model)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        _log_audit(cur, conn, current.get("sub"), "ocr_model.swap_requested", payload.model)
+        conn.commit()
+        cur.close()
+    except psycopg2.Error:
+        logger.exception("Could not audit the model swap")
+    finally:
+        conn.close()
+    return JSONResponse(status_code=202, content=get_ocr_pool().model_status())
+
+
 # Authentication: login, whoami, password change, recovery-code reset.
 
 class LoginPayload(BaseModel):
@@ -1487,6 +1576,13 @@ def analytics_ocr_confidence(_user=Depends(require_manager)):
         conn.close()
 
 
+@app.get("/analytics/ocr-timings", tags=["Analytics"])
+def analytics_ocr_timings(_user=Depends(require_manager)):
+    """Distribution of OCR wall time per pipeline step and engine since startup."""
+    from app.ocr.timing import HISTOGRAM
+    return HISTOGRAM.snapshot()
+
+
 # Upload endpoint: receive an image, run the OCR pipeline,
 # write a pending_review submission row.
 
@@ -1529,55 +1625,134 @@ def _validate_upload(file: UploadFile, image_bytes: bytes) -> None:
         )
 
 
-@app.post("/submissions/upload", response_model=SubmissionOut, tags=["Submissions"])
-async def upload_submission(file: UploadFile = File(...), _user=Depends(require_manager)):
-    """Upload an invoice image, run OCR, store as pending_review."""
-    from app.ocr.receipt_pipeline import process_receipt
+def _ocr_engine_label(model: Optional[str], cascade_model: Optional[str]) -> str:
+    """Engines that read the page, naming the TrOCR checkpoint(s) that served it."""
+    if model is None:
+        trocr = "trocr"
+    elif cascade_model is not None:
+        trocr = f"trocr[{cascade_model}>{model}]"
+    else:
+        trocr = f"trocr[{model}]"
+    return f"{trocr}+easyocr+tesseract"
+
+
+def _ocr_extracted_data(structured: Dict[str, Any], timings: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    model = structured.pop("model", None)
+    cascade_model = structured.pop("cascade_model", None)
+    return {
+        "ocr": {
+            "raw_text": structured.get("raw_text", ""),
+            "engine": _ocr_engine_label(model, cascade_model),
+            "model": model,
+            "cascade_model": cascade_model,
+            "scope": "full_document",
+            "timings": timings,
+        },
+        "structured": structured,
+    }
+
+
+def _insert_pending_submission(
+    cur, conn, structured: Dict[str, Any], timings: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Store one OCR result as a pending_review submission and return the row."""
+    extracted_json = json.dumps(_ocr_extracted_data(structured, timings))
+    if is_sqlite_conn(conn):
+        new_id = str(uuid.uuid4())
+        cur.execute(
+            qmark(
+                "INSERT INTO submissions (id, image_url, extracted_data, status) "
+                "VALUES (%s, %s, %s, %s) "
+                "RETURNING id, image_url, extracted_data, status, created_at",
+                conn,
+            ),
+            (new_id, "uploaded_file", extracted_json, "pending_review"),
+        )
+    else:
+        cur.execute(
+            "INSERT INTO submissions (image_url, extracted_data, status) "
+            "VALUES (%s, %s::jsonb, %s) "
+            "RETURNING id, image_url, extracted_data, status, created_at",
+            ("uploaded_file", extracted_json, "pending_review"),
+        )
+    return cur.fetchone()
+
+
+async def _run_ocr(image_bytes: bytes) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Run the OCR pipeline through the worker pool, unless the same image has
+    already been read by the same model and pipeline version.
+
+    Returns (structured, timings). Timings of real runs feed the process-wide
+    histogram; a cache hit reports only the lookup time.
+    """
+    from app.ocr.result_cache import get_result_cache
+    from app.ocr.timing import HISTOGRAM
+    from app.ocr.workers import get_ocr_pool
+
+    started = time.perf_counter()
+    cache = get_result_cache()
+    key = None
+    if cache is not None:
+        key = await asyncio.to_thread(cache.key_for, image_bytes)
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            logger.info("OCR result cache hit")
+            return cached, {"cache_hit": True, "total_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    structured = await get_ocr_pool().run(image_bytes)
+    timings = structured.pop("timings", None) or {}
+    if timings:
+        HISTOGRAM.observe(timings)
+    # Just after a model swap a worker may still have read the page with the
+    # old checkpoint; that result must not be cached under the new one.
+    if key is not None and structured.get("model") == cache.model_id:
+        await asyncio.to_thread(cache.put, key, structured)
+    return structured, timings
+
+
+@app.post(
+    "/submissions/upload",
+    response_model=SubmissionOut,
+    responses={202: {"model": JobQueuedOut, "description": "Queued as an OCR job (wait=false)"}},
+    tags=["Submissions"],
+)
+async def upload_submission(
+    file: UploadFile = File(...),
+    wait: bool = True,
+    _user=Depends(require_manager),
+):
+    """Upload an invoice image, run OCR, store as pending_review.
+
+    With wait=false the image is queued as an OCR job instead and the call
+    returns 202 with the job id; poll GET /jobs/{id} for the submission.
+    A photo that is too dark, blank or washed out, or blurry fails the OCR
+    pre-flight checks and gets a 422 with the reasons; a sideways or
+    non-AGW page is read anyway and flagged under "preflight".
+    """
+    from app.ocr.preflight import PreflightRejected
+    from app.ocr.workers import OcrQueueFull
 
     image_bytes = await file.read()
     _validate_upload(file, image_bytes)
 
+    if not wait:
+        return _enqueue_upload(image_bytes)
+
     try:
-        structured = process_receipt(image_bytes)
+        structured, timings = await _run_ocr(image_bytes)
+    except OcrQueueFull:
+        raise HTTPException(status_code=503, detail="OCR is busy, try again shortly")
+    except PreflightRejected as exc:
+        logger.info("Upload rejected by OCR pre-flight: %s", ", ".join(exc.reasons))
+        raise HTTPException(status_code=422, detail=str(exc))
     except Exception:
         logger.exception("OCR pipeline failed")
         raise HTTPException(status_code=500, detail="OCR pipeline failed")
 
-    raw_text = structured.get("raw_text", "")
-    extracted_data = {
-        "ocr": {
-            "raw_text": raw_text,
-            "engine": "trocr-large-handwritten+tesseract",
-            "scope": "full_document",
-        },
-        "structured": structured,
-    }
-    extracted_json = json.dumps(extracted_data)
-
     conn = get_connection()
     try:
         cur = conn.cursor()
-
-        if is_sqlite_conn(conn):
-            new_id = str(uuid.uuid4())
-            cur.execute(
-                qmark(
-                    "INSERT INTO submissions (id, image_url, extracted_data, status) "
-                    "VALUES (%s, %s, %s, %s) "
-                    "RETURNING id, image_url, extracted_data, status, created_at",
-                    conn,
-                ),
-                (new_id, "uploaded_file", extracted_json, "pending_review"),
-            )
-        else:
-            cur.execute(
-                "INSERT INTO submissions (image_url, extracted_data, status) "
-                "VALUES (%s, %s::jsonb, %s) "
-                "RETURNING id, image_url, extracted_data, status, created_at",
-                ("uploaded_file", extracted_json, "pending_review"),
-            )
-
-        row = cur.fetchone()
+        row = _insert_pending_submission(cur, conn, structured, timings)
         conn.commit()
         cur.close()
         return normalize_submission(dict(row)) if isinstance(row, dict) else row
@@ -1592,3 +1767,181 @@ async def upload_submission(file: UploadFile = File(...), _user=Depends(require_
         raise HTTPException(status_code=500, detail="Internal server error")
     finally:
         conn.close()
+
+
+def _enqueue_upload(image_bytes: bytes) -> JSONResponse:
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        job_id = enqueue_job(cur, conn, image_bytes)
+        conn.commit()
+        cur.close()
+    except psycopg2.Error:
+        logger.exception("OCR job enqueue failed")
+        raise HTTPException(status_code=500, detail="Database error")
+    finally:
+        conn.close()
+
+    if _job_wakeup is not None:
+        _job_wakeup.set()
+    queued = JobQueuedOut(job_id=job_id, status="queued", status_url=f"/jobs/{job_id}")
+    return JSONResponse(status_code=202, content=queued.model_dump())
+
+
+@app.get("/jobs/{job_id}", response_model=JobOut, tags=["Submissions"])
+def get_ocr_job(job_id: str, _user=Depends(require_manager)):
+    """Status of a queued upload; submission_id is set once status is done."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        job = get_job(cur, conn, job_id)
+        cur.close()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+    except HTTPException:
+        raise
+    except psycopg2.Error:
+        logger.exception("OCR job read failed")
+        raise HTTPException(status_code=500, detail="Database error")
+    finally:
+        conn.close()
+
+
+# Background OCR job runners. Each runner claims one job at a time from the
+# ocr_jobs table and hands the image to the OCR pool, so queued uploads are
+# processed at the pool's pace and picked up again after a restart.
+
+OCR_JOB_POLL_SECONDS = float(os.getenv("OCR_JOB_POLL_SECONDS", "2"))
+
+_job_wakeup: Optional[asyncio.Event] = None
+_job_runners: List[asyncio.Task] = []
+
+
+def _claim_ocr_job(worker_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        job = claim_next_job(cur, conn, worker_id)
+        conn.commit()
+        cur.close()
+        return job
+    finally:
+        conn.close()
+
+
+def _settle_ocr_job(
+    job_id: str,
+    worker_id: str,
+    structured: Optional[Dict[str, Any]] = None,
+    timings: Optional[Dict[str, Any]] = None,
+    error: Optional[str] = None,
+    requeue: bool = False,
+    undo_attempt: bool = False,
+) -> bool:
+    """Write a runner's outcome: the submission, a failure, or a requeue.
+
+    Returns False, writing nothing, when `worker_id` no longer holds the job.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        if structured is not None:
+            settled = complete_job(cur, conn, job_id, worker_id)
+            if settled:
+                row = _insert_pending_submission(cur, conn, structured, timings)
+                set_job_submission(cur, conn, job_id, str(row["id"]))
+        elif requeue:
+            settled = release_job(cur, conn, job_id, worker_id, undo_attempt=undo_attempt)
+        else:
+            settled = fail_job(cur, conn, job_id, worker_id, error or "OCR pipeline failed")
+        conn.commit()
+        cur.close()
+        return settled
+    finally:
+        conn.close()
+
+
+async def _ocr_job_runner(worker_id: str) -> None:
+    from concurrent.futures.process import BrokenProcessPool
+    from app.ocr.preflight import PreflightRejected
+    from app.ocr.workers import OcrQueueFull, get_ocr_pool
+
+    loop = asyncio.get_running_loop()
+    pool = get_ocr_pool()
+    while True:
+        # Leave room for synchronous uploads rather than claim work the pool
+        # would only reject.
+        if pool.pending >= pool.max_pending:
+            await asyncio.sleep(OCR_JOB_POLL_SECONDS)
+            continue
+
+        _job_wakeup.clear()
+        try:
+            job = await loop.run_in_executor(None, _claim_ocr_job, worker_id)
+        except Exception:
+            logger.exception("Claiming an OCR job failed")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(_job_wakeup.wait(), OCR_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        outcome: Dict[str, Any]
+        try:
+            structured, timings = await _run_ocr(job["image_bytes"])
+            outcome = {"structured": structured, "timings": timings}
+        except OcrQueueFull:
+            outcome = {"requeue": True, "undo_attempt": True}
+        except PreflightRejected as exc:
+            outcome = {"error": str(exc)}
+        except BrokenProcessPool:
+            # The worker died on this image; retry it until it has used up
+            # its attempts, in case the crash was not the image's fault.
+            logger.error("OCR job %s lost its worker (attempt %d)", job["id"], job["attempts"])
+            if job["attempts"] < JOB_MAX_ATTEMPTS:
+                outcome = {"requeue": True}
+            else:
+                outcome = {"error": "OCR worker crashed on this image"}
+        except Exception:
+            logger.exception("OCR job %s failed", job["id"])
+            outcome = {"error": "OCR pipeline failed"}
+
+        try:
+            settled = await loop.run_in_executor(None, lambda: _settle_ocr_job(job["id"], worker_id, **outcome))
+            if not settled:
+                logger.warning("OCR job %s was reclaimed by another runner; dropping this result", job["id"])
+        except Exception:
+            # The claim goes stale and another runner retries the job later.
+            logger.exception("Saving the result of OCR job %s failed", job["id"])
+
+
+@app.on_event("startup")
+async def _start_ocr_job_runners() -> None:
+    """Start the background runners that drain the ocr_jobs queue.
+
+    OCR_JOB_RUNNERS=auto runs one per OCR worker; 0 leaves this process
+    serving the API only.
+    """
+    global _job_wakeup
+    from app.ocr.workers import get_ocr_pool
+
+    raw = os.getenv("OCR_JOB_RUNNERS", "auto").strip().lower()
+    count = max(1, get_ocr_pool().workers) if raw == "auto" else int(raw)
+    if count <= 0:
+        return
+    _job_wakeup = asyncio.Event()
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    for i in range(count):
+        _job_runners.append(asyncio.create_task(_ocr_job_runner(f"{host}:{i}")))
+    logger.info("Started %d OCR job runner(s)", count)
+
+
+@app.on_event("shutdown")
+async def _stop_ocr_job_runners() -> None:
+    for task in _job_runners:
+        task.cancel()
+    await asyncio.gather(*_job_runners, return_exceptions=True)
+    _job_runners.clear()
@@ -0,0 +1,136 @@
+"""Cross-request micro-batching for TrOCR recognition.
+
+Concurrent process_receipt calls hand their crops to one shared queue. A
+single scheduler thread holds the first crop for up to TROCR_BATCH_MAX_WAIT_MS
+so crops from other uploads can join it, decodes up to TROCR_BATCH_MAX_SIZE
+of them in one generate() call, then resolves each caller's future. Because
+only the scheduler thread touches the model, concurrent requests no longer
+interleave on the shared weights either.
+
+Opt in with TROCR_MICROBATCH=1. It only pays off when several uploads are
+processed by threads of the same process.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+MICROBATCH_ENABLED = os.getenv("TROCR_MICROBATCH", "0") == "1"
+MAX_BATCH_SIZE = int(os.getenv("TROCR_BATCH_MAX_SIZE", "32"))
+MAX_WAIT_MS = float(os.getenv("TROCR_BATCH_MAX_WAIT_MS", "10"))
+
+
+class MicroBatcher:
+    """Collect items from many callers and run them through `run_batch` together.
+
+    Items are grouped by `key` (for TrOCR: processor, model and token budget),
+    since only items with the same key can share a batch.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Hashable, List[Any]], List[Any]],
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = MAX_WAIT_MS,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Optional[Tuple[Hashable, Any, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="trocr-microbatch", daemon=True)
+        self._thread.start()
+
+    def submit(self, key: Hashable, items: Sequence[Any]) -> List[Future]:
+        """Queue every item under `key`; one future per item, in order."""
+        futures: List[Future] = []
+        for item in items:
+            fut: Future = Future()
+            self._queue.put((key, item, fut))
+            futures.append(fut)
+        return futures
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _collect(self) -> Tuple[List[Tuple[Hashable, Any, Future]], bool]:
+        """Block for the first item, then gather more until full or the wait expires."""
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        pending = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                nxt = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if nxt is None:
+                return pending, True
+            pending.append(nxt)
+        return pending, False
+
+    def _run(self, pending: List[Tuple[Hashable, Any, Future]]) -> None:
+        groups: Dict[Hashable, List[Tuple[Any, Future]]] = {}
+        for key, item, fut in pending:
+            groups.setdefault(key, []).append((item, fut))
+
+        for key, entries in groups.items():
+            live = [(item, fut) for item, fut in entries if fut.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                results = list(self.run_batch(key, [item for item, _ in live]))
+                if len(results) != len(live):
+                    raise RuntimeError(f"run_batch returned {len(results)} result(s) for {len(live)} item(s)")
+            except Exception as exc:
+                # Every caller gets the error; none is left waiting on its future.
+                logger.exception("Micro-batch of %d item(s) failed", len(live))
+                for _, fut in live:
+                    fut.set_exception(exc)
+                continue
+            for (_, fut), result in zip(live, results):
+                fut.set_result(result)
+
+    def _loop(self) -> None:
+        while True:
+            pending, stop = self._collect()
+            if pending:
+                self._run(pending)
+            if stop:
+                return
+
+
+def _run_trocr_batch(key: Hashable, imgs: List[Any]) -> List[Tuple[str, float]]:
+    from app.ocr.handwriting import _ocr_batch_with_confidence
+
+    processor, model, max_tokens = key
+    return _ocr_batch_with_confidence(processor, model, imgs, max_new_tokens=max_tokens, batch_size=len(imgs))
+
+
+_BATCHER: Optional[MicroBatcher] = None
+_BATCHER_LOCK = threading.Lock()
+
+
+def get_trocr_batcher() -> Optional[MicroBatcher]:
+    """Return the process-wide TrOCR batcher, or None when micro-batching is off."""
+    global _BATCHER
+    if not MICROBATCH_ENABLED:
+        return None
+    with _BATCHER_LOCK:
+        if _BATCHER is None:
+            _BATCHER = MicroBatcher(_run_trocr_batch)
+            logger.info(
+                "TrOCR micro-batching on (max batch %d, max wait %.0f ms)",
+                _BATCHER.max_batch_size, _BATCHER.max_wait * 1000,
+            )
+        return _BATCHER
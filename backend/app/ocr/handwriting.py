@@ -1,30 +1,234 @@
-"""TrOCR model loading, document normalisation and per-region OCR helpers."""
+"""TrOCR model loading, document normalisation and per-region OCR helpers.
 
+transformers and torch are imported lazily so that a worker serving the ONNX
+Runtime engine (TROCR_ENGINE=onnx) never loads torch.
+"""
+
+import logging
 import os
-from typing import Optional, Tuple
+import re
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
 
 from PIL import Image
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 
 import cv2
 import numpy as np
 
+from app.ocr.model_registry import ModelRegistry
+from app.ocr.region_detector import PageGeometry, analysis_copy
+from app.ocr.shared_weights import SHARED_WEIGHTS, share_weights, weights_path
+
+if TYPE_CHECKING:
+    from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 
-_hw_processor: Optional[TrOCRProcessor] = None
-_hw_model: Optional[VisionEncoderDecoderModel] = None
+logger = logging.getLogger(__name__)
 
-# Override with a fine-tuned checkpoint by setting TROCR_HANDWRITTEN_MODEL.
+# Override with a fine-tuned checkpoint by setting TROCR_HANDWRITTEN_MODEL,
+# or swap one in while the server runs with POST /admin/model.
 TROCR_HANDWRITTEN_MODEL = os.getenv("TROCR_HANDWRITTEN_MODEL", "microsoft/trocr-large-handwritten")
 
+# "torch" (default) runs the HF model eagerly; "onnx" runs the graphs exported
+# by scripts/export_trocr_onnx.py from TROCR_ONNX_DIR on onnxruntime.
+TROCR_ENGINE = os.getenv("TROCR_ENGINE", "torch").strip().lower()
+TROCR_ONNX_DIR = os.getenv("TROCR_ONNX_DIR", "")
+
 DEFAULT_MAX_TOKENS = int(os.getenv("TROCR_MAX_NEW_TOKENS", "96"))
 
+# TROCR_CASCADE_MODEL names a smaller checkpoint (e.g.
+# microsoft/trocr-base-handwritten, or an ONNX export directory with the onnx
+# engine) that reads every handwritten crop first; only crops it reads with
+# confidence below TROCR_CASCADE_THRESHOLD go on to the main model. Empty
+# (the default) sends every crop to the main model.
+TROCR_CASCADE_MODEL = os.getenv("TROCR_CASCADE_MODEL", "").strip()
+TROCR_CASCADE_THRESHOLD = float(os.getenv("TROCR_CASCADE_THRESHOLD", "0.9"))
+
+# TROCR_QUANTIZE=int8 loads the model with dynamic int8 quantisation of every
+# nn.Linear (CPU only). The quantised weights are cached under
+# TROCR_QUANT_CACHE_DIR so later starts skip loading the fp32 checkpoint.
+TROCR_QUANTIZE = os.getenv("TROCR_QUANTIZE", "").strip().lower()
+TROCR_QUANT_CACHE_DIR = Path(os.getenv(
+    "TROCR_QUANT_CACHE_DIR",
+    str(Path(__file__).resolve().parents[2] / "model_cache"),
+))
+
+# Upper bound on crops decoded in one generate() call; keeps peak memory flat
+# on pages with an unusually large number of filled rows.
+DEFAULT_BATCH_SIZE = int(os.getenv("TROCR_BATCH_SIZE", "16"))
+
+
+def _checkpoint_slug(model_name: str) -> str:
+    """Filesystem-safe name for a checkpoint; for a local directory the newest
+    weights mtime is appended, so a retrained checkpoint gets a new slug."""
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name.strip("/\\"))
+    local = Path(model_name)
+    if local.is_dir():
+        weights = [p for p in local.iterdir() if p.suffix in (".safetensors", ".bin", ".onnx")]
+        if weights:
+            slug += f"-{int(max(p.stat().st_mtime for p in weights))}"
+    return slug
+
+
+def handwritten_model_id(name: Optional[str] = None) -> str:
+    """Identify the TrOCR weights that will serve reads: engine, checkpoint
+    and quantisation. Used to key anything derived from model output.
+
+    `name` is a checkpoint (an ONNX export directory with TROCR_ENGINE=onnx);
+    by default the one requested from the model registry.
+    """
+    if name is None:
+        name = get_hw_registry().requested
+    if TROCR_ENGINE == "onnx":
+        return f"onnx:{_checkpoint_slug(name)}"
+    model_id = f"torch:{_checkpoint_slug(name)}"
+    return f"{model_id}:{TROCR_QUANTIZE}" if TROCR_QUANTIZE else model_id
+
+
+def _quantized_cache_path(model_name: str) -> Path:
+    """Cache file for one checkpoint + library version."""
+    import torch
+    import transformers
+
+    slug = _checkpoint_slug(model_name)
+    return TROCR_QUANT_CACHE_DIR / f"{slug}.int8.torch{torch.__version__}.tf{transformers.__version__}.pt"
+
+
+def _load_quantized(model_name: str) -> "VisionEncoderDecoderModel":
+    """Load `model_name` with dynamically int8-quantised Linear layers.
+
+    On a cache hit the model is built from its config and the int8 state dict
+    is loaded straight into it, so the fp32 weights are never materialised.
+    The cache holds only a state dict and is read with weights_only=True; a
+    file that does not load that way is replaced by a fresh quantisation.
+    """
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+    from transformers import GenerationConfig, VisionEncoderDecoderConfig, VisionEncoderDecoderModel
+    from transformers.modeling_utils import no_init_weights
+
+    cache_path = _quantized_cache_path(model_name)
+    if cache_path.exists():
+        config = VisionEncoderDecoderConfig.from_pretrained(model_name)
+        with no_init_weights():
+            model = VisionEncoderDecoderModel(config)
+        model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        try:
+            # Tensors only: the cache directory is writable, so nothing in
+            # it is unpickled as code.
+            model.load_state_dict(torch.load(cache_path, map_location="cpu", weights_only=True))
+        except Exception:
+            logger.exception("Ignoring unreadable int8 cache %s; re-quantising", cache_path)
+        else:
+            try:
+                model.generation_config = GenerationConfig.from_pretrained(model_name)
+            except OSError:
+                model.generation_config = GenerationConfig.from_model_config(config)
+            logger.info("Loaded int8 TrOCR weights from %s", cache_path)
+            return model.eval()
+
+    model = VisionEncoderDecoderModel.from_pretrained(model_name).eval()
+    model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        torch.save(model.state_dict(), tmp_path)
+        os.replace(tmp_path, cache_path)
+        logger.info("Cached int8 TrOCR weights at %s", cache_path)
+    except OSError:
+        logger.exception("Could not cache int8 TrOCR weights; will re-quantise on next start")
+    return model
+
+
+def _shared_weights_path(model_name: str) -> Path:
+    import transformers
+
+    return weights_path(f"{_checkpoint_slug(model_name)}.{TROCR_QUANTIZE}.tf{transformers.__version__}")
+
+
+def _load_model(model_name: str) -> "VisionEncoderDecoderModel":
+    if TROCR_QUANTIZE == "int8":
+        model = _load_quantized(model_name)
+        # The int8 state dict is read into private memory; the embeddings
+        # and other unquantised tensors can still be shared.
+        if SHARED_WEIGHTS:
+            mapped = share_weights(model, _shared_weights_path(model_name))
+            logger.info("Mapped %.0f MB of TrOCR weights shared between workers", mapped / 1e6)
+        return model
+    if TROCR_QUANTIZE:
+        raise ValueError(f"Unsupported TROCR_QUANTIZE value: {TROCR_QUANTIZE!r} (expected 'int8')")
+    # fp32 weights stay mapped from the checkpoint file (transformers loads
+    # both safetensors and .bin with mmap), so workers share them already.
+    from transformers import VisionEncoderDecoderModel
+    return VisionEncoderDecoderModel.from_pretrained(model_name)
+
+
+def _configured_checkpoint() -> str:
+    return TROCR_ONNX_DIR if TROCR_ENGINE == "onnx" else TROCR_HANDWRITTEN_MODEL
+
+
+def _load_checkpoint(name: str) -> Tuple["TrOCRProcessor", "VisionEncoderDecoderModel"]:
+    """Processor and model for one checkpoint on the configured engine."""
+    if TROCR_ENGINE == "onnx":
+        from app.ocr.onnx_engine import OnnxTrOCR, OnnxTrOCRProcessor
 
-def _load_handwritten() -> Tuple[TrOCRProcessor, VisionEncoderDecoderModel]:
-    global _hw_processor, _hw_model
-    if _hw_processor is None or _hw_model is None:
-        _hw_processor = TrOCRProcessor.from_pretrained(TROCR_HANDWRITTEN_MODEL)
-        _hw_model = VisionEncoderDecoderModel.from_pretrained(TROCR_HANDWRITTEN_MODEL)
-    return _hw_processor, _hw_model
+        if not name:
+            raise RuntimeError("TROCR_ENGINE=onnx needs TROCR_ONNX_DIR (see scripts/export_trocr_onnx.py)")
+        return OnnxTrOCRProcessor(name), OnnxTrOCR(name)
+    if TROCR_ENGINE == "torch":
+        from transformers import TrOCRProcessor
+
+        return TrOCRProcessor.from_pretrained(name), _load_model(name)
+    raise ValueError(f"Unsupported TROCR_ENGINE value: {TROCR_ENGINE!r} (expected 'torch' or 'onnx')")
+
+
+def _warm_checkpoint(processor, model) -> None:
+    """Read one synthetic cell, so a swapped-in model's first page is not its slowest."""
+    cell = np.full((64, 256, 3), 255, dtype=np.uint8)
+    cv2.putText(cell, "12.50", (8, 48), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 3)
+    _ocr_batch_with_confidence(processor, model, [cell], max_new_tokens=8)
+
+
+def check_checkpoint(name: str) -> None:
+    """Raise ValueError for a name that cannot be a checkpoint on this engine.
+
+    A local directory always qualifies; with the torch engine so does a
+    Hugging Face Hub id ("owner/model").
+    """
+    if Path(name).is_dir():
+        return
+    if TROCR_ENGINE == "torch" and re.fullmatch(r"[A-Za-z0-9_.-]+/[A-Za-z0-9_.-]+", name):
+        return
+    raise ValueError(f"{name!r} is not a checkpoint directory or model id")
+
+
+_registry: Optional[ModelRegistry] = None
+_cascade_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_hw_registry() -> ModelRegistry:
+    """Return the process-wide TrOCR model registry (nothing is loaded until first use)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(_load_checkpoint, _warm_checkpoint, _configured_checkpoint)
+        return _registry
+
+
+def get_cascade_registry() -> Optional[ModelRegistry]:
+    """Return the registry of the TROCR_CASCADE_MODEL checkpoint, or None when the cascade is off."""
+    global _cascade_registry
+    if not TROCR_CASCADE_MODEL:
+        return None
+    with _registry_lock:
+        if _cascade_registry is None:
+            _cascade_registry = ModelRegistry(_load_checkpoint, _warm_checkpoint, lambda: TROCR_CASCADE_MODEL)
+        return _cascade_registry
+
+
+def _load_handwritten() -> Tuple["TrOCRProcessor", "VisionEncoderDecoderModel"]:
+    return get_hw_registry().models()
 
 
 def _pil_to_cv_bgr(pil_img: Image.Image) -> np.ndarray:
@@ -51,43 +255,127 @@ def _ensure_pil_rgb(img) -> Image.Image:
     raise ValueError(f"Unsupported image dimensions: {arr.ndim}")
 
 
-def normalize_document(pil_img: Image.Image) -> Image.Image:
-    """Rotate to portrait and deskew small angles via minAreaRect."""
-    pil_img = pil_img.convert("RGB")
-    w, h = pil_img.size
+def to_portrait(rgb: np.ndarray) -> np.ndarray:
+    """Rotate a landscape page array a quarter turn (a view, no copy)."""
+    h, w = rgb.shape[:2]
+    return np.rot90(rgb) if w > h else rgb
 
-    if w > h:
-        pil_img = pil_img.rotate(90, expand=True)
 
-    cv_img = _pil_to_cv_bgr(pil_img)
-    gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
+def estimate_skew(img: np.ndarray) -> float:
+    """Skew angle in degrees for PageGeometry, via minAreaRect; 0.0 when none.
 
+    `img` is an RGB or grayscale page; the estimate runs on its downscaled
+    analysis copy, so passing that copy directly costs nothing extra.
+    """
+    small, _ = analysis_copy(img)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY) if small.ndim == 3 else small
     thr = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
     inv = 255 - thr
     coords = cv2.findNonZero(inv)
     if coords is None:
-        return pil_img
+        return 0.0
 
     rect = cv2.minAreaRect(coords)
     angle = rect[-1]
+    # OpenCV reports the angle in [-90, 0) or, since 4.5, in (0, 90].
     if angle < -45:
         angle = 90 + angle
+    elif angle > 45:
+        angle = angle - 90
 
     # Only correct small skews; larger angles are likely feature errors.
     if abs(angle) < 0.5 or abs(angle) > 12:
-        return pil_img
+        return 0.0
+    return float(angle)
+
+
+def normalize_document(rgb: np.ndarray) -> np.ndarray:
+    """Rotate an RGB page array to portrait and deskew small angles via minAreaRect.
+
+    The skew angle is estimated on the downscaled analysis copy; only the
+    rotation itself touches full-resolution pixels. Returns the input (or a
+    rotated view of it) when no warp is needed.
+    """
+    rgb = to_portrait(rgb)
+    h, w = rgb.shape[:2]
+    return PageGeometry(w, h, estimate_skew(rgb)).warp(rgb)
+
+
+def _ocr_with(processor: "TrOCRProcessor", model: "VisionEncoderDecoderModel", img, max_new_tokens: int) -> str:
+    return _ocr_batch_with_confidence(processor, model, [img], max_new_tokens)[0][0]
+
+
+def _confidence_from_log_probs(log_probs: Sequence[float]) -> float:
+    """Map the average token log-prob onto 0-1 (an average of -5 or worse is 0)."""
+    if not log_probs:
+        return 0.0
+    avg_log_prob = sum(log_probs) / len(log_probs)
+    return max(0.0, min(1.0, 1.0 + avg_log_prob / 5.0))
+
+
+def _generate_with_log_probs(model, pixel_values, max_new_tokens: int):
+    """Run one generate pass; returns (sequences, per-step log-probs of the chosen tokens)."""
+    import torch
+
+    with torch.no_grad():
+        outputs = model.generate(
+            pixel_values,
+            max_new_tokens=max_new_tokens,
+            output_scores=True,
+            return_dict_in_generate=True,
+        )
+    if not outputs.scores:
+        return outputs.sequences.tolist(), None
+    transition = model.compute_transition_scores(
+        outputs.sequences,
+        outputs.scores,
+        getattr(outputs, "beam_indices", None),
+        normalize_logits=True,
+    )
+    return outputs.sequences.tolist(), transition.tolist()
+
+
+def _ocr_batch_with_confidence(
+    processor: "TrOCRProcessor",
+    model,
+    imgs: Sequence,
+    max_new_tokens: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> List[Tuple[str, float]]:
+    """Decode several crops per generate() call; returns (text, confidence) per crop.
+
+    The processor resizes every crop to the same input size, so a page's worth
+    of cells stacks into one tensor and shares a single encoder/decoder pass.
+    Confidence only counts tokens up to and including each sequence's EOS -
+    the padding emitted after a short sequence finishes is ignored. `model` is
+    either a VisionEncoderDecoderModel or an OnnxTrOCR.
+    """
+    is_onnx = getattr(model, "is_onnx", False)
+    if is_onnx:
+        eos_ids = {model.eos_token_id}
+    else:
+        eos = model.generation_config.eos_token_id
+        eos_ids = set(eos) if isinstance(eos, (list, tuple)) else {eos}
 
-    (h2, w2) = gray.shape[:2]
-    M = cv2.getRotationMatrix2D((w2 // 2, h2 // 2), angle, 1.0)
-    rotated = cv2.warpAffine(cv_img, M, (w2, h2), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    results: List[Tuple[str, float]] = []
+    for start in range(0, len(imgs), max(1, batch_size)):
+        chunk = [_ensure_pil_rgb(img) for img in imgs[start:start + batch_size]]
+        if is_onnx:
+            pixel_values = processor(images=chunk, return_tensors="np").pixel_values
+            sequences, transition = model.generate_with_log_probs(pixel_values, max_new_tokens)
+            sequences, transition = sequences.tolist(), transition.tolist()
+        else:
+            pixel_values = processor(images=chunk, return_tensors="pt").pixel_values
+            sequences, transition = _generate_with_log_probs(model, pixel_values, max_new_tokens)
 
-    rgb = cv2.cvtColor(rotated, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(rgb).convert("RGB")
+        texts = [t.strip() for t in processor.batch_decode(sequences, skip_special_tokens=True)]
+        if transition is None:
+            results.extend((text, 0.0) for text in texts)
+            continue
 
+        for text, seq, log_probs in zip(texts, sequences, transition):
+            generated = seq[-len(log_probs):] if log_probs else []
+            n = next((k + 1 for k, tok in enumerate(generated) if tok in eos_ids), len(generated))
+            results.append((text, _confidence_from_log_probs(log_probs[:n])))
 
-def _ocr_with(processor: TrOCRProcessor, model: VisionEncoderDecoderModel, img, max_new_tokens: int) -> str:
-    pil_img = _ensure_pil_rgb(img)
-    pixel_values = processor(images=pil_img, return_tensors="pt").pixel_values
-    generated_ids = model.generate(pixel_values, max_new_tokens=max_new_tokens)
-    text = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-    return text.strip()
+    return results
@@ -0,0 +1,211 @@
+"""Hot-swappable TrOCR checkpoints, so a fine-tuned model deploys without a restart.
+
+The registry holds one active (processor, model) pair. Each page leases it
+for the whole of its read, so a page never mixes two checkpoints. `swap`
+loads and warms the new checkpoint on a background thread while the old one
+keeps serving; once it is ready it becomes active in one step, and the old
+pair is dropped as soon as the last page that leased it finishes.
+
+The first lease loads the configured checkpoint (TROCR_HANDWRITTEN_MODEL,
+or TROCR_ONNX_DIR with the ONNX engine). POST /admin/model requests a swap;
+with OCR_WORKERS > 0 each worker process swaps its own registry (see
+app.ocr.workers).
+"""
+
+import gc
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSwapInProgress(Exception):
+    """Raised when a swap is requested while another checkpoint is still loading."""
+
+
+class _Loaded:
+    """One loaded checkpoint and the number of pages currently reading with it."""
+
+    def __init__(self, name: str, models: Tuple[Any, Any]):
+        self.name = name
+        self.models: Optional[Tuple[Any, Any]] = models
+        self.leases = 0
+        self.retired = False
+
+
+class ModelLease:
+    """A page's hold on one checkpoint; the first `models()` call pins it."""
+
+    def __init__(self, registry: "ModelRegistry"):
+        self._registry = registry
+        self._entry: Optional[_Loaded] = None
+
+    @property
+    def name(self) -> Optional[str]:
+        """Checkpoint this lease reads with, or None before `models()` is called."""
+        return self._entry.name if self._entry is not None else None
+
+    def models(self) -> Tuple[Any, Any]:
+        if self._entry is None:
+            self._entry = self._registry._pin()
+        return self._entry.models
+
+    def release(self) -> None:
+        if self._entry is not None:
+            self._registry._unpin(self._entry)
+            self._entry = None
+
+
+class ModelRegistry:
+    """The active TrOCR checkpoint, swapped in the background on request.
+
+    `load(name)` returns (processor, model) for a checkpoint and `warm`
+    runs one read with them; `default_name()` is the checkpoint to serve
+    until a swap is requested.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], Tuple[Any, Any]],
+        warm: Callable[[Any, Any], None],
+        default_name: Callable[[], str],
+    ):
+        self._load = load
+        self._warm = warm
+        self._default_name = default_name
+        self._lock = threading.Lock()
+        self._first_load_lock = threading.Lock()
+        self._active: Optional[_Loaded] = None
+        self._requested: Optional[str] = None
+        self._loading: Optional[str] = None
+        self._loader: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+        self.swapped_at: Optional[float] = None
+
+    @property
+    def requested(self) -> str:
+        """The checkpoint that should be serving: the last one swapped in, else the default.
+
+        A checkpoint still loading, or one that failed to load, is not it.
+        """
+        return self._requested or self._default_name()
+
+    @property
+    def active(self) -> Optional[str]:
+        """The checkpoint serving new pages, or None before the first load."""
+        entry = self._active
+        return entry.name if entry is not None else None
+
+    @contextmanager
+    def lease(self) -> Iterator[ModelLease]:
+        """Hold one checkpoint for a page; it stays loaded until the block exits."""
+        lease = ModelLease(self)
+        try:
+            yield lease
+        finally:
+            lease.release()
+
+    def models(self) -> Tuple[Any, Any]:
+        """The active pair without a lease, loading the default one on first use.
+
+        For warm-up and scripts; a page that is read while a swap may
+        happen should use `lease` instead.
+        """
+        entry = self._pin()
+        # Read while pinned: a swap may retire the entry and free it on unpin.
+        models = entry.models
+        self._unpin(entry)
+        return models
+
+    def _pin(self) -> _Loaded:
+        while True:
+            with self._lock:
+                entry = self._active
+                if entry is not None:
+                    entry.leases += 1
+                    return entry
+            with self._first_load_lock:
+                if self._active is None:
+                    name = self.requested
+                    loaded = _Loaded(name, self._load(name))
+                    with self._lock:
+                        if self._active is None:
+                            self._active = loaded
+                            logger.info("Serving TrOCR checkpoint %s", name)
+
+    def _unpin(self, entry: _Loaded) -> None:
+        with self._lock:
+            entry.leases -= 1
+            free = entry.retired and entry.leases == 0
+        if free:
+            self._free(entry)
+
+    def _free(self, entry: _Loaded) -> None:
+        entry.models = None
+        gc.collect()
+        logger.info("Released TrOCR checkpoint %s", entry.name)
+
+    def request(self, name: str) -> None:
+        """Record `name` as the checkpoint to serve without loading it here.
+
+        For a checkpoint known to load, e.g. one another process swapped in.
+        """
+        with self._lock:
+            self._requested = name
+
+    def swap(self, name: str, wait: bool = False) -> None:
+        """Load and warm `name` in the background, then make it the active checkpoint.
+
+        Pages already running keep the checkpoint they leased. Raises
+        ModelSwapInProgress while an earlier swap is still loading. With
+        wait=True the load runs on the calling thread instead.
+        """
+        with self._lock:
+            if self._loading is not None:
+                raise ModelSwapInProgress(f"{self._loading} is still loading")
+            self._loading = name
+            self.last_error = None
+        if wait:
+            self._load_and_switch(name)
+            return
+        self._loader = threading.Thread(target=self._load_and_switch, args=(name,), name="trocr-swap", daemon=True)
+        self._loader.start()
+
+    def _load_and_switch(self, name: str) -> None:
+        try:
+            t0 = time.perf_counter()
+            models = self._load(name)
+            self._warm(*models)
+            loaded = _Loaded(name, models)
+        except Exception as exc:
+            with self._lock:
+                self._loading = None
+                self.last_error = f"{type(exc).__name__}: {exc}"
+            logger.exception("Could not load TrOCR checkpoint %s; still serving %s", name, self.active)
+            return
+
+        with self._lock:
+            old, self._active = self._active, loaded
+            self._requested = name
+            self._loading = None
+            self.swapped_at = time.time()
+            free = False
+            if old is not None:
+                old.retired = True
+                free = old.leases == 0
+        logger.info("Switched TrOCR checkpoint to %s (loaded and warmed in %.1fs)", name, time.perf_counter() - t0)
+        if free:
+            self._free(old)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requested": self.requested,
+                "active": self.active,
+                "loading": self._loading,
+                "error": self.last_error,
+                "swapped_at": self.swapped_at,
+            }
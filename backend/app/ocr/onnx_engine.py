@@ -0,0 +1,173 @@
+"""ONNX Runtime engine for TrOCR: greedy decoding without torch.
+
+Runs the three graphs written by scripts/export_trocr_onnx.py - encoder,
+first-step decoder and decoder-with-past - on onnxruntime's CPU provider.
+Preprocessing and detokenisation come from the exported processor config
+files via PIL and `tokenizers`, so a worker on this engine imports neither
+transformers nor torch.
+"""
+
+import json
+import os
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+ONNX_CONFIG_FILE = "onnx_config.json"
+ENCODER_FILE = "encoder_model.onnx"
+DECODER_FILE = "decoder_model.onnx"
+DECODER_WITH_PAST_FILE = "decoder_with_past_model.onnx"
+
+
+def _clean_up_tokenization(text: str) -> str:
+    """Same space clean-up as transformers' `clean_up_tokenization`."""
+    return (
+        text.replace(" .", ".").replace(" ?", "?").replace(" !", "!").replace(" ,", ",")
+        .replace(" ' ", "'").replace(" n't", "n't").replace(" 'm", "'m")
+        .replace(" 's", "'s").replace(" 've", "'ve").replace(" 're", "'re")
+    )
+
+
+class OnnxTrOCRProcessor:
+    """Torch-free stand-in for TrOCRProcessor, read from the export directory.
+
+    Supports the two calls the pipeline makes: `processor(images=...)` for
+    pixel values and `batch_decode(...)` for text.
+    """
+
+    def __init__(self, model_dir: str):
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        cfg = json.loads((model_dir / "preprocessor_config.json").read_text(encoding="utf-8"))
+        self.size = (int(cfg["size"]["width"]), int(cfg["size"]["height"]))
+        self.resample = int(cfg.get("resample", Image.BILINEAR))
+        self.rescale_factor = float(cfg.get("rescale_factor", 1 / 255)) if cfg.get("do_rescale", True) else 1.0
+        if cfg.get("do_normalize", True):
+            self.mean = np.array(cfg.get("image_mean", [0.5, 0.5, 0.5]), dtype=np.float32)
+            self.std = np.array(cfg.get("image_std", [0.5, 0.5, 0.5]), dtype=np.float32)
+        else:
+            self.mean, self.std = np.zeros(3, np.float32), np.ones(3, np.float32)
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        tok_cfg_path = model_dir / "tokenizer_config.json"
+        tok_cfg = json.loads(tok_cfg_path.read_text(encoding="utf-8")) if tok_cfg_path.exists() else {}
+        self.clean_up_tokenization_spaces = bool(tok_cfg.get("clean_up_tokenization_spaces", False))
+
+    def __call__(self, images: Sequence[Image.Image], return_tensors: str = "np"):
+        arrays = []
+        for img in images:
+            resized = img.convert("RGB").resize(self.size, resample=self.resample)
+            arr = np.asarray(resized, dtype=np.float32) * self.rescale_factor
+            arrays.append(((arr - self.mean) / self.std).transpose(2, 0, 1))
+        return SimpleNamespace(pixel_values=np.stack(arrays).astype(np.float32))
+
+    def batch_decode(self, sequences, skip_special_tokens: bool = True) -> List[str]:
+        texts = self.tokenizer.decode_batch(
+            [[int(t) for t in seq] for seq in sequences],
+            skip_special_tokens=skip_special_tokens,
+        )
+        if self.clean_up_tokenization_spaces:
+            texts = [_clean_up_tokenization(t) for t in texts]
+        return texts
+
+
+def _log_softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+class OnnxTrOCR:
+    """Encoder + KV-cached decoder sessions for one exported checkpoint.
+
+    Decoding is greedy: the token picked at each step is the argmax, the same
+    as `model.generate` with the stock TrOCR generation config. Checkpoints
+    configured for beam search will read differently on this engine.
+    """
+
+    is_onnx = True
+
+    def __init__(self, model_dir: str):
+        import onnxruntime as ort
+
+        self.model_dir = Path(model_dir)
+        cfg = json.loads((self.model_dir / ONNX_CONFIG_FILE).read_text(encoding="utf-8"))
+        self.name_or_path = cfg["source_model"]
+        self.num_layers = int(cfg["num_layers"])
+        self.decoder_start_token_id = int(cfg["decoder_start_token_id"])
+        self.eos_token_id = int(cfg["eos_token_id"])
+        # Older exports wrote null for checkpoints without a pad token.
+        pad = cfg.get("pad_token_id")
+        self.pad_token_id = int(pad) if pad is not None else self.eos_token_id
+
+        opts = ort.SessionOptions()
+        threads = int(os.getenv("TROCR_ONNX_THREADS", "0"))
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        providers = ["CPUExecutionProvider"]
+        self.encoder = ort.InferenceSession(str(self.model_dir / ENCODER_FILE), opts, providers=providers)
+        self.decoder = ort.InferenceSession(str(self.model_dir / DECODER_FILE), opts, providers=providers)
+        self.decoder_with_past = ort.InferenceSession(
+            str(self.model_dir / DECODER_WITH_PAST_FILE), opts, providers=providers,
+        )
+        # The exporter may prune inputs a graph never reads; only feed what exists.
+        self._with_past_inputs = {i.name for i in self.decoder_with_past.get_inputs()}
+
+    def _run_with_past(self, feeds: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        return self.decoder_with_past.run(
+            None, {k: v for k, v in feeds.items() if k in self._with_past_inputs},
+        )
+
+    def generate_with_log_probs(
+        self, pixel_values: np.ndarray, max_new_tokens: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Greedy-decode a batch.
+
+        Returns (sequences, log_probs): sequences start with the decoder start
+        token and are padded after EOS, like `generate`; log_probs holds the
+        log-probability of each generated token, shape (batch, steps).
+        """
+        batch = pixel_values.shape[0]
+        encoder_hidden = self.encoder.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+
+        input_ids = np.full((batch, 1), self.decoder_start_token_id, dtype=np.int64)
+        outputs = self.decoder.run(None, {"input_ids": input_ids, "encoder_hidden_states": encoder_hidden})
+
+        tokens: List[np.ndarray] = []
+        log_probs: List[np.ndarray] = []
+        finished = np.zeros(batch, dtype=bool)
+        rows = np.arange(batch)
+        cross_kv = {}
+        for step in range(max_new_tokens):
+            logits = outputs[0][:, -1, :]
+            next_tokens = logits.argmax(axis=-1)
+            step_log_probs = _log_softmax(logits)[rows, next_tokens]
+            next_tokens = np.where(finished, self.pad_token_id, next_tokens).astype(np.int64)
+            tokens.append(next_tokens)
+            log_probs.append(np.where(finished, 0.0, step_log_probs))
+            finished |= next_tokens == self.eos_token_id
+            if finished.all() or step == max_new_tokens - 1:
+                break
+
+            feeds = {"input_ids": next_tokens[:, None], "encoder_hidden_states": encoder_hidden}
+            if step == 0:
+                # First-step outputs: logits, then (self k, self v, cross k, cross v) per layer.
+                for i in range(self.num_layers):
+                    cross_kv[f"past_key_values.{i}.encoder.key"] = outputs[1 + 4 * i + 2]
+                    cross_kv[f"past_key_values.{i}.encoder.value"] = outputs[1 + 4 * i + 3]
+                for i in range(self.num_layers):
+                    feeds[f"past_key_values.{i}.decoder.key"] = outputs[1 + 4 * i]
+                    feeds[f"past_key_values.{i}.decoder.value"] = outputs[1 + 4 * i + 1]
+            else:
+                # With-past outputs: logits, then (self k, self v) per layer.
+                for i in range(self.num_layers):
+                    feeds[f"past_key_values.{i}.decoder.key"] = outputs[1 + 2 * i]
+                    feeds[f"past_key_values.{i}.decoder.value"] = outputs[1 + 2 * i + 1]
+            feeds.update(cross_kv)
+            outputs = self._run_with_past(feeds)
+
+        sequences = np.concatenate([input_ids, np.stack(tokens, axis=1)], axis=1)
+        return sequences, np.stack(log_probs, axis=1)
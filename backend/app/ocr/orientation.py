@@ -0,0 +1,70 @@
+"""Quarter-turn page orientation from the AGW table rules.
+
+to_portrait only makes the frame portrait, always turning a landscape photo
+the same way, so a page shot upside down (or turned the other way) used to
+be read at 180 degrees and come back as junk. `detect_orientation` runs on
+the deskewed layout-analysis copy, shrunk again to ORIENTATION.long_edge
+pixels, and costs a few milliseconds:
+
+- sideways: the long rules run vertically, i.e. they are rows of the page
+  turned a quarter;
+- upside down: an upright AGW page has a tall letterhead above the table and
+  a short footer below it, so the block of table rules sits low on the page
+  and most of the other ink is above it.
+
+A page with too few long rules either way is left as it is (pre-flight then
+reports no_table_rules). OCR_ORIENTATION=off keeps to_portrait alone.
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.ocr.region_detector import _ink_mask, _long_rule_rows, analysis_copy
+
+
+# Tuned on synthetic AGW pages: upright ones score about +0.35, upside-down
+# ones about -0.35, with or without residual skew.
+@dataclass(frozen=True)
+class OrientationThresholds:
+    long_edge: int = 600
+    min_table_rules: int = 10
+    rule_span_pct: float = 0.4
+    min_margin: float = 0.1
+
+
+ORIENTATION = OrientationThresholds()
+ORIENTATION_MODE = os.getenv("OCR_ORIENTATION", "auto").strip().lower()
+
+
+def _upright_score(binary: np.ndarray, rule_rows: list) -> float:
+    """Positive when the rule block sits low and the heavier non-table ink is above it."""
+    h = binary.shape[0]
+    first, last = rule_rows[0], rule_rows[-1]
+    position = (first - (h - 1 - last)) / h
+    row_ink = np.count_nonzero(binary, axis=1)
+    above, below = int(row_ink[:first].sum()), int(row_ink[last + 1:].sum())
+    return position + (above - below) / max(1, above + below)
+
+
+def detect_orientation(gray: np.ndarray) -> int:
+    """Quarter turns that make a grayscale page upright: use np.rot90(img, turns).
+
+    1 for a page turned a quarter clockwise, 2 for one upside down, 3 for
+    one turned a quarter anticlockwise, and 0 for upright pages and pages
+    that cannot be told.
+    """
+    small, _ = analysis_copy(gray, ORIENTATION.long_edge)
+    binary = _ink_mask(small)
+    rule_rows = _long_rule_rows(binary, ORIENTATION.rule_span_pct)
+    turns = 0
+    if len(rule_rows) < ORIENTATION.min_table_rules:
+        binary = np.ascontiguousarray(np.rot90(binary))
+        rule_rows = _long_rule_rows(binary, ORIENTATION.rule_span_pct)
+        if len(rule_rows) < ORIENTATION.min_table_rules:
+            return 0
+        turns = 1
+    if _upright_score(binary, rule_rows) < -ORIENTATION.min_margin:
+        turns += 2
+    return turns
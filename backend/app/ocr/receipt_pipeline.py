@@ -1,27 +1,45 @@
 """Main OCR pipeline for AGW receipts. Combines Tesseract, TrOCR and EasyOCR."""
 
 import io
+import os
 import re
+import time
+from contextlib import nullcontext
 from dataclasses import dataclass
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
 from PIL import Image, ImageOps
-import pytesseract
 
+from app.ocr import tesseract_engine, timing
+from app.ocr.batching import get_trocr_batcher
 from app.ocr.handwriting import (
     DEFAULT_MAX_TOKENS,
-    _ensure_pil_rgb,
+    TROCR_CASCADE_THRESHOLD,
     _load_handwritten,
+    _ocr_batch_with_confidence,
     _ocr_with,
-    _pil_to_cv_bgr,
+    estimate_skew,
+    get_cascade_registry,
+    get_hw_registry,
+    handwritten_model_id,
     normalize_document,
+    to_portrait,
 )
-from app.ocr.region_detector import detect_regions, get_column_bounds
+from app.ocr.orientation import ORIENTATION_MODE, detect_orientation
+from app.ocr.preflight import PREFLIGHT_MODE, PreflightRejected, check_page
+from app.ocr.region_detector import PageGeometry, analysis_copy, detect_regions, get_column_bounds
+from app.ocr.shared_weights import SHARED_WEIGHTS, share_weights, weights_path
+from app.ocr.stages import Stage, run_stages
 from app.ocr.key_fields_parser import parse_header, parse_footer
 
 
+# Bump whenever a change to this module alters the output for the same image
+# and model; cached results from older versions are then ignored.
+PIPELINE_VERSION = "7"
+
+
 # Template constants tuned to the AGW invoice layout. All crop fractions are
 # expressed relative to (image_width, header_end_y / footer_height).
 @dataclass(frozen=True)
@@ -56,6 +74,10 @@ TEMPLATE = TemplateConstants()
 TARGET_H = TEMPLATE.trocr_target_h
 MAX_TABLE_ROWS = TEMPLATE.max_table_rows
 
+# "crops" keeps the photo's pixels and rotates only the regions that are read,
+# through PageGeometry.crop; "warp" deskews the whole RGB page up front.
+DESKEW_MODE = os.getenv("OCR_DESKEW", "crops").strip().lower()
+
 
 _EASYOCR_READER = None
 
@@ -63,7 +85,12 @@ def _get_easyocr():
     global _EASYOCR_READER
     if _EASYOCR_READER is None:
         import easyocr
-        _EASYOCR_READER = easyocr.Reader(['en'], gpu=False, verbose=False)
+        reader = easyocr.Reader(['en'], gpu=False, verbose=False)
+        if SHARED_WEIGHTS:
+            # CRAFT stays fp32 on CPU; the recognizer is int8 apart from a few layers.
+            for part in ("detector", "recognizer"):
+                share_weights(getattr(reader, part), weights_path(f"easyocr{easyocr.__version__}.en.{part}"))
+        _EASYOCR_READER = reader
     return _EASYOCR_READER
 
 
@@ -86,71 +113,182 @@ _DIGIT_SUBS = {
 
 
 # Image helpers: crop, grid removal, preprocessing and blank-row detection.
+# The page is decoded once into an RGB array plus its grayscale; cells are
+# slices of those arrays, and PIL only appears at the OCR engine boundary.
+
+def _decode_rgb(image_bytes: bytes) -> np.ndarray:
+    """Decode an upload (honouring EXIF orientation) into an RGB uint8 array."""
+    with Image.open(io.BytesIO(image_bytes)) as pil_img:
+        return np.asarray(ImageOps.exif_transpose(pil_img).convert("RGB"))
+
+
+def _to_gray(img: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if img.ndim == 3 else img
+
+
+def _prepare_page(rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, PageGeometry, Tuple[np.ndarray, float]]:
+    """Orient and deskew a decoded page; returns (rgb, gray, page, analysis).
+
+    Upside-down and sideways pages are turned upright first (see
+    app.ocr.orientation).
+
+    In "crops" mode rgb and gray are the photo as taken and `page` carries the
+    skew, so every region is read through page.crop. In "warp" mode both are
+    already deskewed and page.angle is 0. `analysis` is the downscaled,
+    deskewed copy used for layout analysis (see analysis_copy).
+    """
+    if DESKEW_MODE == "warp":
+        rgb = normalize_document(rgb)
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        small, scale = analysis_copy(gray)
+        turns = detect_orientation(small) if ORIENTATION_MODE != "off" else 0
+        if turns:
+            timing.count("pages_turned")
+            rgb, gray, small = (np.rot90(a, turns) for a in (rgb, gray, small))
+        h, w = gray.shape
+        return rgb, gray, PageGeometry(w, h), (small, scale)
+
+    rgb = to_portrait(rgb)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    h, w = gray.shape
+    small, scale = analysis_copy(gray)
+    page = PageGeometry(w, h, estimate_skew(small))
+    analysis = page.warp(small, scale)
+    # Quarter turns and the deskew rotation share a centre, so the skew
+    # measured before turning still applies afterwards.
+    turns = detect_orientation(analysis) if ORIENTATION_MODE != "off" else 0
+    if turns:
+        timing.count("pages_turned")
+        rgb, gray, small = (np.rot90(a, turns) for a in (rgb, gray, small))
+        h, w = gray.shape
+        page = PageGeometry(w, h, page.angle)
+        analysis = page.warp(small, scale)
+    return rgb, gray, page, (analysis, scale)
+
+
+def _cell_slices(
+    shape: Tuple[int, ...],
+    x1: int, y1: int,
+    x2: int, y2: int,
+    pad: int = 3,
+) -> Tuple[slice, slice]:
+    """(rows, cols) of a cell with a small outer pad, clamped to an array of `shape`."""
+    img_h, img_w = shape[:2]
+    return slice(max(0, y1 - pad), min(img_h, y2 + pad)), slice(max(0, x1 - pad), min(img_w, x2 + pad))
+
 
 def _crop_cell(
-    pil_img: Image.Image,
+    img: np.ndarray,
     x1: int, y1: int,
     x2: int, y2: int,
     pad: int = 3,
-) -> Image.Image:
-    """Crop a cell with a small outer pad to avoid clipping ink at the edge."""
-    img_w, img_h = pil_img.size
-    return pil_img.crop((
-        max(0, x1 - pad),
-        max(0, y1 - pad),
-        min(img_w, x2 + pad),
-        min(img_h, y2 + pad),
-    ))
-
-
-def remove_grid_lines(pil_img: Image.Image) -> Image.Image:
-    """Erase the printed grid with morphological opening; returns grayscale PIL."""
-    cv_img = cv2.cvtColor(np.array(pil_img.convert("RGB")), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-    h, w = gray.shape
+) -> np.ndarray:
+    """Slice a cell with a small outer pad to avoid clipping ink at the edge (no copy)."""
+    return img[_cell_slices(img.shape, x1, y1, x2, y2, pad)]
+
+
+def _grid_line_mask(
+    analysis: Tuple[np.ndarray, float],
+    size: Tuple[int, int],
+    y1: int = 0,
+    y2: Optional[int] = None,
+) -> np.ndarray:
+    """Printed rules found on the analysis copy, as a mask of page rows [y1, y2).
+
+    `size` is the page's (w, h). The big-kernel openings run on the matching
+    rows of the downscaled copy. The vertical one gets two kernel heights of
+    context either side, enough for its result on those rows to match a run
+    over the whole copy. Only upsampling the finished mask touches
+    full-resolution pixels.
+    """
+    small, scale = analysis
+    sh, sw = small.shape
+    w, h = size
+    y2 = h if y2 is None else y2
+    kw = max(sw // 6, round(50 * scale))
+    kh = max(sh // 10, round(30 * scale))
+
+    fy = sh / h
+    s1 = max(0, int(y1 * fy) - 1)
+    s2 = min(sh, int(np.ceil(y2 * fy)) + 1)
+    c1 = max(0, s1 - 2 * kh)
+    c2 = min(sh, s2 + 2 * kh)
 
     # Invert so ink/lines are foreground for MORPH_OPEN.
-    inv = cv2.bitwise_not(gray)
+    inv_small = cv2.bitwise_not(small[c1:c2])
 
-    kw = max(w // 6, 50)
     horiz_k = cv2.getStructuringElement(cv2.MORPH_RECT, (kw, 1))
-    horiz_lines = cv2.morphologyEx(inv, cv2.MORPH_OPEN, horiz_k, iterations=2)
+    horiz_lines = cv2.morphologyEx(inv_small[s1 - c1:s2 - c1], cv2.MORPH_OPEN, horiz_k, iterations=2)
     horiz_lines = cv2.dilate(horiz_lines,
                              cv2.getStructuringElement(cv2.MORPH_RECT, (1, 3)))
 
-    kh = max(h // 10, 30)
     vert_k = cv2.getStructuringElement(cv2.MORPH_RECT, (1, kh))
-    vert_lines = cv2.morphologyEx(inv, cv2.MORPH_OPEN, vert_k, iterations=2)
+    vert_lines = cv2.morphologyEx(inv_small, cv2.MORPH_OPEN, vert_k, iterations=2)
     vert_lines = cv2.dilate(vert_lines,
                             cv2.getStructuringElement(cv2.MORPH_RECT, (3, 1)))
 
-    line_mask = cv2.add(horiz_lines, vert_lines)
-    cleaned_inv = cv2.subtract(inv, line_mask)
-    cleaned = cv2.bitwise_not(cleaned_inv)
-    return Image.fromarray(cleaned)
+    if scale == 1.0:
+        return cv2.add(horiz_lines, vert_lines[s1 - c1:s2 - c1])[y1 - s1:y2 - s1]
+    # Upsampling the whole (mostly empty) small mask keeps cv2.resize's pixel
+    # alignment and is still far cheaper than any full-resolution morphology.
+    line_mask = np.zeros_like(small)
+    cv2.add(horiz_lines, vert_lines[s1 - c1:s2 - c1], dst=line_mask[s1:s2])
+    return cv2.resize(line_mask, (w, h), interpolation=cv2.INTER_LINEAR)[y1:y2]
+
+
+def remove_grid_lines(
+    gray: np.ndarray,
+    analysis: Optional[Tuple[np.ndarray, float]] = None,
+    line_mask: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Erase the printed grid from a grayscale page (or region) with morphological opening.
+
+    The rules are found on `analysis`, the downscaled (copy, scale) pair from
+    `analysis_copy`, and subtracted from `gray` at full resolution. A caller
+    cleaning only part of the page passes the matching slice of
+    `_grid_line_mask` as `line_mask` instead.
+    """
+    if line_mask is None:
+        h, w = gray.shape
+        line_mask = _grid_line_mask(analysis if analysis is not None else analysis_copy(gray), (w, h))
 
+    # Reuse the buffer in place: the page-sized temporaries dominate peak memory.
+    inv = cv2.bitwise_not(gray)
+    cleaned_inv = cv2.subtract(inv, line_mask, dst=inv)
+    return cv2.bitwise_not(cleaned_inv, dst=cleaned_inv)
 
-def preprocess_cell_for_trocr(pil_img: Image.Image) -> Image.Image:
-    """Binarise, denoise, pad and RGB-convert a cell crop for TrOCR."""
-    cv_img = cv2.cvtColor(np.array(pil_img.convert("RGB")), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-    h, w = gray.shape
 
+def _binarize_for_trocr(gray: np.ndarray, cell_h: int) -> np.ndarray:
+    """Adaptive threshold plus a 2x2 opening, with the block size for cells `cell_h` tall.
+
+    Works on a single cell or on a whole region of equal-height cells, so a
+    column of crops can be binarised in one call and then sliced.
+    """
     binary = cv2.adaptiveThreshold(
         gray, 255,
         cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
         cv2.THRESH_BINARY,
-        blockSize=max(h // 2 | 1, 11),
+        blockSize=max(cell_h // 2 | 1, 11),
         C=12,
     )
 
     noise_k = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-    clean = cv2.morphologyEx(binary, cv2.MORPH_OPEN, noise_k, iterations=1)
-    clean = cv2.copyMakeBorder(clean, 8, 8, 16, 16, cv2.BORDER_CONSTANT, value=255)
-    return Image.fromarray(clean).convert("RGB")
+    return cv2.morphologyEx(binary, cv2.MORPH_OPEN, noise_k, iterations=1)
+
+
+def _pad_for_trocr(binary: np.ndarray) -> np.ndarray:
+    return cv2.copyMakeBorder(binary, 8, 8, 16, 16, cv2.BORDER_CONSTANT, value=255)
 
 
-def _resize_for_trocr(pil_img: Image.Image) -> Image.Image:
+def preprocess_cell_for_trocr(cell: np.ndarray) -> np.ndarray:
+    """Binarise, denoise and pad a cell crop for TrOCR; returns a grayscale array."""
+    gray = _to_gray(cell)
+    return _pad_for_trocr(_binarize_for_trocr(gray, gray.shape[0]))
+
+
+def _resize_for_trocr(cell: np.ndarray) -> Image.Image:
+    """Scale a preprocessed cell to TrOCR's line height; this is where PIL takes over."""
+    pil_img = Image.fromarray(cell).convert("RGB")
     w, h = pil_img.size
     if h == 0:
         return pil_img
@@ -159,9 +297,23 @@ def _resize_for_trocr(pil_img: Image.Image) -> Image.Image:
     return pil_img.resize((new_w, TARGET_H), Image.LANCZOS)
 
 
-def _has_ink(pil_img: Image.Image, dark_thresh: int = 180, min_ratio: float = 0.005) -> bool:
+# EasyOCR's recogniser reads text lines 64 px tall and resizes every box to
+# that height itself, so enlarging a cell already that tall only costs time.
+_EASYOCR_LINE_H = 64
+
+
+def _upscale_for_easyocr(cell: np.ndarray) -> np.ndarray:
+    """Double a numeric cell's resolution for EasyOCR (Lanczos, as PIL does it)
+    unless it is already at least EasyOCR's line height."""
+    if cell.shape[0] >= _EASYOCR_LINE_H:
+        return cell
+    pil_img = Image.fromarray(cell)
+    return np.asarray(pil_img.resize((pil_img.width * 2, pil_img.height * 2), Image.LANCZOS))
+
+
+def _has_ink(cell: np.ndarray, dark_thresh: int = 180, min_ratio: float = 0.005) -> bool:
     """Coarse dark-pixel ratio check; used for quantity/amount (too small for component analysis)."""
-    gray = np.array(pil_img.convert("L"))
+    gray = _to_gray(cell)
     if gray.size == 0:
         return False
     dark_pixels = np.count_nonzero(gray < dark_thresh)
@@ -169,7 +321,7 @@ def _has_ink(pil_img: Image.Image, dark_thresh: int = 180, min_ratio: float = 0.
 
 
 def _has_written_content(
-    pil_img: Image.Image,
+    cell: np.ndarray,
     *,
     dark_thresh: int = 180,
     min_tall_components: int = 3,
@@ -181,7 +333,7 @@ def _has_written_content(
     Requires several tall components AND at least one below the top third - that
     eliminates descender-leakage false positives from the row above.
     """
-    gray = np.array(pil_img.convert("L"))
+    gray = _to_gray(cell)
     if gray.size == 0:
         return False
     row_h = gray.shape[0]
@@ -203,59 +355,228 @@ def _has_written_content(
     return tall >= min_tall_components and below_top >= 1
 
 
+# Columns of the occupancy matrix returned by _table_occupancy.
+OCCUPANCY_COLUMNS = ("description", "quantity", "amount")
+
+
+def _row_pad(y_top: int, y_bot: int) -> int:
+    """Vertical pad for numeric cells, as a fraction of row height so it adapts to scan density."""
+    return max(4, int((y_bot - y_top) * 0.10))
+
+
+def _table_occupancy(
+    cleaned: np.ndarray,
+    row_pairs: List[Tuple[int, int]],
+    col_bounds: Dict[str, Tuple[int, int]],
+    *,
+    pad: int = 3,
+    dark_thresh: int = 180,
+    min_ink_ratio: float = 0.005,
+    min_tall_components: int = 2,
+    min_vertical_ratio: float = 0.22,
+    min_area: int = 25,
+) -> np.ndarray:
+    """Which table cells hold ink: a bool matrix of rows x OCCUPANCY_COLUMNS.
+
+    One pass over the grid-free table band replaces the per-cell
+    `_has_written_content` / `_has_ink` calls:
+
+    - Quantity and amount cells use the dark-pixel ratio of the same padded
+      windows the OCR crops use, read off one integral image.
+    - The same integral rules out description cells with too few dark pixels
+      to hold `min_tall_components` components.
+    - Connected components are labelled once over the remaining span of the
+      description column, binned into rows by centroid, and judged with the
+      tall-component rules of `_has_written_content`. A few pixel rows around
+      every separator are cleared first, so a stroke that crosses a rule
+      splits at it, as it would in per-row crops.
+    """
+    n_rows = len(row_pairs)
+    occupied = np.zeros((n_rows, len(OCCUPANCY_COLUMNS)), dtype=bool)
+    if not row_pairs:
+        return occupied
+    h, w = cleaned.shape[:2]
+    tops = np.array([y_top for y_top, _ in row_pairs])
+    bots = np.array([y_bot for _, y_bot in row_pairs])
+    row_pads = np.array([_row_pad(y_top, y_bot) for y_top, y_bot in row_pairs])
+    usable = (bots - tops) >= 8
+
+    band_y1 = max(0, int((tops - row_pads).min()) - pad)
+    band_y2 = min(h, int((bots + row_pads).max()) + pad)
+    dark = (cleaned[band_y1:band_y2] < dark_thresh).astype(np.uint8)
+    integral = cv2.integral(dark)
+
+    def window_ink(y1: np.ndarray, y2: np.ndarray, x1: int, x2: int) -> Tuple[np.ndarray, np.ndarray]:
+        x1, x2 = max(0, x1 - pad), min(w, x2 + pad)
+        y1 = np.clip(y1 - pad, 0, h) - band_y1
+        y2 = np.clip(y2 + pad, 0, h) - band_y1
+        ink = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        return ink, np.maximum(1, (y2 - y1) * (x2 - x1))
+
+    up_x1, _ = col_bounds["unit_price"]
+    _, am_x2 = col_bounds["amount"]
+    for col, (x1, x2) in ((1, col_bounds["quantity"]), (2, (up_x1, am_x2))):
+        ink, area = window_ink(tops - row_pads, bots + row_pads, x1, x2)
+        occupied[:, col] = usable & (ink / area > min_ink_ratio)
+
+    desc_x1, desc_x2 = col_bounds["description"]
+    desc_ink, _ = window_ink(tops, bots, desc_x1, desc_x2)
+    candidates = np.flatnonzero(usable & (desc_ink >= min_tall_components * min_area))
+    if not len(candidates):
+        return occupied
+
+    # Label only the span of candidate rows, then bin components by centroid.
+    span_y1 = max(0, int(tops[candidates[0]]) - pad - band_y1)
+    span_y2 = min(dark.shape[0], int(bots[candidates[-1]]) + pad - band_y1)
+    strip = dark[span_y1:span_y2, max(0, desc_x1 - pad):min(w, desc_x2 + pad)].copy()
+    offset = band_y1 + span_y1
+    for y in set(tops.tolist()) | set(bots.tolist()):
+        strip[max(0, y - offset - 2):max(0, y - offset + 3), :] = 0
+    eroded = cv2.erode(strip, np.ones((2, 2), np.uint8), iterations=1)
+    # BBDT labels the same components as the default algorithm, about twice
+    # as fast on this sparse strip.
+    _, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(
+        eroded, 8, cv2.CV_32S, cv2.CCL_BBDT,
+    )
+    stats, cy = stats[1:], centroids[1:, 1] + offset
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    stats, cy = stats[keep], cy[keep]
+    row_of = np.searchsorted(bots, cy, side="right")
+    in_table = (row_of < n_rows) & (cy >= tops[np.minimum(row_of, n_rows - 1)])
+    stats, cy, row_of = stats[in_table], cy[in_table], row_of[in_table]
+    crop_top = tops[row_of] - pad
+    crop_h = (bots[row_of] + pad) - crop_top
+    tall = stats[:, cv2.CC_STAT_HEIGHT] >= crop_h * min_vertical_ratio
+    below_top = tall & (cy - crop_top > crop_h * 0.33)
+    n_tall = np.bincount(row_of[tall], minlength=n_rows)
+    n_below = np.bincount(row_of[below_top], minlength=n_rows)
+    is_candidate = np.zeros(n_rows, dtype=bool)
+    is_candidate[candidates] = True
+    occupied[:, 0] = is_candidate & (n_tall >= min_tall_components) & (n_below >= 1)
+    return occupied
+
+
 # OCR helpers: TrOCR with and without confidence, Tesseract and EasyOCR wrappers,
 # and the amount-cell post-processor that handles column-overflow cases.
 
-def _trocr_cell(pil_img: Image.Image, processor, model, max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
-    preprocessed = preprocess_cell_for_trocr(pil_img)
+def _trocr_cell(cell: np.ndarray, processor, model, max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+    preprocessed = preprocess_cell_for_trocr(cell)
     resized = _resize_for_trocr(preprocessed)
     return _ocr_with(processor, model, resized, max_new_tokens=max_tokens)
 
 
-def _trocr_cell_with_confidence(pil_img: Image.Image, processor, model, max_tokens: int = DEFAULT_MAX_TOKENS):
+def _trocr_cells_with_confidence(
+    cells: List[np.ndarray],
+    processor,
+    model,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    preprocessed: bool = False,
+    engine: str = "trocr",
+) -> List[Tuple[str, float]]:
+    """Batched `_trocr_cell`: one generate pass for every crop, each with a 0-1
+    confidence from its avg token log-prob.
+
+    Pass `preprocessed=True` when the cells already went through
+    preprocess_cell_for_trocr (or were sliced from a region binarised once).
+    With micro-batching on, the crops join the shared queue instead so they
+    can be decoded together with crops from concurrent uploads. `engine` is
+    the name the time is charged to in the timings.
+    """
+    if not cells:
+        return []
+    timing.count("trocr_crops", len(cells))
+    with timing.engine(engine):
+        prepared = [
+            _resize_for_trocr(cell if preprocessed else preprocess_cell_for_trocr(cell))
+            for cell in cells
+        ]
+        batcher = get_trocr_batcher()
+        if batcher is not None:
+            futures = batcher.submit((processor, model, max_tokens), prepared)
+            return [fut.result() for fut in futures]
+        return _ocr_batch_with_confidence(processor, model, prepared, max_new_tokens=max_tokens)
+
+
+def _trocr_cell_with_confidence(cell: np.ndarray, processor, model, max_tokens: int = DEFAULT_MAX_TOKENS):
     """Like `_trocr_cell` but also returns a 0-1 confidence from avg token log-prob."""
-    import torch
-    preprocessed = preprocess_cell_for_trocr(pil_img)
-    resized = _resize_for_trocr(preprocessed)
-    pil_rgb = _ensure_pil_rgb(resized)
-    pixel_values = processor(images=pil_rgb, return_tensors="pt").pixel_values
-
-    with torch.no_grad():
-        outputs = model.generate(
-            pixel_values,
-            max_new_tokens=max_tokens,
-            output_scores=True,
-            return_dict_in_generate=True,
-        )
-
-    text = processor.batch_decode(outputs.sequences, skip_special_tokens=True)[0].strip()
+    return _trocr_cells_with_confidence([cell], processor, model, max_tokens)[0]
+
+
+def _trocr_cascade(
+    cells: List[np.ndarray],
+    processor,
+    model,
+    small: Tuple[Any, Any],
+    threshold: float = TROCR_CASCADE_THRESHOLD,
+) -> List[Tuple[str, float]]:
+    """Read preprocessed crops with the small (processor, model) pair first and
+    read again with the main model only those it is less than `threshold` sure of."""
+    reads = _trocr_cells_with_confidence(cells, *small, preprocessed=True, engine="trocr_cascade")
+    doubtful = [i for i, (_, conf) in enumerate(reads) if conf < threshold]
+    timing.count("trocr_escalated", len(doubtful))
+    rereads = _trocr_cells_with_confidence([cells[i] for i in doubtful], processor, model, preprocessed=True)
+    for i, read in zip(doubtful, rereads):
+        reads[i] = read
+    return reads
+
+
+def _tesseract_region(region: np.ndarray, psm: int = 6) -> str:
+    with timing.engine("tesseract"):
+        return tesseract_engine.image_to_string(region, psm).strip()
+
+
+def _easyocr_read(region: np.ndarray) -> str:
+    """Full EasyOCR read (detection + recognition) of an RGB region."""
+    reader = _get_easyocr()
+    arr = np.ascontiguousarray(region)
+    with timing.engine("easyocr"):
+        results = reader.readtext(arr, detail=0, paragraph=False)
+    return " ".join(results).strip()
 
-    if outputs.scores:
-        log_probs = []
-        for i, score in enumerate(outputs.scores):
-            probs = torch.softmax(score, dim=-1)
-            # +1 because position 0 of sequences is the BOS token.
-            token_id = outputs.sequences[0, i + 1]
-            log_probs.append(torch.log(probs[0, token_id]).item())
-        avg_log_prob = sum(log_probs) / len(log_probs) if log_probs else -10.0
-        confidence = max(0.0, min(1.0, 1.0 + avg_log_prob / 5.0))
-    else:
-        confidence = 0.0
 
-    return text, confidence
+# Blank rows between stacked cells so no recognizer box picks up its neighbour.
+_EASYOCR_STACK_GAP = 8
 
 
-def _tesseract_region(pil_img: Image.Image, psm: int = 6) -> str:
-    return pytesseract.image_to_string(
-        pil_img, config=f"--psm {psm} --oem 3"
-    ).strip()
+def _easyocr_recognize_cells(cells: List[np.ndarray]) -> List[str]:
+    """Read tightly-cropped single-line cells with EasyOCR's recognizer only.
 
+    The column bounds already locate the text, so CRAFT detection (most of
+    readtext's cost) is skipped: the crops are stacked on one greyscale canvas
+    and handed to `recognize` as known boxes in a single call.
+    """
+    if not cells:
+        return []
+    greys = [_to_gray(cell) for cell in cells]
+    width = max(g.shape[1] for g in greys)
+    height = sum(g.shape[0] for g in greys) + _EASYOCR_STACK_GAP * (len(greys) - 1)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+
+    boxes: List[List[int]] = []
+    box_index: Dict[int, int] = {}
+    y = 0
+    for idx, grey in enumerate(greys):
+        gh, gw = grey.shape
+        canvas[y:y + gh, :gw] = grey
+        boxes.append([0, gw, y, y + gh])
+        box_index[y] = idx
+        y += gh + _EASYOCR_STACK_GAP
 
-def _easyocr_read(pil_img: Image.Image) -> str:
     reader = _get_easyocr()
-    arr = np.array(pil_img.convert("RGB"))
-    results = reader.readtext(arr, detail=0, paragraph=False)
-    return " ".join(results).strip()
+    timing.count("easyocr_cells", len(boxes))
+    with timing.engine("easyocr"):
+        results = reader.recognize(
+            canvas, horizontal_list=boxes, free_list=[],
+            detail=1, paragraph=False, batch_size=len(boxes),
+        )
+    # Map each read back to its crop by the top edge of its box rather than
+    # trusting the output order.
+    texts = [""] * len(greys)
+    for box, text, _conf in results:
+        idx = box_index.get(int(box[0][1]))
+        if idx is not None:
+            texts[idx] = text.strip()
+    return texts
 
 
 def _parse_amount_easyocr(raw: str) -> str:
@@ -284,100 +605,364 @@ def _parse_amount_easyocr(raw: str) -> str:
     return f"{all_digits}.00"
 
 
+def _parse_footer_amount(raw: str) -> str:
+    """Turn a raw TrOCR read of a handwritten footer box into "pounds.pence"."""
+    groups = re.findall(r"\d+", raw)
+    if not groups:
+        return ""
+    significant = [g for g in groups if len(g) >= 2]
+    if not significant:
+        return ""
+    main = max(significant, key=len)
+    # A leading "1" on 4+ digit reads is usually the box border.
+    if len(main) >= 4 and main[0] == "1":
+        main = main[1:]
+    idx = groups.index(max(groups, key=len))
+    pence_after = [g for g in groups[idx + 1:] if len(g) == 2]
+    pence = pence_after[0] if pence_after else "00"
+    return f"{main}.{pence}"
+
+
+def warm_up() -> Dict[str, float]:
+    """Load TrOCR, EasyOCR and Tesseract and read one synthetic cell with each.
+
+    Loading alone leaves torch's first-call allocations and kernel selection,
+    and EasyOCR's detector, to the first upload. Returns seconds per engine;
+    raises if an engine cannot be loaded or run.
+    """
+    cell = np.full((TARGET_H, 4 * TARGET_H, 3), 255, dtype=np.uint8)
+    cv2.putText(cell, "12.50", (8, TARGET_H - 16), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 3)
+    seconds: Dict[str, float] = {}
+
+    t0 = time.perf_counter()
+    processor, model = _load_handwritten()
+    _trocr_cells_with_confidence([cell], processor, model)
+    seconds["trocr"] = time.perf_counter() - t0
+
+    cascade = get_cascade_registry()
+    if cascade is not None:
+        t0 = time.perf_counter()
+        _trocr_cells_with_confidence([cell], *cascade.models())
+        seconds["trocr_cascade"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    _easyocr_read(cell)
+    _easyocr_recognize_cells([cell])
+    seconds["easyocr"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    tesseract_engine.get_tesseract()
+    _tesseract_region(cell)
+    seconds["tesseract"] = time.perf_counter() - t0
+    return seconds
+
+
 # Public entry point called by the upload endpoint.
 
 def process_receipt(image_bytes: bytes) -> Dict[str, Any]:
-    """Run the AGW OCR pipeline on one image and return the structured fields."""
-    pil_img = Image.open(io.BytesIO(image_bytes))
-    pil_img = ImageOps.exif_transpose(pil_img).convert("RGB")
-    pil_img = normalize_document(pil_img)
+    """Run the AGW OCR pipeline on one image and return the structured fields.
 
-    cv_img = _pil_to_cv_bgr(pil_img)
-    h, w = cv_img.shape[:2]
+    Raises PreflightRejected for a dark, blank or blurry page when
+    OCR_PREFLIGHT is "reject"; otherwise the checks' outcome is under
+    "preflight". The result also carries a "timings" dict (see app.ocr.timing) with wall
+    time per step and per engine; the upload moves it under
+    extracted_data["ocr"]["timings"].
+    """
+    with timing.collect() as timer:
+        result = _read_receipt(image_bytes)
+    result["timings"] = timer.as_dict()
+    return result
+
+
+def _read_receipt(image_bytes: bytes) -> Dict[str, Any]:
+    rgb = _decode_rgb(image_bytes)
+    timing.split("decode")
+    # Rules and regions are found on one downscaled, deskewed copy of the
+    # page; full-resolution pixels are only read through page.crop.
+    rgb, gray, page, analysis = _prepare_page(rgb)
+    timing.split("normalize_document")
+
+    # Blurry, dark or blank pages stop here, before any model; sideways or
+    # non-AGW pages are only flagged.
+    preflight = None
+    if PREFLIGHT_MODE != "off":
+        preflight = check_page(analysis[0])
+        timing.split("preflight")
+        if preflight["reject"] and PREFLIGHT_MODE == "reject":
+            raise PreflightRejected(preflight["reasons"])
 
-    regions = detect_regions(cv_img)
-    col_bounds = get_column_bounds(w)
+    h, w = gray.shape
+    regions = detect_regions(gray, analysis)
+    col_bounds = get_column_bounds(w, regions.get("column_xs"))
+    timing.split("detect_regions")
 
     header_end_y = regions["header_end_y"]
     table_end_y = regions["table_end_y"]
     row_ys = regions["row_ys"]
 
-    processor, model = _load_handwritten()
-
-    # Letterhead printed text (address, VAT, phone) - PSM 3 handles mixed layouts.
-    top_header_img = pil_img.crop((0, 0, w, int(header_end_y * TEMPLATE.top_header_bottom_pct)))
-    header_text = _tesseract_region(top_header_img, psm=3)
-
-    # Invoice number is red on pink carbonless: Tesseract loses the red channel,
-    # EasyOCR's CTC model keeps it.
-    inv_no_img = pil_img.crop((
-        int(w * TEMPLATE.inv_no_x_start), 0,
-        int(w * TEMPLATE.inv_no_x_end), int(header_end_y * TEMPLATE.inv_no_y_end_pct),
-    ))
-    inv_no_text = _easyocr_read(inv_no_img)
+    # Everything below only needs the regions, so the reads run as a small
+    # dependency graph (see app.ocr.stages) and the engines overlap.
+
+    def read_letterhead() -> str:
+        # Letterhead printed text (address, VAT, phone) - PSM 3 handles mixed layouts.
+        top_header_img = page.crop(rgb, 0, 0, w, int(header_end_y * TEMPLATE.top_header_bottom_pct))
+        return _tesseract_region(top_header_img, psm=3)
+
+    def read_invoice_no() -> str:
+        # Invoice number is red on pink carbonless: Tesseract loses the red channel,
+        # EasyOCR's CTC model keeps it.
+        inv_no_img = page.crop(
+            rgb,
+            int(w * TEMPLATE.inv_no_x_start), 0,
+            int(w * TEMPLATE.inv_no_x_end), int(header_end_y * TEMPLATE.inv_no_y_end_pct),
+        )
+        return _easyocr_read(inv_no_img)
 
     # Customer name crop excludes the "INVOICE TO:" label to the left; EasyOCR
-    # first (stronger on short printed-style names), TrOCR as cursive fallback.
-    name_img = pil_img.crop((
-        int(w * TEMPLATE.name_x_start_pct),
-        int(header_end_y * TEMPLATE.name_y_start_pct),
-        int(w * TEMPLATE.name_x_end_pct),
-        int(header_end_y * TEMPLATE.name_y_end_pct),
-    ))
-    cust_name = _easyocr_read(name_img)
-    if not cust_name:
-        cust_name = _trocr_cell(name_img, processor, model)
+    # first (stronger on short printed-style names), TrOCR as cursive fallback
+    # in the page-wide batch below.
+    name_img = page.crop(
+        rgb,
+        int(w * TEMPLATE.name_x_start_pct), int(header_end_y * TEMPLATE.name_y_start_pct),
+        int(w * TEMPLATE.name_x_end_pct), int(header_end_y * TEMPLATE.name_y_end_pct),
+    )
+
+    def read_date() -> str:
+        # Invoice date: EasyOCR handles slash separators better than TrOCR here.
+        date_img = page.crop(
+            rgb,
+            int(w * TEMPLATE.date_x_start_pct), int(header_end_y * TEMPLATE.date_y_start_pct),
+            int(w * TEMPLATE.date_x_end_pct), int(header_end_y * TEMPLATE.date_y_end_pct),
+        )
+        if _has_written_content(_to_gray(date_img), min_tall_components=2):
+            return _easyocr_read(date_img)
+        return ""
 
+    def crop_table() -> Dict[str, Any]:
+        page_rows: List[Tuple[int, int]] = [
+            (row_ys[i], row_ys[i + 1]) for i in range(min(len(row_ys) - 1, MAX_TABLE_ROWS))
+        ]
+        if row_ys and len(page_rows) < MAX_TABLE_ROWS:
+            page_rows.append((row_ys[min(len(row_ys) - 1, MAX_TABLE_ROWS)], table_end_y))
+
+        # Strip the grid once for the whole table band (plus the widest cell pad)
+        # - more reliable than per-cell. The letterhead is never cleaned, and in
+        # "crops" mode the band is the only large region resampled from the photo.
+        # line_mask covers the band and everything below it, for the footer.
+        band_pad = max([3] + [_row_pad(y_top, y_bot) for y_top, y_bot in page_rows])
+        band_y1 = max(0, min((y_top for y_top, _ in page_rows), default=table_end_y) - band_pad)
+        band_y2 = min(h, max((y_bot for _, y_bot in page_rows), default=table_end_y) + band_pad)
+        line_mask = _grid_line_mask(analysis, (w, h), band_y1)
+        table = remove_grid_lines(page.crop(gray, 0, band_y1, w, band_y2), line_mask=line_mask[:band_y2 - band_y1])
+        band_h = table.shape[0]
+        # Row bounds from here on are in band coordinates.
+        row_pairs = [(y_top - band_y1, y_bot - band_y1) for y_top, y_bot in page_rows]
+
+        # Decide which cells hold ink in one pass over the table band - the
+        # description test uses connected components because dark-pixel ratio is
+        # fooled by descender leakage and line-removal residue.
+        occupied = _table_occupancy(table, row_pairs, col_bounds)
+        written_rows = np.flatnonzero(occupied[:, 0])
+        readable_rows = sum(1 for y_top, y_bot in row_pairs if y_bot - y_top >= 8)
+        timing.count("rows_blank", readable_rows - len(written_rows))
+
+        # First pass: crop every written row. Crops are only collected here so
+        # EasyOCR and TrOCR can each read the whole page in one batch.
+        pending_rows: List[Dict[str, Any]] = []
+        desc_rows: List[slice] = []
+        numeric_imgs: List[np.ndarray] = []
+        numeric_slots: List[Tuple[Dict[str, Any], str]] = []
+        desc_x1, desc_x2 = col_bounds["description"]
+        qty_x1, qty_x2 = col_bounds["quantity"]
+        up_x1, _ = col_bounds["unit_price"]
+        _, am_x2 = col_bounds["amount"]
+        for i in written_rows:
+            y_top, y_bot = row_pairs[i]
+
+            # Small left/right offsets skip the column rules that grid-removal
+            # occasionally leaves behind (otherwise read as leading "I" or trailing "#").
+            rows, desc_cols = _cell_slices(
+                table.shape,
+                desc_x1 + TEMPLATE.desc_left_offset_px,
+                y_top,
+                desc_x2 - TEMPLATE.desc_right_offset_px,
+                y_bot,
+            )
+            desc_rows.append(rows)
+
+            row_pad = _row_pad(y_top, y_bot)
+            row = {"row": int(i) + 1, "quantity": "", "amount": ""}
+
+            # EasyOCR handles isolated digits better than TrOCR; use the full
+            # quantity column width (row-number column is separate) so 2-digit
+            # values like "15" aren't split.
+            if occupied[i, 1]:
+                qty_img = _crop_cell(
+                    table, qty_x1,
+                    max(0, y_top - row_pad), qty_x2,
+                    min(band_h, y_bot + row_pad),
+                )
+                numeric_imgs.append(_upscale_for_easyocr(qty_img))
+                numeric_slots.append((row, "quantity"))
+
+            # Read unit_price and amount columns together because larger pounds
+            # values overflow the amount column; the parser anchors on the
+            # trailing 2-digit pence group to discard any unit_price noise.
+            if occupied[i, 2]:
+                amount_img = _crop_cell(
+                    table, up_x1,
+                    max(0, y_top - row_pad), am_x2,
+                    min(band_h, y_bot + row_pad),
+                )
+                numeric_imgs.append(_upscale_for_easyocr(amount_img))
+                numeric_slots.append((row, "amount"))
+
+            pending_rows.append(row)
+
+        # Binarise the description column once, from the first written row to the
+        # last, and hand TrOCR a slice of it per row instead of thresholding each
+        # crop. Blank rows outside that span are never thresholded.
+        desc_imgs: List[np.ndarray] = []
+        if desc_rows:
+            span_y1, span_y2 = desc_rows[0].start, desc_rows[-1].stop
+            cell_h = int(np.median([r.stop - r.start for r in desc_rows]))
+            desc_binary = _binarize_for_trocr(table[span_y1:span_y2, desc_cols], cell_h)
+            desc_imgs = [_pad_for_trocr(desc_binary[r.start - span_y1:r.stop - span_y1]) for r in desc_rows]
+        timing.count("rows_read", len(pending_rows))
+        return {
+            "line_mask": line_mask,
+            "band_y1": band_y1,
+            "pending_rows": pending_rows,
+            "numeric_imgs": numeric_imgs,
+            "numeric_slots": numeric_slots,
+            "desc_imgs": desc_imgs,
+        }
+
+    def read_cells(crops: Dict[str, Any]) -> None:
+        # Every qty/amount crop of the page goes through the recognizer together.
+        numeric_reads = _easyocr_recognize_cells(crops["numeric_imgs"])
+        for (row, field), raw in zip(crops["numeric_slots"], numeric_reads):
+            if field == "quantity":
+                corrected = "".join(_DIGIT_SUBS.get(c, c) for c in raw)
+                # Concatenate every digit run - 2-digit quantities are sometimes
+                # read with a gap between the digits.
+                row["quantity"] = "".join(re.findall(r"\d+", corrected))
+            else:
+                row["amount"] = _parse_amount_easyocr(raw)
+
+    def read_footer() -> str:
+        # Footer: NET TOTAL / VAT / AMOUNT DUE stacked in ~1/3 height each.
+        footer_img = page.crop(rgb, 0, table_end_y, w, h)
+        return _tesseract_region(footer_img, psm=6)
+
+    def crop_footer_boxes(crops: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        line_mask, band_y1 = crops["line_mask"], crops["band_y1"]
+        fh = h - table_end_y
+        totals_y1 = table_end_y + int(fh * TEMPLATE.footer_totals_top_pct)
+        totals_y2 = table_end_y + int(fh * TEMPLATE.footer_totals_bottom_pct)
+        totals_h = totals_y2 - totals_y1
+        row_h = totals_h // 3
+
+        fp_x1 = int(w * TEMPLATE.footer_label_end_pct)
+        fp_x2 = col_bounds["amount"][1]
+
+        # The three amount boxes are cleaned and binarised as one strip.
+        footer_clean = footer_binary = None
+        if row_h > 0 and fp_x1 < fp_x2 <= w:
+            strip_y2 = min(h, totals_y1 + 3 * row_h)
+            footer_clean = remove_grid_lines(
+                page.crop(gray, fp_x1, totals_y1, fp_x2, strip_y2),
+                line_mask=line_mask[totals_y1 - band_y1:strip_y2 - band_y1, fp_x1:fp_x2],
+            )
+            footer_binary = _binarize_for_trocr(footer_clean, row_h)
+
+        def _footer_amount_crop(row_idx: int) -> Optional[np.ndarray]:
+            fy1 = row_idx * row_h
+            fy2 = fy1 + row_h
+            if footer_clean is None or totals_y1 + fy2 > h:
+                return None
+            crop = footer_clean[fy1:fy2]
+            if crop.size == 0:
+                return None
+            if not _has_ink(crop):
+                return None
+            return _pad_for_trocr(footer_binary[fy1:fy2])
+
+        return {
+            key: crop
+            for key, crop in (
+                ("net_total", _footer_amount_crop(0)),
+                ("vat", _footer_amount_crop(1)),
+                ("amount_due", _footer_amount_crop(2)),
+            )
+            if crop is not None
+        }
+
+    def read_handwriting(crops, footer_crops, cust_name, models) -> List[Tuple[str, float]]:
+        # One TrOCR pass for the whole page: every description crop, the footer
+        # amount boxes and, when EasyOCR found nothing, the customer name.
+        (processor, model), small = models
+        batch_imgs: List[np.ndarray] = list(crops["desc_imgs"]) + list(footer_crops.values())
+        if not cust_name:
+            batch_imgs.append(preprocess_cell_for_trocr(name_img))
+        if small is not None:
+            return _trocr_cascade(batch_imgs, processor, model, small)
+        return _trocr_cells_with_confidence(batch_imgs, processor, model, preprocessed=True)
+
+    # Declaration order is also the priority among ready stages: the table
+    # crops and the customer name come first because TrOCR waits on them.
+    # The leases keep this page on one checkpoint if another is swapped in
+    # meanwhile (POST /admin/model).
+    cascade = get_cascade_registry()
+    with get_hw_registry().lease() as hw, (cascade.lease() if cascade else nullcontext()) as small_hw:
+        def load_models():
+            return hw.models(), small_hw.models() if small_hw is not None else None
+
+        stages = run_stages([
+            Stage("load_model", load_models),
+            Stage("table_crops", crop_table),
+            Stage("footer_crops", crop_footer_boxes, deps=("table_crops",)),
+            Stage("customer_name", lambda: _easyocr_read(name_img), engine="easyocr"),
+            Stage("header_ocr", read_letterhead, engine="tesseract"),
+            Stage("footer_ocr", read_footer, engine="tesseract"),
+            Stage("cell_ocr", read_cells, deps=("table_crops",), engine="easyocr"),
+            Stage("invoice_no", read_invoice_no, engine="easyocr"),
+            Stage("invoice_date", read_date, engine="easyocr"),
+            Stage(
+                "trocr", read_handwriting,
+                deps=("table_crops", "footer_crops", "customer_name", "load_model"),
+                engine="trocr",
+            ),
+        ])
+        model_id = handwritten_model_id(hw.name)
+        cascade_id = handwritten_model_id(small_hw.name) if small_hw is not None and small_hw.name else None
+    timing.split("stage_graph")
+
+    header_text = stages["header_ocr"]
+    inv_no_text = stages["invoice_no"]
+    cust_name = stages["customer_name"]
     # Phone line is almost always blank; skip the OCR call.
     cust_phone = ""
-    customer_txt = f"{cust_name}\n{cust_phone}"
-
-    # Invoice date: EasyOCR handles slash separators better than TrOCR here.
-    date_img = pil_img.crop((
-        int(w * TEMPLATE.date_x_start_pct),
-        int(header_end_y * TEMPLATE.date_y_start_pct),
-        int(w * TEMPLATE.date_x_end_pct),
-        int(header_end_y * TEMPLATE.date_y_end_pct),
-    ))
-    if _has_written_content(date_img, min_tall_components=2):
-        date_raw = _easyocr_read(date_img)
-    else:
-        date_raw = ""
+    date_raw = stages["invoice_date"]
+    pending_rows = stages["table_crops"]["pending_rows"]
+    footer_printed = stages["footer_ocr"]
+    footer_crops = stages["footer_crops"]
+
+    n_desc = len(stages["table_crops"]["desc_imgs"])
+    batch_reads = stages["trocr"]
+    desc_reads = batch_reads[:n_desc]
+    footer_reads = batch_reads[n_desc:n_desc + len(footer_crops)]
+    if not cust_name:
+        cust_name = batch_reads[-1][0]
 
+    customer_txt = f"{cust_name}\n{cust_phone}"
     header_fields = parse_header(header_text, inv_no_text, cust_name, cust_phone, date_raw)
 
-    # Strip the grid once on the full image - more reliable than per-cell.
-    cleaned_pil = remove_grid_lines(pil_img)
-    cleaned_rgb = cleaned_pil.convert("RGB")
-
-    row_pairs: List[Tuple[int, int]] = [
-        (row_ys[i], row_ys[i + 1]) for i in range(min(len(row_ys) - 1, MAX_TABLE_ROWS))
-    ]
-    if row_ys and len(row_pairs) < MAX_TABLE_ROWS:
-        row_pairs.append((row_ys[min(len(row_ys) - 1, MAX_TABLE_ROWS)], table_end_y))
-
     line_items: List[Dict[str, Any]] = []
-    for row_idx, (y_top, y_bot) in enumerate(row_pairs, start=1):
-        if y_bot - y_top < 8:
-            continue
-
-        # Blank-row filter on connected components - dark-pixel ratio is fooled
-        # by descender leakage and line-removal residue.
-        desc_x1, desc_x2 = col_bounds["description"]
-        desc_check_crop = _crop_cell(cleaned_rgb, desc_x1, y_top, desc_x2, y_bot)
-        if not _has_written_content(desc_check_crop, min_tall_components=2):
-            continue
+    for pending, (desc_raw, desc_conf) in zip(pending_rows, desc_reads):
+        qty_text = pending["quantity"]
+        amount_text = pending["amount"]
 
-        # Small left/right offsets skip the column rules that grid-removal
-        # occasionally leaves behind (otherwise read as leading "I" or trailing "#").
-        desc_img = _crop_cell(
-            cleaned_rgb,
-            desc_x1 + TEMPLATE.desc_left_offset_px,
-            y_top,
-            desc_x2 - TEMPLATE.desc_right_offset_px,
-            y_bot,
-        )
-        desc_raw, desc_conf = _trocr_cell_with_confidence(desc_img, processor, model)
         desc_text = re.sub(_LEADING_JUNK, '', desc_raw)
         desc_text = re.sub(_TRAILING_JUNK, '', desc_text).strip()
 
@@ -385,47 +970,6 @@ def process_receipt(image_bytes: bytes) -> Dict[str, Any]:
         if desc_conf < 0.15 and len(desc_text) < 5:
             desc_text = ""
 
-        # Vertical pad as a fraction of row height so it adapts to scan density.
-        row_pad = max(4, int((y_bot - y_top) * 0.10))
-
-        # EasyOCR handles isolated digits better than TrOCR; use the full
-        # quantity column width (row-number column is separate) so 2-digit
-        # values like "15" aren't split.
-        qty_x1, qty_x2 = col_bounds["quantity"]
-        qty_img = _crop_cell(
-            cleaned_rgb, qty_x1,
-            max(0, y_top - row_pad), qty_x2,
-            min(h, y_bot + row_pad),
-        )
-        qty_text = ""
-        if _has_ink(qty_img):
-            qty_up = qty_img.resize(
-                (qty_img.width * 2, qty_img.height * 2), Image.LANCZOS,
-            )
-            qty_raw = _easyocr_read(qty_up)
-            qty_corrected = "".join(_DIGIT_SUBS.get(c, c) for c in qty_raw)
-            # Concatenate every digit run - 2-digit quantities are often split
-            # into two boxes by EasyOCR.
-            qty_text = "".join(re.findall(r"\d+", qty_corrected))
-
-        # Read unit_price and amount columns together because larger pounds
-        # values overflow the amount column; the parser anchors on the
-        # trailing 2-digit pence group to discard any unit_price noise.
-        up_x1, _ = col_bounds["unit_price"]
-        _, am_x2 = col_bounds["amount"]
-        amount_img = _crop_cell(
-            cleaned_rgb, up_x1,
-            max(0, y_top - row_pad), am_x2,
-            min(h, y_bot + row_pad),
-        )
-        amount_text = ""
-        if _has_ink(amount_img):
-            amount_up = amount_img.resize(
-                (amount_img.width * 2, amount_img.height * 2), Image.LANCZOS,
-            )
-            amount_raw = _easyocr_read(amount_up)
-            amount_text = _parse_amount_easyocr(amount_raw)
-
         # Writers often run the quantity into the description column.
         if not qty_text and desc_text:
             m = re.match(r"^([0-9]{1,3})[ ,]+(\S.*)$", desc_text)
@@ -446,7 +990,7 @@ def process_receipt(image_bytes: bytes) -> Dict[str, Any]:
             continue
 
         line_items.append({
-            "row":         row_idx,
+            "row":         pending["row"],
             "quantity":    qty_text,
             "description": desc_text,
             "unit_price":  "",
@@ -464,57 +1008,13 @@ def process_receipt(image_bytes: bytes) -> Dict[str, Any]:
             cutoff = last_amount_idx + 2
             line_items = line_items[:cutoff]
 
-    # Footer: NET TOTAL / VAT / AMOUNT DUE stacked in ~1/3 height each.
-    footer_img = pil_img.crop((0, table_end_y, w, h))
-    footer_printed = _tesseract_region(footer_img, psm=6)
-
-    fh = h - table_end_y
-    totals_y1 = table_end_y + int(fh * TEMPLATE.footer_totals_top_pct)
-    totals_y2 = table_end_y + int(fh * TEMPLATE.footer_totals_bottom_pct)
-    totals_h = totals_y2 - totals_y1
-    row_h = totals_h // 3
-
-    fp_x1 = int(w * TEMPLATE.footer_label_end_pct)
-    fp_x2 = col_bounds["amount"][1]
-
-    def _footer_amount(row_idx: int) -> str:
-        fy1 = totals_y1 + row_idx * row_h
-        fy2 = fy1 + row_h
-        if fy1 >= fy2 or fp_x1 >= fp_x2 or fy2 > h or fp_x2 > w:
-            return ""
-        crop = cleaned_rgb.crop((fp_x1, fy1, fp_x2, fy2))
-        if crop.size[0] == 0 or crop.size[1] == 0:
-            return ""
-        if not _has_ink(crop):
-            return ""
-        raw = _trocr_cell(crop, processor, model)
-        groups = re.findall(r"\d+", raw)
-        if not groups:
-            return ""
-        significant = [g for g in groups if len(g) >= 2]
-        if not significant:
-            return ""
-        main = max(significant, key=len)
-        # A leading "1" on 4+ digit reads is usually the box border.
-        if len(main) >= 4 and main[0] == "1":
-            main = main[1:]
-        idx = groups.index(max(groups, key=len))
-        pence_after = [g for g in groups[idx + 1:] if len(g) == 2]
-        pence = pence_after[0] if pence_after else "00"
-        return f"{main}.{pence}"
-
     # Start with whatever Tesseract found on the printed footer labels,
     # then overlay the direct TrOCR reads from the handwritten boxes.
     footer_fields = parse_footer(footer_printed)
-    net_direct = _footer_amount(0)
-    vat_direct = _footer_amount(1)
-    due_direct = _footer_amount(2)
-    if net_direct:
-        footer_fields["net_total"] = net_direct
-    if vat_direct:
-        footer_fields["vat"] = vat_direct
-    if due_direct:
-        footer_fields["amount_due"] = due_direct
+    for key, (raw, _conf) in zip(footer_crops, footer_reads):
+        direct = _parse_footer_amount(raw)
+        if direct:
+            footer_fields[key] = direct
 
     item_lines = []
     for item in line_items:
@@ -535,10 +1035,17 @@ def process_receipt(image_bytes: bytes) -> Dict[str, Any]:
         f"{items_block}\n\n"
         f"[FOOTER]\n{footer_printed}"
     )
+    timing.split("assemble")
 
-    return {
+    result = {
         **header_fields,
         "line_items":  line_items,
         **footer_fields,
         "raw_text":    raw_text,
     }
+    if preflight is not None:
+        result["preflight"] = preflight
+    result["model"] = model_id
+    if cascade_id is not None:
+        result["cascade_model"] = cascade_id
+    return result
@@ -1,12 +1,23 @@
-"""Locate header, table and row boundaries on the AGW receipt template."""
-
-from collections import Counter
+"""Locate header, table, row and column boundaries on the AGW receipt template.
+
+Fitted layouts are kept in a small in-process LRU keyed by image size and a
+fingerprint of where the long rules sit, so repeat scans from the same phone
+or scanner skip the morphology and grid fit. OCR_LAYOUT_CACHE_SIZE sets how
+many layouts are kept (0 turns the cache off).
+"""
+
+import copy
+import os
+import threading
+from collections import Counter, OrderedDict
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
+from app.ocr import timing
+
 
 # Template constants tuned to the AGW invoice layout. All fractions are of
 # image width or height on an already-normalised portrait scan.
@@ -26,6 +37,9 @@ class TemplateConstants:
     col_quantity_end: float = 0.14
     col_description_end: float = 0.75
     col_unit_price_end: float = 0.88
+    # A boundary moves onto a detected vertical rule within this fraction of
+    # the width; otherwise the fraction above is used.
+    column_snap_pct: float = 0.03
 
     fallback_header_end_pct: float = 0.28
     fallback_table_start_pct: float = 0.30
@@ -35,19 +49,97 @@ class TemplateConstants:
 TEMPLATE = TemplateConstants()
 EXPECTED_TABLE_ROWS = TEMPLATE.expected_table_rows
 
+# Skew estimation and rule detection run on a copy whose long edge is at most
+# this many pixels; coordinates are mapped back to the full image. Phone
+# photos are ~4000 px, so the big-kernel morphology sees ~6x fewer pixels.
+# 0 analyses at full resolution.
+ANALYSIS_LONG_EDGE = int(os.getenv("OCR_ANALYSIS_LONG_EDGE", "1600"))
+
+LAYOUT_CACHE_SIZE = int(os.getenv("OCR_LAYOUT_CACHE_SIZE", "32"))
+
+
+def analysis_copy(img: np.ndarray, long_edge: Optional[int] = None) -> Tuple[np.ndarray, float]:
+    """Return (downscaled copy, scale) for layout analysis.
+
+    `scale` is analysis pixels per full-resolution pixel (1.0 when the image
+    is already small enough, in which case `img` itself is returned).
+    """
+    long_edge = ANALYSIS_LONG_EDGE if long_edge is None else long_edge
+    h, w = img.shape[:2]
+    if not long_edge or max(h, w) <= long_edge:
+        return img, 1.0
+    scale = long_edge / max(h, w)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+
+@dataclass(frozen=True)
+class PageGeometry:
+    """The deskewed page frame, as a rotation of the portrait photo.
+
+    Layout coordinates (region bounds, row_ys, column bounds) are in the
+    deskewed frame, which has the photo's width and height. `crop` resamples
+    only the requested rectangle from the photo, so the page as a whole
+    never has to be warped. With angle 0 every crop is a plain slice.
+    """
+    width: int
+    height: int
+    angle: float = 0.0
+
+    def matrix(self, scale: float = 1.0, x: int = 0, y: int = 0) -> np.ndarray:
+        """Affine map from photo pixels to frame pixels, for an image `scale`
+        times the photo's size, shifted so frame point (x, y) is the origin."""
+        m = cv2.getRotationMatrix2D((self.width // 2, self.height // 2), self.angle, 1.0)
+        m[:, 2] *= scale
+        m[0, 2] -= x
+        m[1, 2] -= y
+        return m
+
+    def warp(self, img: np.ndarray, scale: float = 1.0) -> np.ndarray:
+        """Deskew a whole image (the photo, or an analysis copy at `scale`)."""
+        if not self.angle:
+            return img
+        h, w = img.shape[:2]
+        return cv2.warpAffine(img, self.matrix(scale), (w, h),
+                              flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+    def crop(self, img: np.ndarray, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        """Frame rectangle [x1, x2) x [y1, y2), sampled from the photo `img`."""
+        if not self.angle or x2 <= x1 or y2 <= y1:
+            return img[y1:y2, x1:x2]
+        return cv2.warpAffine(img, self.matrix(x=x1, y=y1), (x2 - x1, y2 - y1),
+                              flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def _as_gray(img: np.ndarray) -> np.ndarray:
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+
+
+def _ink_mask(img: np.ndarray) -> np.ndarray:
+    """Otsu inverse binary: ink is 255."""
+    _, binary = cv2.threshold(_as_gray(img), 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary
+
 
 def _find_horizontal_lines(
-    cv_img: np.ndarray,
+    img: np.ndarray,
     min_span_pct: float = TEMPLATE.min_horizontal_span_pct,
+    binary: Optional[np.ndarray] = None,
+    iterations: int = 2,
 ) -> List[Tuple[int, int]]:
-    """Return [(y_centre, line_width)] for each detected horizontal rule, top-to-bottom."""
-    h, w = cv_img.shape[:2]
-    gray = cv2.cvtColor(cv_img, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    """Return [(y_centre, line_width)] for each detected horizontal rule, top-to-bottom.
+
+    `binary` is `_ink_mask(img)` when the caller already has it. Two opening
+    `iterations` reject more handwriting; one also keeps long rules that are
+    still slightly skewed.
+    """
+    h, w = img.shape[:2]
+    if binary is None:
+        binary = _ink_mask(img)
 
     kernel_w = max(int(w * min_span_pct), 20)
     horiz_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_w, 1))
-    horiz = cv2.morphologyEx(binary, cv2.MORPH_OPEN, horiz_kernel, iterations=2)
+    horiz = cv2.morphologyEx(binary, cv2.MORPH_OPEN, horiz_kernel, iterations=iterations)
 
     contours, _ = cv2.findContours(horiz, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     lines: List[Tuple[int, int]] = []
@@ -60,6 +152,81 @@ def _find_horizontal_lines(
     return lines
 
 
+def _find_vertical_rules(binary: np.ndarray, y1: int, y2: int, strip_h: int = 32) -> List[int]:
+    """Return x centres of the vertical rules crossing rows [y1, y2) of `binary`.
+
+    The band is cut into short horizontal strips and each strip gets a
+    column projection profile of ink (widened by a pixel either side, so a
+    slightly slanted rule stays in its column). A rule is solid ink in a
+    strip, while handwriting strokes are shorter than one. Solid columns
+    are then grouped across strips, so the residual skew left after
+    deskewing only widens a rule's group instead of splitting it.
+    """
+    band = binary[max(0, y1):max(0, y2)]
+    n = band.shape[0] // strip_h
+    if n < 2:
+        return []
+    band = cv2.dilate(band[:n * strip_h], np.ones((1, 3), np.uint8))
+    ink = band.reshape(n, strip_h, -1).sum(axis=1, dtype=np.int32) // 255
+    strip_idx, cols = np.nonzero(ink >= 0.8 * strip_h)
+    if not len(cols):
+        return []
+    order = np.argsort(cols, kind="stable")
+    strip_idx, cols = strip_idx[order], cols[order]
+    breaks = np.flatnonzero(np.diff(cols) > 2) + 1
+    rules = []
+    for idx, run in zip(np.split(strip_idx, breaks), np.split(cols, breaks)):
+        if len(np.unique(idx)) > n // 2:
+            rules.append(int(round(float(np.median(run)))))
+    return rules
+
+
+def _layout_fingerprint(binary: np.ndarray) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Positions of the long rules, in 2 px bins, from two projection profiles.
+
+    Rows at least half ink are the horizontal rules that span the page and
+    columns at least a third ink are the table's vertical rules. Scans from
+    the same device and form line up bin for bin.
+    """
+    h, w = binary.shape[:2]
+    row_ink = cv2.reduce(binary, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel() // 255
+    col_ink = cv2.reduce(binary, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel() // 255
+    rows = np.unique(np.flatnonzero(row_ink >= w // 2) // 2)
+    cols = np.unique(np.flatnonzero(col_ink >= h // 3) // 2)
+    return tuple(rows.tolist()), tuple(cols.tolist())
+
+
+class LayoutCache:
+    """In-process LRU of detect_regions results."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        with self._lock:
+            regions = self._entries.get(key)
+            if regions is None:
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(regions)
+
+    def put(self, key: tuple, regions: Dict) -> None:
+        with self._lock:
+            self._entries[key] = copy.deepcopy(regions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+LAYOUT_CACHE = LayoutCache(LAYOUT_CACHE_SIZE)
+
+
 def _cluster(ys: List[int], gap: int = 10) -> List[int]:
     """Merge y-values within `gap` px of each other (average of cluster)."""
     if not ys:
@@ -73,6 +240,13 @@ def _cluster(ys: List[int], gap: int = 10) -> List[int]:
     return clustered
 
 
+def _long_rule_rows(binary: np.ndarray, min_span_pct: float) -> List[int]:
+    """Rows of the rules spanning `min_span_pct` of an ink mask, tolerating a little skew."""
+    min_width = binary.shape[1] * min_span_pct
+    lines = _find_horizontal_lines(binary, binary=binary, iterations=1)
+    return _cluster([y for y, cw in lines if cw >= min_width])
+
+
 def _estimate_pitch(detected: List[int]) -> int:
     # Use the mode over plausible gaps rather than the median: footer box
     # edges produce sub-row-height gaps that bias the median downwards.
@@ -104,41 +278,29 @@ def _fill_rows(detected: List[int], table_start: int, table_end: int) -> List[in
         pitch = max(1, (table_end - table_start) // (EXPECTED_TABLE_ROWS + 1))
         return [table_start + i * pitch for i in range(EXPECTED_TABLE_ROWS + 1)]
 
-    # Anchor on the detected line with the most pitch-consistent neighbours.
+    # Anchor on the detected line with the most pitch-consistent neighbours
+    # (first one on ties): score every pair of lines at once.
     tol = max(3, int(pitch * 0.15))
-
-    def neighbour_score(y: int) -> int:
-        score = 0
-        for other in detected:
-            if other == y:
-                continue
-            delta = abs(other - y)
-            multiple = round(delta / pitch)
-            if multiple > 0 and abs(delta - multiple * pitch) <= tol:
-                score += 1
-        return score
-
-    anchor = max(detected, key=neighbour_score)
-
-    grid: List[int] = []
-    y = anchor
-    while y > table_start - pitch // 2:
-        grid.append(int(y))
-        y -= pitch
-    grid.reverse()
-    y = anchor + pitch
-    while y <= table_end + pitch // 2:
-        grid.append(int(y))
-        y += pitch
-
-    detected_sorted = sorted(detected)
-    snapped: List[int] = []
-    for gy in grid:
-        near = [d for d in detected_sorted if abs(d - gy) <= tol]
-        if near:
-            snapped.append(int(min(near, key=lambda d: abs(d - gy))))
-        else:
-            snapped.append(int(gy))
+    ys = np.asarray(detected)
+    delta = np.abs(ys[:, None] - ys[None, :])
+    multiple = np.rint(delta / pitch)
+    consistent = (multiple > 0) & (np.abs(delta - multiple * pitch) <= tol)
+    anchor = int(ys[np.argmax(consistent.sum(axis=1))])
+
+    # Grid of pitch steps through the anchor covering the table, then snap
+    # each grid line to the nearest detected rule within tolerance.
+    lo = table_start - pitch // 2
+    hi = table_end + pitch // 2
+    first = anchor - ((anchor - lo - 1) // pitch) * pitch if anchor > lo else anchor + pitch
+    grid = np.arange(first, max(anchor, hi) + 1, pitch)
+
+    detected_sorted = np.sort(ys)
+    snapped: List[int] = grid.tolist()
+    if len(grid):
+        dist = np.abs(detected_sorted[None, :] - grid[:, None])
+        nearest = np.argmin(dist, axis=1)
+        near = dist[np.arange(len(grid)), nearest] <= tol
+        snapped = np.where(near, detected_sorted[nearest], grid).tolist()
 
     while snapped and snapped[0] < table_start - tol:
         snapped.pop(0)
@@ -149,11 +311,46 @@ def _fill_rows(detected: List[int], table_start: int, table_end: int) -> List[in
     return snapped
 
 
-def detect_regions(cv_img: np.ndarray) -> Dict:
-    """Return y-bounds: header_end_y, table_start_y, table_end_y, row_ys."""
-    h, w = cv_img.shape[:2]
+def detect_regions(img: np.ndarray, analysis: Optional[Tuple[np.ndarray, float]] = None) -> Dict:
+    """Return y-bounds header_end_y, table_start_y, table_end_y, row_ys, and
+    column_xs, the x centres of the table's vertical rules.
 
-    lines = _find_horizontal_lines(cv_img, min_span_pct=TEMPLATE.min_horizontal_span_pct)
+    `img` is the page as a grayscale array (or BGR, converted here). Rules are
+    found on `analysis`, the (copy, scale) pair from `analysis_copy`, which is
+    made here when not given; every returned coordinate is in `img` pixels.
+    A page whose size and rule fingerprint match a recent one reuses its
+    layout from LAYOUT_CACHE.
+    """
+    h, w = img.shape[:2]
+
+    small, scale = analysis if analysis is not None else analysis_copy(_as_gray(img))
+    binary = _ink_mask(small)
+
+    key = None
+    if LAYOUT_CACHE.max_entries > 0:
+        rule_rows, rule_cols = _layout_fingerprint(binary)
+        # A page with too few long rules to tell forms apart (badly skewed,
+        # blank) is fitted from scratch and not cached.
+        if len(rule_rows) >= 3 and len(rule_cols) >= 2:
+            key = (w, h, round(scale, 6), rule_rows, rule_cols)
+    if key is not None:
+        cached = LAYOUT_CACHE.get(key)
+        if cached is not None:
+            timing.count("layout_cache_hits")
+            return cached
+
+    regions = _fit_regions(h, w, small, binary, scale)
+    if key is not None:
+        LAYOUT_CACHE.put(key, regions)
+    return regions
+
+
+def _fit_regions(h: int, w: int, small: np.ndarray, binary: np.ndarray, scale: float) -> Dict:
+    """detect_regions without the cache; `binary` is `_ink_mask(small)`."""
+    lines = [
+        (int(round(y / scale)), int(round(cw / scale)))
+        for y, cw in _find_horizontal_lines(small, TEMPLATE.min_horizontal_span_pct, binary=binary)
+    ]
 
     if len(lines) < 3:
         table_start = int(h * TEMPLATE.fallback_table_start_pct)
@@ -166,6 +363,7 @@ def detect_regions(cv_img: np.ndarray) -> Dict:
             "table_start_y": table_start,
             "table_end_y": table_end,
             "row_ys": row_ys,
+            "column_xs": [],
         }
 
     # Column-header separator is the widest line below the outer border.
@@ -198,21 +396,42 @@ def detect_regions(cv_img: np.ndarray) -> Dict:
     )
     row_ys = _fill_rows(row_line_ys, table_start_y, table_end_y)
 
+    column_xs = [
+        int(round(x / scale))
+        for x in _find_vertical_rules(binary, int(row_ys[0] * scale), int(row_ys[-1] * scale))
+    ]
+
     return {
         "header_end_y": header_end_y,
         "table_start_y": table_start_y,
         "table_end_y": table_end_y,
         "row_ys": row_ys,
+        "column_xs": column_xs,
     }
 
 
-def get_column_bounds(img_width: int) -> Dict[str, Tuple[int, int]]:
-    """Hard-coded AGW column x-bounds: row_num, quantity, description, unit_price, amount."""
+def get_column_bounds(img_width: int, column_xs: Optional[List[int]] = None) -> Dict[str, Tuple[int, int]]:
+    """AGW column x-bounds: row_num, quantity, description, unit_price, amount.
+
+    Each boundary is the template fraction of the width, moved onto the
+    nearest detected vertical rule (detect_regions' column_xs) when one is
+    within TEMPLATE.column_snap_pct of the width.
+    """
     w = img_width
+    edges = []
+    for frac in (TEMPLATE.col_row_num_end, TEMPLATE.col_quantity_end,
+                 TEMPLATE.col_description_end, TEMPLATE.col_unit_price_end):
+        x = int(w * frac)
+        if column_xs:
+            nearest = min(column_xs, key=lambda r: abs(r - x))
+            if abs(nearest - x) <= w * TEMPLATE.column_snap_pct:
+                x = nearest
+        edges.append(x)
+    row_num_end, quantity_end, description_end, unit_price_end = edges
     return {
-        "row_num":     (0,                                     int(w * TEMPLATE.col_row_num_end)),
-        "quantity":    (int(w * TEMPLATE.col_row_num_end),     int(w * TEMPLATE.col_quantity_end)),
-        "description": (int(w * TEMPLATE.col_quantity_end),    int(w * TEMPLATE.col_description_end)),
-        "unit_price":  (int(w * TEMPLATE.col_description_end), int(w * TEMPLATE.col_unit_price_end)),
-        "amount":      (int(w * TEMPLATE.col_unit_price_end),  w),
+        "row_num":     (0,               row_num_end),
+        "quantity":    (row_num_end,     quantity_end),
+        "description": (quantity_end,    description_end),
+        "unit_price":  (description_end, unit_price_end),
+        "amount":      (unit_price_end,  w),
     }
@@ -0,0 +1,134 @@
+"""Content-addressed cache of process_receipt results.
+
+Re-uploading the same photo (a retried request, a duplicate scan) returns the
+stored result instead of running OCR again. The key is the SHA-256 of the
+uploaded bytes combined with a fingerprint of everything else that decides
+the output: the serving TrOCR model (handwritten_model_id) and cascade, PIPELINE_VERSION,
+the layout-analysis resolution, the deskew and orientation modes, the
+pre-flight mode and thresholds, and both TemplateConstants. Changing any of them yields new keys,
+so stale entries are never read and simply age out. A TrOCR checkpoint
+swapped in while the server runs (POST /admin/model) re-keys the cache from
+the moment it is requested.
+
+Entries are JSON files under OCR_CACHE_DIR. Reads bump the file's mtime, and
+once there are more than OCR_CACHE_MAX_ENTRIES files the least recently used
+ones are deleted. Set OCR_CACHE=0 to turn the cache off.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE", "1") == "1"
+OCR_CACHE_DIR = Path(os.getenv(
+    "OCR_CACHE_DIR",
+    str(Path(__file__).resolve().parents[2] / "ocr_cache"),
+))
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "500"))
+
+
+def pipeline_fingerprint(model_id: Optional[str] = None) -> str:
+    """Hash of the model id (by default the requested one), pipeline version and template constants."""
+    from app.ocr import handwriting, orientation, preflight, receipt_pipeline, region_detector
+    from app.ocr.handwriting import handwritten_model_id
+
+    parts = {
+        "model": model_id or handwritten_model_id(),
+        "pipeline": receipt_pipeline.PIPELINE_VERSION,
+        "analysis_long_edge": region_detector.ANALYSIS_LONG_EDGE,
+        "deskew": receipt_pipeline.DESKEW_MODE,
+        "orientation": {"mode": orientation.ORIENTATION_MODE, **asdict(orientation.ORIENTATION)},
+        "preflight": {"mode": preflight.PREFLIGHT_MODE, **asdict(preflight.PREFLIGHT)},
+        "template": asdict(receipt_pipeline.TEMPLATE),
+        "regions": asdict(region_detector.TEMPLATE),
+    }
+    if handwriting.TROCR_CASCADE_MODEL:
+        parts["cascade"] = {
+            "model": handwritten_model_id(handwriting.TROCR_CASCADE_MODEL),
+            "threshold": handwriting.TROCR_CASCADE_THRESHOLD,
+        }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class OcrResultCache:
+    """LRU store of OCR results on disk, bounded by entry count."""
+
+    def __init__(self, root: Path, max_entries: int, fingerprint: str, model_id: Optional[str] = None):
+        self.root = root
+        self.max_entries = max(1, max_entries)
+        self.fingerprint = fingerprint
+        self.model_id = model_id
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, image_bytes: bytes) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        return hashlib.sha256(f"{digest}:{self.fingerprint}".encode("ascii")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            result = json.loads(path.read_text(encoding="utf-8"))
+            os.utime(path)
+            return result
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning("Dropping unreadable OCR cache entry %s", path.name)
+            path.unlink(missing_ok=True)
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_text(json.dumps(result), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            logger.exception("Could not write OCR cache entry")
+            tmp_path.unlink(missing_ok=True)
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for p in self.root.glob("*.json"):
+                try:
+                    entries.append((p.stat().st_mtime, p))
+                except FileNotFoundError:
+                    continue
+            excess = len(entries) - self.max_entries
+            if excess <= 0:
+                return
+            entries.sort()
+            for _, p in entries[:excess]:
+                p.unlink(missing_ok=True)
+
+
+_CACHE: Optional[OcrResultCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_result_cache() -> Optional[OcrResultCache]:
+    """Return the process-wide cache for the requested TrOCR checkpoint, or None when OCR_CACHE=0."""
+    from app.ocr.handwriting import handwritten_model_id
+
+    global _CACHE
+    if not OCR_CACHE_ENABLED:
+        return None
+    model_id = handwritten_model_id()
+    with _CACHE_LOCK:
+        if _CACHE is None or _CACHE.model_id != model_id:
+            _CACHE = OcrResultCache(OCR_CACHE_DIR, OCR_CACHE_MAX_ENTRIES, pipeline_fingerprint(model_id), model_id)
+        return _CACHE
@@ -0,0 +1,79 @@
+"""Model weights mapped from one file, so OCR worker processes share them.
+
+Each OCR worker loads its own models, and the workers are spawned rather
+than forked (torch thread pools do not survive a fork), so copy-on-write
+from a pre-loaded parent is not an option. fp32 TrOCR is shared already:
+transformers maps the checkpoint file and the parameters point into it. But
+the int8 TrOCR state dict and EasyOCR's networks are read with a plain
+torch.load into private memory, once per worker.
+
+With OCR_SHARED_WEIGHTS=1, those models' plain tensors are exported once to
+OCR_SHARED_WEIGHTS_DIR and every process maps that file with
+`torch.load(mmap=True)` and adopts the mapped tensors as its parameters.
+Inference never writes to them, so the pages sit in the page cache once and
+all workers share them; /health reports per-process RSS and PSS to check.
+Dynamically quantised layers keep packed weights that cannot be mapped, so
+only their remaining plain tensors are shared.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict
+
+if TYPE_CHECKING:
+    import torch
+
+logger = logging.getLogger(__name__)
+
+SHARED_WEIGHTS = os.getenv("OCR_SHARED_WEIGHTS", "0") == "1"
+SHARED_WEIGHTS_DIR = Path(os.getenv(
+    "OCR_SHARED_WEIGHTS_DIR",
+    str(Path(__file__).resolve().parents[2] / "model_cache"),
+))
+
+
+def weights_path(name: str) -> Path:
+    """File for the weights called `name`, per torch version."""
+    import torch
+
+    return SHARED_WEIGHTS_DIR / f"{name}.shared.torch{torch.__version__}.pt"
+
+
+def _plain_tensors(module: "torch.nn.Module") -> Dict[str, "torch.Tensor"]:
+    """Floating-point parameters and buffers by name, tied ones under every name."""
+    tensors = {**dict(module.named_parameters(remove_duplicate=False)),
+               **dict(module.named_buffers(remove_duplicate=False))}
+    return {key: t.detach() for key, t in tensors.items() if t.is_floating_point() and not t.is_quantized}
+
+
+def share_weights(module: "torch.nn.Module", path: Path) -> int:
+    """Replace `module`'s plain tensors with ones mapped from `path`; returns bytes mapped.
+
+    The file is written from `module` first if it does not exist yet, so the
+    first process to start needs its weights loaded the usual way.
+    """
+    import torch
+
+    plain = _plain_tensors(module)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        torch.save(plain, tmp_path)
+        os.replace(tmp_path, path)
+        logger.info("Exported shared weights to %s", path)
+
+    mapped = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    if set(mapped) != set(plain) or any(mapped[k].shape != plain[k].shape for k in plain):
+        raise RuntimeError(f"{path} does not match the model it is loaded into; delete it to re-export")
+    # Swapped in directly rather than through load_state_dict, which
+    # quantised layers only accept together with their packed weights.
+    for key, tensor in mapped.items():
+        owner_name, _, name = key.rpartition(".")
+        owner = module.get_submodule(owner_name)
+        if name in owner._parameters:
+            owner._parameters[name] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            owner._buffers[name] = tensor
+    # Tied weights were saved once and come back as views of one mapping.
+    return sum({t.untyped_storage().data_ptr(): t.untyped_storage().nbytes() for t in mapped.values()}.values())
@@ -0,0 +1,138 @@
+"""A small dependency-graph scheduler for the OCR stages of one page.
+
+Once the regions are known, the reads of a page barely depend on each
+other: the letterhead and footer go to Tesseract, the invoice number, name,
+date and numeric cells to EasyOCR, and the descriptions and footer boxes to
+TrOCR. process_receipt declares them as `Stage`s and `run_stages` runs every
+stage whose dependencies are done on a short-lived thread pool of
+OCR_STAGE_WORKERS threads (default 4). Tesseract (through its C API or a
+subprocess), torch and onnxruntime all release the GIL, so the engines
+genuinely overlap.
+
+Each engine has a process-wide limit, shared by every upload in the process,
+so a stage waits for a slot instead of piling onto an engine: Tesseract up
+to TESSERACT_POOL_SIZE reads at once, EasyOCR and TrOCR one each (with
+TROCR_MICROBATCH on, the batcher already serialises TrOCR and has to see
+concurrent uploads, so there is no limit). OCR_STAGE_WORKERS=1 runs the
+stages one after another on the calling thread, in declaration order.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.ocr import timing
+from app.ocr.batching import MICROBATCH_ENABLED
+from app.ocr.tesseract_engine import TESSERACT_POOL_SIZE
+
+STAGE_WORKERS = max(1, int(os.getenv("OCR_STAGE_WORKERS", "4")))
+
+ENGINE_LIMITS: Dict[str, Optional[int]] = {
+    "tesseract": TESSERACT_POOL_SIZE,
+    "easyocr": 1,
+    "trocr": None if MICROBATCH_ENABLED else 1,
+}
+
+_SLOTS: Dict[str, threading.BoundedSemaphore] = {}
+_SLOTS_LOCK = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """One step of the page: `fn` is called with the results of `deps`, in order.
+
+    `engine` names the OCR engine the stage spends its time in, if any, so
+    it can be held to that engine's limit.
+    """
+
+    name: str
+    fn: Callable[..., Any]
+    deps: Tuple[str, ...] = ()
+    engine: Optional[str] = None
+
+
+def _engine_slot(engine: Optional[str]) -> Optional[threading.BoundedSemaphore]:
+    limit = ENGINE_LIMITS.get(engine) if engine else None
+    if not limit:
+        return None
+    with _SLOTS_LOCK:
+        slot = _SLOTS.get(engine)
+        if slot is None:
+            slot = _SLOTS[engine] = threading.BoundedSemaphore(max(1, limit))
+        return slot
+
+
+def _run_stage(stage: Stage, args: List[Any]) -> Any:
+    slot = _engine_slot(stage.engine)
+    if slot is not None:
+        slot.acquire()
+    try:
+        t0 = time.perf_counter()
+        try:
+            return stage.fn(*args)
+        finally:
+            timing.record(stage.name, time.perf_counter() - t0)
+    finally:
+        if slot is not None:
+            slot.release()
+
+
+def _check_graph(stages: Sequence[Stage]) -> None:
+    # Dependencies must be declared first, which also rules out cycles.
+    seen = set()
+    for stage in stages:
+        if stage.name in seen:
+            raise ValueError(f"Duplicate stage {stage.name!r}")
+        missing = [dep for dep in stage.deps if dep not in seen]
+        if missing:
+            raise ValueError(f"Stage {stage.name!r} depends on undeclared or later stages {missing}")
+        seen.add(stage.name)
+
+
+def run_stages(stages: Sequence[Stage], workers: int = STAGE_WORKERS) -> Dict[str, Any]:
+    """Run `stages` as soon as their dependencies finish; return results by name.
+
+    The first stage to raise cancels the stages not yet started, and its
+    exception is re-raised here once the running ones have finished.
+    """
+    _check_graph(stages)
+    results: Dict[str, Any] = {}
+    if workers <= 1 or len(stages) <= 1:
+        for stage in stages:
+            results[stage.name] = _run_stage(stage, [results[dep] for dep in stage.deps])
+        return results
+
+    waiting = list(stages)
+    running: Dict[Future, Stage] = {}
+    busy: Dict[Optional[str], int] = {}
+    with ThreadPoolExecutor(max_workers=min(workers, len(stages)), thread_name_prefix="ocr-stage") as pool:
+        try:
+            while waiting or running:
+                # Declaration order is the priority order among ready stages.
+                # A stage is held back while this page already fills its
+                # engine's limit, so no pool thread sits waiting on a sibling.
+                for stage in [s for s in waiting if all(dep in results for dep in s.deps)]:
+                    limit = ENGINE_LIMITS.get(stage.engine) if stage.engine else None
+                    if limit and busy.get(stage.engine, 0) >= limit:
+                        continue
+                    waiting.remove(stage)
+                    busy[stage.engine] = busy.get(stage.engine, 0) + 1
+                    # Each stage runs in a copy of this context, so timing
+                    # still reaches the upload's StageTimer.
+                    ctx = contextvars.copy_context()
+                    args = [results[dep] for dep in stage.deps]
+                    running[pool.submit(ctx.run, _run_stage, stage, args)] = stage
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    stage = running.pop(fut)
+                    busy[stage.engine] -= 1
+                    results[stage.name] = fut.result()
+        except BaseException:
+            for fut in running:
+                fut.cancel()
+            raise
+    return results
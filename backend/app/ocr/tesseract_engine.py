@@ -0,0 +1,184 @@
+"""Tesseract through its C API, with initialised handles kept per process.
+
+pytesseract writes every region to a temporary PNG and starts a `tesseract`
+process, which loads the traineddata again, for each call. This engine loads
+libtesseract once with ctypes and initialises each handle once (language and
+OEM). A region is handed over as the array's own buffer via
+TessBaseAPISetImage, and only the page segmentation mode changes per call.
+
+A handle is not thread-safe, so handles live in a small pool of at most
+TESSERACT_POOL_SIZE (default 2): a caller takes one, reads and puts it back.
+TESSERACT_ENGINE=cli keeps pytesseract, which is also the fallback when
+libtesseract cannot be loaded or initialised. Set TESSERACT_LIB to the
+library's path when it is not on the loader path.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TESSERACT_ENGINE = os.getenv("TESSERACT_ENGINE", "capi").strip().lower()
+TESSERACT_LIB = os.getenv("TESSERACT_LIB", "")
+TESSERACT_POOL_SIZE = int(os.getenv("TESSERACT_POOL_SIZE", "2"))
+TESSERACT_LANG = "eng"
+
+# TessOcrEngineMode; --oem 3 on the command line.
+OEM_DEFAULT = 3
+
+# Homebrew installs outside the default macOS loader path.
+_LIB_CANDIDATES = (
+    "libtesseract.so.5",
+    "/opt/homebrew/lib/libtesseract.dylib",
+    "/usr/local/lib/libtesseract.dylib",
+)
+
+
+def _load_library() -> ctypes.CDLL:
+    names = [TESSERACT_LIB] if TESSERACT_LIB else [ctypes.util.find_library("tesseract"), *_LIB_CANDIDATES]
+    errors = []
+    for name in filter(None, names):
+        try:
+            lib = ctypes.CDLL(name)
+            break
+        except OSError as exc:
+            errors.append(str(exc))
+    else:
+        raise OSError("libtesseract not found: " + ("; ".join(errors) or "no candidate paths"))
+
+    handle = ctypes.c_void_p
+    lib.TessBaseAPICreate.restype = handle
+    lib.TessBaseAPICreate.argtypes = []
+    lib.TessBaseAPIInit2.restype = ctypes.c_int
+    lib.TessBaseAPIInit2.argtypes = [handle, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+    lib.TessBaseAPISetPageSegMode.restype = None
+    lib.TessBaseAPISetPageSegMode.argtypes = [handle, ctypes.c_int]
+    lib.TessBaseAPISetImage.restype = None
+    lib.TessBaseAPISetImage.argtypes = [handle, ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+    # c_void_p rather than c_char_p, so the pointer can be handed back to TessDeleteText.
+    lib.TessBaseAPIGetUTF8Text.restype = ctypes.c_void_p
+    lib.TessBaseAPIGetUTF8Text.argtypes = [handle]
+    lib.TessDeleteText.restype = None
+    lib.TessDeleteText.argtypes = [ctypes.c_void_p]
+    for name in ("TessBaseAPIClear", "TessBaseAPIEnd", "TessBaseAPIDelete"):
+        getattr(lib, name).restype = None
+        getattr(lib, name).argtypes = [handle]
+    return lib
+
+
+class TesseractApi:
+    """One initialised TessBaseAPI handle."""
+
+    def __init__(self, lib: ctypes.CDLL, lang: str = TESSERACT_LANG, oem: int = OEM_DEFAULT):
+        self._lib = lib
+        self._handle = lib.TessBaseAPICreate()
+        # A None datapath lets Tesseract use TESSDATA_PREFIX or its built-in path.
+        if lib.TessBaseAPIInit2(self._handle, None, lang.encode("ascii"), oem) != 0:
+            lib.TessBaseAPIDelete(self._handle)
+            raise RuntimeError(f"Tesseract could not load the {lang!r} traineddata")
+
+    def read(self, img: np.ndarray, psm: int) -> str:
+        """Text of an RGB or grayscale uint8 array under page segmentation mode `psm`."""
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        h, w = img.shape[:2]
+        if not h or not w:
+            return ""
+        lib = self._lib
+        lib.TessBaseAPISetPageSegMode(self._handle, psm)
+        lib.TessBaseAPISetImage(self._handle, img.ctypes.data, w, h,
+                                1 if img.ndim == 2 else img.shape[2], img.strides[0])
+        text_ptr = lib.TessBaseAPIGetUTF8Text(self._handle)
+        try:
+            return ctypes.string_at(text_ptr).decode("utf-8", errors="replace") if text_ptr else ""
+        finally:
+            if text_ptr:
+                lib.TessDeleteText(text_ptr)
+            lib.TessBaseAPIClear(self._handle)
+
+    def close(self) -> None:
+        if self._handle:
+            self._lib.TessBaseAPIEnd(self._handle)
+            self._lib.TessBaseAPIDelete(self._handle)
+            self._handle = None
+
+
+class TesseractPool:
+    """Up to `size` handles from `factory`, created on demand and reused.
+
+    The first handle is created here, so a missing library or traineddata
+    shows up when the pool is built rather than on the first upload.
+    """
+
+    def __init__(self, factory: Callable[[], TesseractApi], size: int = TESSERACT_POOL_SIZE):
+        self.size = max(1, size)
+        self._factory = factory
+        self._idle: "queue.LifoQueue[TesseractApi]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._idle.put(factory())
+        self.created = 1
+
+    def _acquire(self) -> TesseractApi:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = self.created < self.size
+            if grow:
+                self.created += 1
+        if not grow:
+            return self._idle.get()
+        try:
+            return self._factory()
+        except Exception:
+            with self._lock:
+                self.created -= 1
+            raise
+
+    def read(self, img: np.ndarray, psm: int) -> str:
+        api = self._acquire()
+        try:
+            return api.read(img, psm)
+        finally:
+            self._idle.put(api)
+
+
+_POOL: Optional[TesseractPool] = None
+_POOL_FAILED = False
+_POOL_LOCK = threading.Lock()
+
+
+def get_tesseract() -> Optional[TesseractPool]:
+    """Return the process-wide handle pool, or None when pytesseract is used."""
+    global _POOL, _POOL_FAILED
+    if TESSERACT_ENGINE != "capi" or _POOL_FAILED:
+        return None
+    with _POOL_LOCK:
+        if _POOL is None and not _POOL_FAILED:
+            try:
+                lib = _load_library()
+                _POOL = TesseractPool(lambda: TesseractApi(lib))
+                logger.info("Tesseract C API ready (pool of up to %d handles)", _POOL.size)
+            except (OSError, RuntimeError, AttributeError) as exc:
+                _POOL_FAILED = True
+                logger.warning("Tesseract C API unavailable (%s); falling back to pytesseract", exc)
+        return _POOL
+
+
+def image_to_string(img: np.ndarray, psm: int = 6) -> str:
+    """OCR an RGB or grayscale array, like pytesseract with `--psm {psm} --oem 3`."""
+    pool = get_tesseract()
+    if pool is not None:
+        return pool.read(img, psm)
+
+    import pytesseract
+    from PIL import Image
+
+    return pytesseract.image_to_string(Image.fromarray(img), config=f"--psm {psm} --oem {OEM_DEFAULT}")
@@ -0,0 +1,178 @@
+"""Lightweight per-stage timing for the OCR pipeline.
+
+process_receipt runs under `collect()`, which installs a StageTimer for the
+current context. The pipeline marks the end of each step with `split(name)`,
+and every engine call (Tesseract, EasyOCR, TrOCR) is wrapped in
+`engine(name)`, which records wall time and call count. Stages that run
+concurrently (see app.ocr.stages) charge their own wall time with
+`record(name, seconds)` instead, so those entries overlap and do not add up
+to total_ms. Outside `collect()` these helpers do nothing, so the helper
+functions stay usable on their own.
+
+The timer's `as_dict()` is what the upload stores under
+extracted_data["ocr"]["timings"]. HISTOGRAM aggregates those dicts across
+uploads for the whole API process; GET /analytics/ocr-timings reads it.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class StageTimer:
+    """Wall time per pipeline step and per engine, plus plain counters."""
+
+    def __init__(self):
+        self._start = self._last_split = time.perf_counter()
+        # Stage threads of the same upload report into one timer.
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+        self.engines: Dict[str, Dict[str, float]] = {}
+        self.counts: Dict[str, int] = {}
+
+    def split(self, name: str) -> None:
+        """Charge the time since the previous split to step `name`."""
+        now = time.perf_counter()
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + (now - self._last_split)
+            self._last_split = now
+
+    def record(self, name: str, seconds: float) -> None:
+        """Charge `seconds` to step `name` without moving the split point."""
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_engine_call(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.engines.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_ms": round((time.perf_counter() - self._start) * 1000, 1),
+                "stages": {name: round(s * 1000, 1) for name, s in self.stages.items()},
+                "engines": {
+                    name: {"ms": round(e["seconds"] * 1000, 1), "calls": int(e["calls"])}
+                    for name, e in self.engines.items()
+                },
+                "counts": dict(self.counts),
+            }
+
+
+_current: ContextVar[Optional[StageTimer]] = ContextVar("ocr_stage_timer", default=None)
+
+
+@contextmanager
+def collect() -> Iterator[StageTimer]:
+    timer = StageTimer()
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+
+
+def split(name: str) -> None:
+    timer = _current.get()
+    if timer is not None:
+        timer.split(name)
+
+
+def record(name: str, seconds: float) -> None:
+    timer = _current.get()
+    if timer is not None:
+        timer.record(name, seconds)
+
+
+def count(name: str, n: int = 1) -> None:
+    timer = _current.get()
+    if timer is not None:
+        timer.count(name, n)
+
+
+@contextmanager
+def engine(name: str) -> Iterator[None]:
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add_engine_call(name, time.perf_counter() - t0)
+
+
+class TimingHistogram:
+    """Process-wide distribution of stage and engine times across uploads."""
+
+    BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[str, Dict[str, Any]] = {}
+        self._counts: Dict[str, int] = {}
+        self._uploads = 0
+
+    def _observe(self, name: str, ms: float) -> None:
+        series = self._series.get(name)
+        if series is None:
+            series = {"count": 0, "sum_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(self.BUCKETS_MS) + 1)}
+            self._series[name] = series
+        series["count"] += 1
+        series["sum_ms"] += ms
+        series["max_ms"] = max(series["max_ms"], ms)
+        series["buckets"][bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+
+    def observe(self, timings: Dict[str, Any]) -> None:
+        with self._lock:
+            self._uploads += 1
+            self._observe("total", timings.get("total_ms", 0.0))
+            for name, ms in timings.get("stages", {}).items():
+                self._observe(f"stage.{name}", ms)
+            for name, entry in timings.get("engines", {}).items():
+                self._observe(f"engine.{name}", entry["ms"])
+                self._counts[f"{name}_calls"] = self._counts.get(f"{name}_calls", 0) + entry["calls"]
+            for name, n in timings.get("counts", {}).items():
+                self._counts[name] = self._counts.get(name, 0) + n
+
+    def _quantile(self, buckets: List[int], total: int, q: float) -> Optional[float]:
+        """Upper edge of the bucket holding quantile q (None if it is the overflow bucket)."""
+        target = q * total
+        seen = 0
+        for i, n in enumerate(buckets):
+            seen += n
+            if seen >= target and n:
+                return float(self.BUCKETS_MS[i]) if i < len(self.BUCKETS_MS) else None
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            series = {}
+            for name, s in sorted(self._series.items()):
+                series[name] = {
+                    "count": s["count"],
+                    "mean_ms": round(s["sum_ms"] / s["count"], 1),
+                    "max_ms": round(s["max_ms"], 1),
+                    "p50_ms_le": self._quantile(s["buckets"], s["count"], 0.50),
+                    "p95_ms_le": self._quantile(s["buckets"], s["count"], 0.95),
+                    "buckets": list(s["buckets"]),
+                }
+            return {
+                "uploads": self._uploads,
+                "bucket_upper_bounds_ms": list(self.BUCKETS_MS),
+                "series": series,
+                "counts": dict(self._counts),
+            }
+
+
+HISTOGRAM = TimingHistogram()
@@ -0,0 +1,381 @@
+"""OCR worker pool: runs process_receipt off the FastAPI event loop.
+
+With OCR_WORKERS > 0 uploads are handed to a ProcessPoolExecutor whose
+workers each load and warm their own models, so a long OCR run no longer
+stalls /health, logins or any other request. OCR_WORKERS=auto sizes the pool
+from the core count (OCR_THREADS_PER_WORKER cores each); OCR_WORKERS=0 keeps
+the pipeline in-process on a worker thread, which is what TROCR_MICROBATCH
+needs to see concurrent uploads.
+
+Starting the pool warms every engine (receipt_pipeline.warm_up: load
+TrOCR, EasyOCR and Tesseract and read a synthetic cell with each), in each
+worker or, with OCR_WORKERS=0, on a background thread. `ready` turns true
+once that has finished everywhere; GET /ready reports it for the load
+balancer. SKIP_OCR_WARMUP=1 skips the warm-up and reports ready at once.
+
+`request_model` hot-swaps the TrOCR checkpoint (app.ocr.model_registry).
+The requested name sits in memory shared with the workers; a thread in
+each worker notices a new one within MODEL_POLL_S, loads and warms it while
+the old checkpoint keeps serving, switches over and counts itself done.
+
+At most OCR_MAX_PENDING uploads may be queued or running at once; beyond
+that `run` raises OcrQueueFull instead of letting requests pile up.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+THREADS_PER_WORKER = max(1, int(os.getenv("OCR_THREADS_PER_WORKER", "4")))
+
+
+def _resolve_worker_count(raw: str) -> int:
+    if raw.strip().lower() == "auto":
+        return max(1, (os.cpu_count() or 1) // THREADS_PER_WORKER)
+    return max(0, int(raw))
+
+
+OCR_WORKERS = _resolve_worker_count(os.getenv("OCR_WORKERS", "auto"))
+OCR_MAX_PENDING = max(1, int(os.getenv("OCR_MAX_PENDING", "8")))
+WARMUP_TIMEOUT_S = 600
+MODEL_POLL_S = 1.0
+MAX_MODEL_NAME_BYTES = 1024
+
+
+class OcrQueueFull(Exception):
+    """Raised when OCR_MAX_PENDING uploads are already queued or running."""
+
+
+class _SharedModelRequest:
+    """The TrOCR checkpoint the API wants served, how many workers have
+    switched to it (or failed to), and the last one a worker did switch to,
+    in memory shared with the workers.
+
+    Generation 0 means the configured checkpoint; each request bumps it. The
+    served name only moves once a worker has loaded the requested checkpoint,
+    so a request that fails everywhere leaves it on the old one.
+    """
+
+    def __init__(self, ctx, name: Optional[str]):
+        self.generation = ctx.Value("i", 1 if name else 0)
+        self.name = ctx.Array("c", MAX_MODEL_NAME_BYTES)
+        self.name.value = (name or "").encode("utf-8")
+        self.served = ctx.Array("c", MAX_MODEL_NAME_BYTES)
+        self.served.value = (name or "").encode("utf-8")
+        self.switched = ctx.Value("i", 0)
+        self.failed = ctx.Value("i", 0)
+
+    def publish(self, name: str) -> None:
+        with self.generation.get_lock():
+            self.name.value = name.encode("utf-8")
+            self.switched.value = 0
+            self.failed.value = 0
+            self.generation.value += 1
+
+    def current(self) -> Tuple[int, str]:
+        with self.generation.get_lock():
+            return self.generation.value, self.name.value.decode("utf-8")
+
+    def served_name(self) -> Optional[str]:
+        """Last checkpoint a worker switched to, or None for the configured one."""
+        with self.generation.get_lock():
+            return self.served.value.decode("utf-8") or None
+
+    def settle(self, generation: int, ok: bool) -> None:
+        """Count one worker done with `generation`, unless a newer request replaced it."""
+        with self.generation.get_lock():
+            if self.generation.value == generation:
+                counter = self.switched if ok else self.failed
+                counter.value += 1
+                if ok:
+                    self.served.value = self.name.value
+
+
+_READY_BARRIER = None
+_WARMUP_ERROR: Optional[str] = None
+
+
+def _warm_up() -> None:
+    if os.getenv("SKIP_OCR_WARMUP") == "1":
+        return
+    from app.ocr.receipt_pipeline import warm_up
+    seconds = warm_up()
+    logger.info(
+        "OCR engines warm in process %d (%s)", os.getpid(),
+        ", ".join(f"{name} {s:.1f}s" for name, s in seconds.items()),
+    )
+
+
+def _follow_model_requests(model_request: _SharedModelRequest, seen: int) -> None:
+    """Worker thread: swap this worker's TrOCR checkpoint whenever a new one is requested."""
+    from app.ocr.handwriting import get_hw_registry
+
+    registry = get_hw_registry()
+    while True:
+        time.sleep(MODEL_POLL_S)
+        generation, name = model_request.current()
+        if generation == seen:
+            continue
+        seen = generation
+        registry.swap(name, wait=True)
+        model_request.settle(generation, ok=registry.last_error is None)
+
+
+def _init_worker(threads: int, ready_barrier, model_request: _SharedModelRequest) -> None:
+    """Pin the worker's thread budget, then warm its engines before any job."""
+    global _READY_BARRIER, _WARMUP_ERROR
+    _READY_BARRIER = ready_barrier
+    # Both torch and onnxruntime read these when they are first used, which
+    # in a fresh worker is after this point.
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    os.environ.setdefault("TROCR_ONNX_THREADS", str(threads))
+    # A worker (re)started after a swap loads the last checkpoint that
+    # loaded; one requested but not loaded yet is left to the watcher, so a
+    # checkpoint that fails to load never becomes a worker's only model.
+    generation, name = model_request.current()
+    served = model_request.served_name()
+    if served:
+        from app.ocr.handwriting import get_hw_registry
+        get_hw_registry().request(served)
+    try:
+        _warm_up()
+    except Exception as exc:
+        _WARMUP_ERROR = f"{type(exc).__name__}: {exc}"
+        logger.exception("OCR worker %d failed to warm up; it will load models on first use", os.getpid())
+    seen = generation
+    if generation and name == served:
+        model_request.settle(generation, ok=_WARMUP_ERROR is None)
+    elif generation:
+        seen = -1
+    threading.Thread(
+        target=_follow_model_requests, args=(model_request, seen), name="ocr-model-watch", daemon=True,
+    ).start()
+
+
+def _worker_ready() -> int:
+    # Every worker has to reach the barrier before any ping returns, so each
+    # ping is answered by a different (warmed) process.
+    _READY_BARRIER.wait(timeout=WARMUP_TIMEOUT_S)
+    if _WARMUP_ERROR is not None:
+        raise RuntimeError(_WARMUP_ERROR)
+    return os.getpid()
+
+
+_SMAPS_FIELDS = {"Rss": "rss_mb", "Pss": "pss_mb", "Shared_Clean": "shared_mb", "Shared_Dirty": "shared_mb"}
+
+
+def process_memory(pid: int) -> Dict[str, Optional[float]]:
+    """RSS, PSS and shared memory of one process in MB, from /proc (Linux).
+
+    RSS counts shared pages (e.g. OCR_SHARED_WEIGHTS) in every process that
+    maps them; PSS splits them between those processes, so PSS summed over
+    the workers is their real footprint. None where /proc is not available.
+    """
+    usage: Dict[str, Optional[float]] = {"rss_mb": None, "pss_mb": None, "shared_mb": None}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return usage
+    for line in lines:
+        field, _, value = line.partition(":")
+        key = _SMAPS_FIELDS.get(field)
+        if key is not None:
+            usage[key] = round((usage[key] or 0.0) + int(value.split()[0]) / 1024, 1)
+    return usage
+
+
+def _run_pipeline(image_bytes: bytes) -> Dict[str, Any]:
+    from app.ocr.receipt_pipeline import process_receipt
+    return process_receipt(image_bytes)
+
+
+class OcrWorkerPool:
+    """Bounded front door to the OCR pipeline, in worker processes or a thread."""
+
+    def __init__(
+        self,
+        workers: int = OCR_WORKERS,
+        max_pending: int = OCR_MAX_PENDING,
+        target: Callable[[bytes], Dict[str, Any]] = _run_pipeline,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.target = target
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self.ready_workers: Set[int] = set()
+        self.warmup_errors: List[str] = []
+        self._warm_in_process = False
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._requested_model: Optional[str] = None
+        self._model_request: Optional[_SharedModelRequest] = None
+
+    def start(self) -> None:
+        if self.workers == 0:
+            # The warm-up runs beside the server, so /health answers meanwhile.
+            if self._warmup_thread is None:
+                self._warmup_thread = threading.Thread(target=self._warm_up_here, name="ocr-warmup", daemon=True)
+                self._warmup_thread.start()
+            return
+        if self._executor is not None:
+            return
+        self._sync_model()
+        # spawn, not fork: the parent may already hold torch thread pools,
+        # which do not survive a fork.
+        ctx = multiprocessing.get_context("spawn")
+        self._model_request = _SharedModelRequest(ctx, self._requested_model)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(THREADS_PER_WORKER, ctx.Barrier(self.workers), self._model_request),
+        )
+        # One no-op per worker makes the executor start them all now, so
+        # their models load before the first upload rather than during it.
+        for _ in range(self.workers):
+            self._executor.submit(_worker_ready).add_done_callback(self._mark_ready)
+        logger.info(
+            "Started %d OCR worker process(es), %d thread(s) each, queue limit %d",
+            self.workers, THREADS_PER_WORKER, self.max_pending,
+        )
+
+    def _warm_up_here(self) -> None:
+        try:
+            _warm_up()
+            self._warm_in_process = True
+        except Exception as exc:
+            self.warmup_errors.append(f"{type(exc).__name__}: {exc}")
+            logger.exception("OCR warm-up failed; uploads will load the models on first use")
+
+    def _mark_ready(self, fut) -> None:
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            self.warmup_errors.append(str(fut.exception()))
+        else:
+            self.ready_workers.add(fut.result())
+
+    @property
+    def ready(self) -> bool:
+        """True once every worker (or this process, with no workers) is warm."""
+        if self.workers:
+            return len(self.ready_workers) >= self.workers
+        return self._warm_in_process
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self.ready_workers.clear()
+            self.warmup_errors.clear()
+
+    def request_model(self, name: str) -> None:
+        """Start swapping the TrOCR checkpoint to `name` everywhere; returns at once.
+
+        Raises ModelSwapInProgress while an earlier request is still loading
+        and ValueError for a name too long to share with the workers.
+        """
+        from app.ocr.handwriting import get_hw_registry
+        from app.ocr.model_registry import ModelSwapInProgress
+
+        registry = get_hw_registry()
+        if not self.workers:
+            registry.swap(name)
+            return
+        if len(name.encode("utf-8")) >= MAX_MODEL_NAME_BYTES:
+            raise ValueError(f"Checkpoint name longer than {MAX_MODEL_NAME_BYTES - 1} bytes")
+        status = self.model_status()
+        if status["loading"] is not None:
+            raise ModelSwapInProgress(f"{status['loading']} is still loading")
+        # This process takes the name once a worker has loaded it (_sync_model).
+        if self._model_request is not None:
+            self._model_request.publish(name)
+
+    def _sync_model(self) -> None:
+        """Adopt the checkpoint the workers switched to, to key cached results
+        by it and to restart the workers on it."""
+        from app.ocr.handwriting import get_hw_registry
+
+        served = self._model_request.served_name() if self._model_request else None
+        if served and served != self._requested_model:
+            get_hw_registry().request(served)
+            self._requested_model = served
+
+    def model_status(self) -> Dict[str, Any]:
+        """Requested TrOCR checkpoint and how far the swap to it has got."""
+        from app.ocr.handwriting import get_hw_registry
+
+        registry = get_hw_registry()
+        if not self.workers:
+            return {**registry.status(), "workers": 0}
+        self._sync_model()
+        generation, name = self._model_request.current() if self._model_request else (0, "")
+        if not generation:
+            # Nothing requested since the workers started: they serve the default.
+            switched, failed = self.workers, 0
+        else:
+            switched, failed = self._model_request.switched.value, self._model_request.failed.value
+        return {
+            "requested": registry.requested,
+            "loading": name if switched + failed < self.workers else None,
+            "workers": self.workers,
+            "workers_switched": switched,
+            "workers_failed": failed,
+        }
+
+    def memory(self) -> Dict[str, Any]:
+        """Memory of this process and of every ready worker, with totals."""
+        api = process_memory(os.getpid())
+        workers = [{"pid": pid, **process_memory(pid)} for pid in sorted(self.ready_workers)]
+
+        def total(key: str) -> Optional[float]:
+            values = [entry[key] for entry in [api, *workers]]
+            return None if None in values else round(sum(values), 1)
+
+        return {"api": api, "workers": workers, "total_rss_mb": total("rss_mb"), "total_pss_mb": total("pss_mb")}
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, image_bytes: bytes) -> Dict[str, Any]:
+        """Run the pipeline on one image without blocking the event loop."""
+        if self._pending >= self.max_pending:
+            raise OcrQueueFull(f"{self._pending} uploads already being processed")
+        self._pending += 1
+        self._sync_model()
+        executor = self._executor
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(executor, self.target, image_bytes)
+            except BrokenProcessPool:
+                # A worker died mid-job (usually the OOM killer). Replace the
+                # pool once, so later uploads are not all rejected with this error.
+                if self._executor is executor:
+                    logger.error("OCR worker pool broke; restarting it")
+                    self.shutdown()
+                    self.start()
+                raise
+        finally:
+            self._pending -= 1
+
+
+_POOL: Optional[OcrWorkerPool] = None
+
+
+def get_ocr_pool() -> OcrWorkerPool:
+    """Return the process-wide pool, creating it (unstarted) on first use."""
+    global _POOL
+    if _POOL is None:
+        _POOL = OcrWorkerPool()
+    return _POOL
@@ -47,3 +47,19 @@ class ProductOut(BaseModel):
     id: str
     name: str
     current_stock: int
+
+
+class JobOut(BaseModel):
+    id: str
+    status: str
+    submission_id: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class JobQueuedOut(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
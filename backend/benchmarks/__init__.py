@@ -0,0 +1 @@
+"""Synthetic-receipt benchmarks for the OCR pipeline (see benchmarks/run.py)."""
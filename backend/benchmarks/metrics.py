@@ -0,0 +1,77 @@
+"""Score process_receipt output against synthetic ground truth."""
+
+import re
+from statistics import mean
+from typing import Any, Dict, List, Optional
+
+HEADER_FIELDS = ("invoice_number", "invoice_date", "customer_name")
+FOOTER_FIELDS = ("net_total", "vat", "amount_due")
+
+
+def _cer(pred: str, ref: str) -> float:
+    """Character Error Rate via Levenshtein distance."""
+    pred, ref = pred.strip().lower(), ref.strip().lower()
+    if not ref:
+        return 0.0 if not pred else 1.0
+    prev = list(range(len(pred) + 1))
+    for i in range(1, len(ref) + 1):
+        cur = [i] + [0] * len(pred)
+        for j in range(1, len(pred) + 1):
+            cost = 0 if ref[i - 1] == pred[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+        prev = cur
+    return prev[-1] / len(ref)
+
+
+def _same_amount(pred: str, ref: str) -> bool:
+    try:
+        return abs(float(pred) - float(ref)) < 0.005
+    except (TypeError, ValueError):
+        return False
+
+
+def _norm_name(name: str) -> str:
+    return re.sub(r"\s+", " ", name or "").strip().lower()
+
+
+def score_receipt(result: Dict[str, Any], truth: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-field correctness for one receipt, plus per-row line-item scores."""
+    fields = {
+        "invoice_number": result.get("invoice_number", "") == truth["invoice_number"],
+        "invoice_date": result.get("invoice_date", "") == truth["invoice_date"],
+        "customer_name": (
+            _norm_name(result.get("customer", {}).get("name", ""))
+            == _norm_name(truth["customer"]["name"])
+        ),
+    }
+    for key in FOOTER_FIELDS:
+        fields[key] = _same_amount(result.get(key, ""), truth[key])
+
+    predicted = {item["row"]: item for item in result.get("line_items", [])}
+    rows = []
+    for item in truth["line_items"]:
+        pred = predicted.get(item["row"])
+        rows.append({
+            "found": pred is not None,
+            "quantity": pred is not None and pred.get("quantity", "") == item["quantity"],
+            "amount": pred is not None and _same_amount(pred.get("amount", ""), item["amount"]),
+            "description_cer": _cer(pred.get("description", "") if pred else "", item["description"]),
+        })
+    return {"fields": fields, "rows": rows}
+
+
+def summarise(scores: List[Dict[str, Any]]) -> Dict[str, Optional[float]]:
+    """Fraction of receipts with each field right, and line-item rates over all rows."""
+    if not scores:
+        return {}
+    summary: Dict[str, Optional[float]] = {
+        key: round(mean(1.0 if s["fields"][key] else 0.0 for s in scores), 3)
+        for key in HEADER_FIELDS + FOOTER_FIELDS
+    }
+    rows = [r for s in scores for r in s["rows"]]
+    if rows:
+        summary["rows_found"] = round(mean(1.0 if r["found"] else 0.0 for r in rows), 3)
+        summary["row_quantity"] = round(mean(1.0 if r["quantity"] else 0.0 for r in rows), 3)
+        summary["row_amount"] = round(mean(1.0 if r["amount"] else 0.0 for r in rows), 3)
+        summary["description_cer"] = round(mean(r["description_cer"] for r in rows), 3)
+    return summary
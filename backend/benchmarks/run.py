@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: run process_receipt over synthetic AGW invoices.
+
+Each engine preset is a set of environment overrides (TROCR_ENGINE,
+TROCR_QUANTIZE, ...). The OCR modules read these at import time, so when
+more than one engine is given, each one runs in its own subprocess and the
+parent prints a side-by-side table. For every engine the report has:
+
+- throughput;
+- p50 and p95 latency;
+- mean time per pipeline stage and per OCR engine, from result["timings"];
+- counters per receipt, e.g. TrOCR crops and, for torch-cascade, the share
+  of them escalated to the main model;
+- field accuracy against the generator's ground truth.
+
+Usage:
+    cd backend && source venv/bin/activate
+    python -m benchmarks.run --n 20
+    python -m benchmarks.run --n 50 --engine torch --engine torch-int8
+    python -m benchmarks.run --engine onnx --set TROCR_ONNX_DIR=../data/trocr-onnx
+    python -m benchmarks.run --n 10 --max-skew 0 --noise 0 --save-json bench.json
+    python -m benchmarks.run --n 5 --dump-dir /tmp/agw-synth   # keep the images
+    python -m benchmarks.run --long-edge 4032 --engine torch --engine torch-fullres
+    python -m benchmarks.run --engine torch --engine torch-cascade --set TROCR_CASCADE_THRESHOLD=0.8
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from statistics import mean
+from typing import Any, Dict, List, Optional
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+ENGINES: Dict[str, Dict[str, str]] = {
+    "torch": {"TROCR_ENGINE": "torch", "TROCR_QUANTIZE": "", "TROCR_CASCADE_MODEL": ""},
+    "torch-int8": {"TROCR_ENGINE": "torch", "TROCR_QUANTIZE": "int8", "TROCR_CASCADE_MODEL": ""},
+    "onnx": {"TROCR_ENGINE": "onnx", "TROCR_CASCADE_MODEL": ""},
+    # Layout analysis on the full-resolution page, to check the downscaled
+    # default (OCR_ANALYSIS_LONG_EDGE) costs no accuracy.
+    "torch-fullres": {
+        "TROCR_ENGINE": "torch", "TROCR_QUANTIZE": "", "TROCR_CASCADE_MODEL": "", "OCR_ANALYSIS_LONG_EDGE": "0",
+    },
+    # A small checkpoint first, the main one only for crops it is unsure of;
+    # TROCR_CASCADE_MODEL in the environment picks the small checkpoint.
+    "torch-cascade": {
+        "TROCR_ENGINE": "torch", "TROCR_QUANTIZE": "",
+        "TROCR_CASCADE_MODEL": os.getenv("TROCR_CASCADE_MODEL") or "microsoft/trocr-base-handwritten",
+    },
+}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _parse_overrides(pairs: List[str]) -> Dict[str, str]:
+    overrides = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep or not key:
+            raise SystemExit(f"--set expects KEY=VALUE, got {pair!r}")
+        overrides[key] = value
+    return overrides
+
+
+def run_engine(args: argparse.Namespace) -> Dict[str, Any]:
+    """Benchmark the engine configured in os.environ; imports happen here on purpose."""
+    from benchmarks.metrics import score_receipt, summarise
+    from benchmarks.synth import render_receipt
+    from app.ocr.receipt_pipeline import process_receipt
+
+    seeds = list(range(args.seed, args.seed + args.n))
+    receipts = [
+        render_receipt(
+            s, max_skew_deg=args.max_skew, noise=args.noise, hand_font=args.hand_font,
+            long_edge=args.long_edge,
+        )
+        for s in seeds
+    ]
+    if args.dump_dir:
+        out = Path(args.dump_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        for s, (image_bytes, truth) in zip(seeds, receipts):
+            (out / f"agw_{s:05d}.jpg").write_bytes(image_bytes)
+            (out / f"agw_{s:05d}.json").write_text(json.dumps(truth, indent=2), encoding="utf-8")
+
+    # Untimed warm-up so model loading does not land in the first latency.
+    for image_bytes, _ in receipts[:args.warmup]:
+        process_receipt(image_bytes)
+
+    latencies: List[float] = []
+    stage_ms: Dict[str, List[float]] = {}
+    engine_ms: Dict[str, List[float]] = {}
+    engine_calls: Dict[str, List[int]] = {}
+    counts: Dict[str, int] = {}
+    scores = []
+    for i, (image_bytes, truth) in enumerate(receipts, start=1):
+        t0 = time.perf_counter()
+        result = process_receipt(image_bytes)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        timings = result.get("timings", {})
+        for name, ms in timings.get("stages", {}).items():
+            stage_ms.setdefault(name, []).append(ms)
+        for name, entry in timings.get("engines", {}).items():
+            engine_ms.setdefault(name, []).append(entry["ms"])
+            engine_calls.setdefault(name, []).append(entry["calls"])
+        for name, n in timings.get("counts", {}).items():
+            counts[name] = counts.get(name, 0) + n
+        scores.append(score_receipt(result, truth))
+        if i % 10 == 0 or i == len(receipts):
+            print(f"  [{i}/{len(receipts)}] last {latencies[-1]:.0f} ms", file=sys.stderr, flush=True)
+
+    return {
+        "n": len(receipts),
+        "throughput_per_s": round(len(latencies) / (sum(latencies) / 1000), 3),
+        "latency_ms": {
+            "mean": round(mean(latencies), 1),
+            "p50": round(_percentile(latencies, 0.50), 1),
+            "p95": round(_percentile(latencies, 0.95), 1),
+            "max": round(max(latencies), 1),
+        },
+        "stages_ms": {name: round(mean(v), 1) for name, v in stage_ms.items()},
+        "engines": {
+            name: {"ms": round(mean(v), 1), "calls": round(mean(engine_calls[name]), 1)}
+            for name, v in engine_ms.items()
+        },
+        "counts": {name: round(n / len(receipts), 1) for name, n in counts.items()},
+        "escalation_rate": _escalation_rate(counts),
+        "accuracy": summarise(scores),
+    }
+
+
+def _escalation_rate(counts: Dict[str, int]) -> Optional[float]:
+    """Share of crops the cascade model passed on to the main model; None without a cascade."""
+    if "trocr_escalated" not in counts:
+        return None
+    # trocr_crops counts the cascade pass and the escalated re-reads.
+    first_pass = counts.get("trocr_crops", 0) - counts["trocr_escalated"]
+    return round(counts["trocr_escalated"] / first_pass, 3) if first_pass else 0.0
+
+
+def _print_report(reports: Dict[str, Dict[str, Any]]) -> None:
+    names = list(reports)
+    width = max(12, *(len(n) for n in names)) + 2
+
+    def row(label: str, values: List[str]) -> None:
+        print(f"  {label:<22}" + "".join(f"{v:>{width}}" for v in values))
+
+    print("=" * (24 + width * len(names)))
+    print(f"  AGW synthetic benchmark  (n={reports[names[0]]['n']})")
+    print("=" * (24 + width * len(names)))
+    row("", names)
+    row("throughput (rcpt/s)", [f"{reports[n]['throughput_per_s']:.2f}" for n in names])
+    for key in ("mean", "p50", "p95", "max"):
+        row(f"latency {key} (ms)", [f"{reports[n]['latency_ms'][key]:.0f}" for n in names])
+
+    print("\n  Mean time per stage (ms)")
+    stages = list(dict.fromkeys(s for n in names for s in reports[n]["stages_ms"]))
+    for stage in stages:
+        row(stage, [f"{reports[n]['stages_ms'].get(stage, 0.0):.0f}" for n in names])
+    engines = list(dict.fromkeys(e for n in names for e in reports[n]["engines"]))
+    for engine in engines:
+        row(f"{engine} (calls)", [
+            f"{reports[n]['engines'][engine]['ms']:.0f} ({reports[n]['engines'][engine]['calls']:g})"
+            if engine in reports[n]["engines"] else "-"
+            for n in names
+        ])
+
+    print("\n  Counts per receipt")
+    names_counts = list(dict.fromkeys(c for n in names for c in reports[n].get("counts", {})))
+    for name in names_counts:
+        row(name, [f"{reports[n]['counts'].get(name, 0):g}" for n in names])
+    if any(reports[n].get("escalation_rate") is not None for n in names):
+        row("escalation rate", [
+            f"{reports[n]['escalation_rate']:.3f}" if reports[n].get("escalation_rate") is not None else "-"
+            for n in names
+        ])
+
+    print("\n  Field accuracy")
+    fields = list(dict.fromkeys(f for n in names for f in reports[n]["accuracy"]))
+    for field in fields:
+        row(field, [f"{reports[n]['accuracy'].get(field, 0.0):.3f}" for n in names])
+
+
+def _strip_engines(argv: List[str]) -> List[str]:
+    """Drop --engine/--save-json from argv so each child runs one engine quietly."""
+    out, skip = [], False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        if arg in ("--engine", "--save-json"):
+            skip = True
+            continue
+        if arg.startswith(("--engine=", "--save-json=")):
+            continue
+        out.append(arg)
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=20, help="Receipts per engine")
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES),
+                        help="Engine preset (repeat to compare); default torch")
+    parser.add_argument("--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment override applied to every engine")
+    parser.add_argument("--seed", type=int, default=1000, help="First generator seed")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed receipts before measuring")
+    parser.add_argument("--max-skew", type=float, default=3.0, help="Max rotation in degrees")
+    parser.add_argument("--noise", type=float, default=6.0, help="Gaussian noise sigma (0-255 scale)")
+    parser.add_argument("--long-edge", type=int, default=None,
+                        help="Resample pages to this long edge, e.g. 4032 for 12 MP photos")
+    parser.add_argument("--hand-font", default=None, help="TTF handwriting font (default: Hershey script)")
+    parser.add_argument("--dump-dir", default=None, help="Also write the generated images and ground truth here")
+    parser.add_argument("--save-json", default=None, help="Write the report to this path")
+    parser.add_argument("--report-json", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    engines = args.engine or ["torch"]
+    overrides = _parse_overrides(args.overrides)
+
+    if len(engines) == 1:
+        os.environ.update({**ENGINES[engines[0]], **overrides})
+        reports = {engines[0]: run_engine(args)}
+    else:
+        reports = {}
+        child_args = list(sys.argv[1:])
+        for name in engines:
+            print(f"\n>> {name}", file=sys.stderr, flush=True)
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+                report_path = tmp.name
+            cmd = [sys.executable, "-m", "benchmarks.run", *_strip_engines(child_args),
+                   "--engine", name, "--report-json", report_path]
+            subprocess.run(cmd, cwd=BACKEND_ROOT, check=True)
+            reports[name] = json.loads(Path(report_path).read_text(encoding="utf-8"))[name]
+            os.unlink(report_path)
+
+    if args.report_json:
+        Path(args.report_json).write_text(json.dumps(reports), encoding="utf-8")
+        return
+
+    _print_report(reports)
+    if args.save_json:
+        Path(args.save_json).write_text(json.dumps(reports, indent=2), encoding="utf-8")
+        print(f"\nSaved report to {args.save_json}")
+
+
+if __name__ == "__main__":
+    main()
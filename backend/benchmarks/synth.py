@@ -0,0 +1,257 @@
+"""Render synthetic AGW invoices with known contents.
+
+The page follows the geometry the pipeline assumes: the crop fractions in
+receipt_pipeline.TEMPLATE and the column and row layout in
+region_detector.TEMPLATE. Each page has:
+
+- a printed letterhead;
+- a red invoice number at the top right;
+- a handwritten customer name and date;
+- a ruled table of 30 rows, with the column-header separator as the widest
+  rule in the top half;
+- three footer boxes for NET TOTAL, VAT and AMOUNT DUE.
+
+Handwriting uses OpenCV's Hershey script fonts with per-character jitter, so
+no font files are needed. Pass `hand_font` (a .ttf path) to use a real
+handwriting font instead. After drawing, the page gets a controlled rotation,
+blur, sensor noise and a JPEG round trip, like a phone photo.
+
+`render_receipt(seed)` is deterministic. It returns the JPEG bytes and a
+ground-truth dict shaped like process_receipt's output.
+"""
+
+import io
+import random
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from app.ocr.receipt_pipeline import TEMPLATE as CROPS
+from app.ocr.region_detector import TEMPLATE as REGIONS
+
+
+@dataclass(frozen=True)
+class PageGeometry:
+    width: int = 1560
+    height: int = 2200
+    table_start_y: int = 550
+    row_pitch: int = 45
+    table_rows: int = 30
+    header_row_h: int = 26
+
+
+PAGE = PageGeometry()
+
+PAPER = (250, 238, 240)
+PRINT_INK = (35, 35, 40)
+RED_INK = (200, 35, 45)
+PEN_INKS = ((25, 40, 130), (20, 20, 30), (30, 30, 90))
+
+PRODUCTS = (
+    "15mm copper pipe", "22mm copper pipe", "15mm compression elbow",
+    "22mm end feed tee", "PTFE tape", "radiator valve pair", "flux paste",
+    "solder wire", "pipe clips 15mm", "washing machine valve",
+    "basin waste", "push fit coupler", "isolating valve", "flexible hose",
+    "immersion heater", "gate valve 22mm", "silicone sealant", "towel rail",
+    "thermostatic valve", "drain cock", "pressure gauge", "expansion vessel",
+)
+SURNAMES = (
+    "Smith", "Jones", "Patel", "Taylor", "Brown", "Wilson", "Khan", "Evans",
+    "Walker", "Wright", "Hughes", "Green", "Hall", "Clarke", "Murphy",
+)
+
+
+def _hershey_text(
+    canvas: np.ndarray, text: str, x: int, baseline: int, height: int,
+    color: Tuple[int, int, int], rng: random.Random, hand: bool,
+) -> int:
+    """Draw `text` one character at a time; returns the x after the last glyph."""
+    font = cv2.FONT_HERSHEY_SCRIPT_SIMPLEX if hand else cv2.FONT_HERSHEY_DUPLEX
+    thickness = 2
+    base_scale = cv2.getFontScaleFromHeight(font, height, thickness)
+    for ch in text:
+        scale = base_scale * (rng.uniform(0.92, 1.08) if hand else 1.0)
+        dy = rng.randint(-2, 2) if hand else 0
+        (cw, _), _ = cv2.getTextSize(ch, font, scale, thickness)
+        if ch != " ":
+            cv2.putText(canvas, ch, (x, baseline + dy), font, scale, color, thickness, cv2.LINE_AA)
+        x += cw + (rng.randint(-1, 2) if hand else 1)
+    return x
+
+
+def _ttf_text(
+    canvas: np.ndarray, text: str, x: int, baseline: int, height: int,
+    color: Tuple[int, int, int], rng: random.Random, font_path: str,
+) -> int:
+    """Like `_hershey_text` but with a TrueType handwriting font."""
+    font = ImageFont.truetype(font_path, size=int(height * 1.4))
+    pil = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(pil)
+    for ch in text:
+        dy = rng.randint(-2, 2)
+        draw.text((x, baseline + dy), ch, font=font, fill=color, anchor="ls")
+        x += int(draw.textlength(ch, font=font)) + rng.randint(-1, 1)
+    canvas[:] = np.asarray(pil)
+    return x
+
+
+def _amount(pence: int) -> str:
+    return f"{pence // 100}.{pence % 100:02d}"
+
+
+def _items(rng: random.Random, n_rows: int) -> List[Dict[str, Any]]:
+    items = []
+    for row in range(1, n_rows + 1):
+        qty = rng.choice((1, 1, 2, 2, 3, 4, 5, 6, 10, 12, 20))
+        unit_pence = rng.randint(45, 6500)
+        items.append({
+            "row": row,
+            "quantity": str(qty),
+            "description": rng.choice(PRODUCTS),
+            "amount": _amount(qty * unit_pence),
+        })
+    return items
+
+
+def render_receipt(
+    seed: int,
+    *,
+    max_skew_deg: float = 3.0,
+    noise: float = 6.0,
+    blur: bool = True,
+    jpeg_quality: int = 85,
+    hand_font: Optional[str] = None,
+    long_edge: Optional[int] = None,
+    page: PageGeometry = PAGE,
+) -> Tuple[bytes, Dict[str, Any]]:
+    """Render invoice number `seed`; returns (jpeg_bytes, ground_truth).
+
+    `long_edge` resamples the finished page to that many pixels on its long
+    side before skew and noise, e.g. 4032 for a 12 MP phone photo.
+    """
+    rng = random.Random(seed)
+    w, h = page.width, page.height
+    canvas = np.full((h, w, 3), PAPER, dtype=np.uint8)
+    pen = rng.choice(PEN_INKS)
+
+    def printed(text: str, x: int, baseline: int, height: int, color=PRINT_INK) -> int:
+        return _hershey_text(canvas, text, x, baseline, height, color, rng, hand=False)
+
+    def written(text: str, x: int, baseline: int, height: int) -> int:
+        if hand_font:
+            return _ttf_text(canvas, text, x, baseline, height, pen, rng, hand_font)
+        return _hershey_text(canvas, text, x, baseline, height, pen, rng, hand=True)
+
+    header_end = page.table_start_y - 5
+
+    # Letterhead, left of the invoice-number block.
+    printed("AGW HEATING & PLUMBING SUPPLIES", int(w * 0.04), 70, 34)
+    printed("Unit 4, Riverside Trading Estate, Leeds LS10 1AB", int(w * 0.04), 120, 20)
+    printed("Tel: 0113 496 0321    VAT No: GB 284 5521 07", int(w * 0.04), 160, 20)
+
+    invoice_number = str(rng.randint(10000, 99999))
+    inv_baseline = int(header_end * CROPS.inv_no_y_end_pct) - 12
+    inv_x = printed("No.", int(w * CROPS.inv_no_x_start) + 20, inv_baseline, 30, RED_INK)
+    printed(invoice_number, inv_x + 14, inv_baseline, 30, RED_INK)
+
+    name = f"{rng.choice('ABCDEGJKLMPRST')} {rng.choice(SURNAMES)}"
+    name_band = (header_end * CROPS.name_y_start_pct, header_end * CROPS.name_y_end_pct)
+    name_baseline = int(name_band[0] + 0.75 * (name_band[1] - name_band[0]))
+    printed("INVOICE TO:", int(w * 0.03), name_baseline, 16)
+    written(name, int(w * CROPS.name_x_start_pct) + 10, name_baseline, 26)
+
+    date = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2022, 2026)}"
+    date_band = (header_end * CROPS.date_y_start_pct, header_end * CROPS.date_y_end_pct)
+    date_baseline = int(date_band[0] + 0.7 * (date_band[1] - date_band[0]))
+    printed("DATE:", int(w * CROPS.date_x_start_pct) - 110, date_baseline, 18)
+    written(date, int(w * CROPS.date_x_start_pct) + 60, date_baseline, 28)
+
+    # Table: a short header row above the separator, then ruled data rows.
+    col_x = [0] + [int(w * f) for f in (
+        REGIONS.col_row_num_end, REGIONS.col_quantity_end,
+        REGIONS.col_description_end, REGIONS.col_unit_price_end,
+    )] + [w - 1]
+    top = page.table_start_y - page.header_row_h
+    bottom = page.table_start_y + page.table_rows * page.row_pitch
+    cv2.line(canvas, (int(w * 0.01), top), (int(w * 0.99), top), PRINT_INK, 2)
+    # The separator runs edge to edge so it is the widest rule in the top band.
+    cv2.line(canvas, (0, page.table_start_y), (w - 1, page.table_start_y), PRINT_INK, 3)
+    for k in range(1, page.table_rows + 1):
+        y = page.table_start_y + k * page.row_pitch
+        cv2.line(canvas, (int(w * 0.01), y), (int(w * 0.99), y), PRINT_INK, 2)
+    for x in col_x[1:-1]:
+        cv2.line(canvas, (x, top), (x, bottom), PRINT_INK, 2)
+    for label, (x1, x2) in zip(
+        ("QTY", "DESCRIPTION", "UNIT PRICE", "AMOUNT"),
+        zip(col_x[1:], col_x[2:]),
+    ):
+        printed(label, x1 + 8, page.table_start_y - 6, 14)
+
+    line_items = _items(rng, rng.randint(3, 14))
+    for item in line_items:
+        y_bot = page.table_start_y + item["row"] * page.row_pitch
+        baseline = y_bot - page.row_pitch // 4
+        text_h = int(page.row_pitch * 0.55)
+        written(item["quantity"], col_x[1] + 18, baseline, text_h)
+        written(item["description"], col_x[2] + 24, baseline, text_h)
+        written(item["amount"], col_x[4] + 20, baseline, text_h)
+
+    net_pence = sum(int(i["amount"].replace(".", "")) for i in line_items)
+    vat_pence = round(net_pence * 0.2)
+    footer = {
+        "net_total": _amount(net_pence),
+        "vat": _amount(vat_pence),
+        "amount_due": _amount(net_pence + vat_pence),
+    }
+
+    # Footer boxes sit inside the band the pipeline crops (see TEMPLATE).
+    table_end = page.table_start_y + (REGIONS.expected_table_rows + 1) * page.row_pitch
+    fh = h - table_end
+    y1 = table_end + int(fh * CROPS.footer_totals_top_pct)
+    box_h = (int(fh * CROPS.footer_totals_bottom_pct) - int(fh * CROPS.footer_totals_top_pct)) // 3
+    box_x1 = int(w * CROPS.footer_label_end_pct) + 10
+    for i, (key, label) in enumerate((("net_total", "NET TOTAL"), ("vat", "VAT"), ("amount_due", "AMOUNT DUE"))):
+        by1 = y1 + i * box_h + 4
+        by2 = by1 + box_h - 8
+        cv2.rectangle(canvas, (box_x1, by1), (w - 20, by2), PRINT_INK, 2)
+        printed(label, int(w * 0.62), by2 - 14, 18)
+        written(footer[key], box_x1 + 24, by2 - 14, int(box_h * 0.45))
+    printed("Goods remain the property of AGW until paid in full", int(w * 0.04), h - 40, 16)
+
+    img = Image.fromarray(canvas)
+    zoom = 1.0
+    if long_edge and long_edge != max(w, h):
+        zoom = long_edge / max(w, h)
+        img = img.resize((round(w * zoom), round(h * zoom)), Image.BICUBIC)
+    angle = rng.uniform(-max_skew_deg, max_skew_deg) if max_skew_deg else 0.0
+    if angle:
+        img = img.rotate(angle, resample=Image.BICUBIC, fillcolor=PAPER)
+    arr = np.asarray(img).astype(np.float32)
+    if blur:
+        arr = cv2.GaussianBlur(arr, (3, 3), 0)
+    if noise:
+        arr += np.random.default_rng(seed).normal(0.0, noise, arr.shape)
+    img = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=jpeg_quality)
+
+    truth = {
+        "invoice_number": invoice_number,
+        "invoice_date": date,
+        "customer": {"name": name},
+        "line_items": line_items,
+        **footer,
+        "skew_deg": round(angle, 2),
+        # Row grid in output pixels, before skew: row k spans
+        # table_start_y + k * row_pitch to table_start_y + (k + 1) * row_pitch.
+        "layout": {
+            "table_start_y": round(page.table_start_y * zoom, 1),
+            "row_pitch": round(page.row_pitch * zoom, 2),
+            "table_rows": page.table_rows,
+        },
+    }
+    return buf.getvalue(), truth
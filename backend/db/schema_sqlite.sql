@@ -137,6 +137,28 @@ CREATE TABLE IF NOT EXISTS audit_log (
   FOREIGN KEY (user_id) REFERENCES users(id)
 );
 
+-- Durable OCR job queue; see db/schema.sql. SQLite has no SKIP LOCKED, so a
+-- worker claims a row by flipping status and claimed_by in one UPDATE.
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+  id TEXT PRIMARY KEY NOT NULL DEFAULT (
+    lower(hex(randomblob(4))) || '-' ||
+    lower(hex(randomblob(2))) || '-' ||
+    lower(hex(randomblob(2))) || '-' ||
+    lower(hex(randomblob(2))) || '-' ||
+    lower(hex(randomblob(6)))
+  ),
+  status TEXT NOT NULL CHECK (status IN ('queued', 'running', 'done', 'failed')) DEFAULT 'queued',
+  image_bytes BLOB,
+  submission_id TEXT,
+  error TEXT,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  claimed_by TEXT,
+  claimed_at TEXT,
+  created_at TEXT NOT NULL DEFAULT (datetime('now')),
+  finished_at TEXT,
+  FOREIGN KEY (submission_id) REFERENCES submissions(id) ON DELETE SET NULL
+);
+
 CREATE UNIQUE INDEX IF NOT EXISTS idx_products_name ON products(name);
 CREATE INDEX IF NOT EXISTS idx_invoice_items_submission_id ON invoice_items(submission_id);
 CREATE INDEX IF NOT EXISTS idx_stock_movements_product_id ON stock_movements(product_id);
@@ -144,4 +166,5 @@ CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_reset_tokens_user ON password_reset_tokens(user_id);
 CREATE INDEX IF NOT EXISTS idx_reset_tokens_expires ON password_reset_tokens(expires_at);
 CREATE INDEX IF NOT EXISTS idx_audit_log_user ON audit_log(user_id);
-CREATE INDEX IF NOT EXISTS idx_audit_log_created ON audit_log(created_at);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_audit_log_created ON audit_log(created_at);
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_status_created ON ocr_jobs(status, created_at);
\ No newline at end of file
@@ -88,10 +88,10 @@ def evaluate_engine(engine: str, pairs: List[Tuple[Path, str]]) -> dict:
     t0 = time.time()
 
     if engine == "tesseract":
-        import pytesseract
+        from app.ocr.tesseract_engine import image_to_string
         for i, (img_path, truth) in enumerate(pairs, 1):
-            pil = Image.open(img_path).convert("RGB")
-            pred = pytesseract.image_to_string(pil, config="--psm 7 --oem 3").strip()
+            arr = np.asarray(Image.open(img_path).convert("RGB"))
+            pred = image_to_string(arr, psm=7).strip()
             scores.append(_cer(pred, truth))
             _report(i, total, scores, t0)
     elif engine == "easyocr":
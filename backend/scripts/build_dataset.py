@@ -26,26 +26,26 @@ from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
-import numpy as np
-from PIL import Image, ImageOps
+import cv2
+from PIL import Image
 
 from app.ocr.handwriting import (
     DEFAULT_MAX_TOKENS,
     _load_handwritten,
     _ocr_with,
-    _pil_to_cv_bgr,
     normalize_document,
 )
 from app.ocr.receipt_pipeline import (
     MAX_TABLE_ROWS,
     TARGET_H,
     _crop_cell,
+    _decode_rgb,
     _has_ink,
     _resize_for_trocr,
     preprocess_cell_for_trocr,
     remove_grid_lines,
 )
-from app.ocr.region_detector import detect_regions, get_column_bounds
+from app.ocr.region_detector import analysis_copy, detect_regions, get_column_bounds
 
 
 def build_dataset(raw_dir: Path, crops_dir: Path, skip_existing: bool = False) -> None:
@@ -78,15 +78,13 @@ def build_dataset(raw_dir: Path, crops_dir: Path, skip_existing: bool = False) -
         out_dir.mkdir(parents=True, exist_ok=True)
         print(f"[{img_idx:3d}/{len(image_paths)}] {invoice_id} ...", end="", flush=True)
 
-        pil_img = Image.open(img_path)
-        pil_img = ImageOps.exif_transpose(pil_img).convert("RGB")
-        pil_img = normalize_document(pil_img)
+        rgb  = normalize_document(_decode_rgb(img_path.read_bytes()))
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        h, w = gray.shape
 
-        cv_img = _pil_to_cv_bgr(pil_img)
-        h, w   = cv_img.shape[:2]
-
-        regions    = detect_regions(cv_img)
-        col_bounds = get_column_bounds(w)
+        analysis   = analysis_copy(gray)
+        regions    = detect_regions(gray, analysis)
+        col_bounds = get_column_bounds(w, regions.get("column_xs"))
 
         row_ys      = regions["row_ys"]
         table_end_y = regions["table_end_y"]
@@ -102,7 +100,7 @@ def build_dataset(raw_dir: Path, crops_dir: Path, skip_existing: bool = False) -
             )
 
         # Grid-line removal (same as inference)
-        cleaned_rgb = remove_grid_lines(pil_img).convert("RGB")
+        cleaned = remove_grid_lines(gray, analysis)
 
         desc_x1, desc_x2 = col_bounds["description"]
         up_x1,   _       = col_bounds["unit_price"]
@@ -122,33 +120,33 @@ def build_dataset(raw_dir: Path, crops_dir: Path, skip_existing: bool = False) -
                 continue
 
             # Skip blank rows (same logic as inference)
-            desc_check = _crop_cell(cleaned_rgb, desc_x1, y_top, desc_x2, y_bot)
+            desc_check = _crop_cell(cleaned, desc_x1, y_top, desc_x2, y_bot)
             if not _has_ink(desc_check):
                 continue
 
             row_entry = {"row": row_idx, "crops": []}
 
             # Description crop
-            desc_raw  = _crop_cell(cleaned_rgb, desc_x1 + 50, y_top, desc_x2, y_bot)
+            desc_raw  = _crop_cell(cleaned, desc_x1 + 50, y_top, desc_x2, y_bot)
             desc_pre  = preprocess_cell_for_trocr(desc_raw)
             desc_in   = _resize_for_trocr(desc_pre)
             desc_pred = _ocr_with(processor, model, desc_in,
                                   max_new_tokens=DEFAULT_MAX_TOKENS)
 
             stem = f"row_{row_idx:02d}_description"
-            desc_pre.save(out_dir / f"{stem}.png")
+            Image.fromarray(desc_pre).save(out_dir / f"{stem}.png")
             (out_dir / f"{stem}.txt").write_text(desc_pred, encoding="utf-8")
             row_entry["crops"].append({"col": "description", "pred": desc_pred})
 
             # Amount crop (unit_price + amount combined)
-            amt_raw  = _crop_cell(cleaned_rgb, up_x1, y_top, am_x2, y_bot)
+            amt_raw  = _crop_cell(cleaned, up_x1, y_top, am_x2, y_bot)
             if _has_ink(amt_raw):
                 amt_pre  = preprocess_cell_for_trocr(amt_raw)
                 amt_in   = _resize_for_trocr(amt_pre)
                 amt_pred = _ocr_with(processor, model, amt_in,
                                      max_new_tokens=DEFAULT_MAX_TOKENS)
                 a_stem = f"row_{row_idx:02d}_amount"
-                amt_pre.save(out_dir / f"{a_stem}.png")
+                Image.fromarray(amt_pre).save(out_dir / f"{a_stem}.png")
                 (out_dir / f"{a_stem}.txt").write_text(amt_pred, encoding="utf-8")
                 row_entry["crops"].append({"col": "amount", "pred": amt_pred})
 
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+distill_trocr.py - Distils the fine-tuned TrOCR into a compact student.
+
+The teacher (the fine-tuned large model) reads every crop in data/crops/,
+labelled or not, and its n-best beam hypotheses, weighted by their
+probabilities, become soft sequence targets for the student. When the
+student shares the teacher's tokenizer, the student also matches the
+teacher's per-token distributions along its best reading (temperature-scaled
+KL). Crops a human has reviewed in label_helper.py add their label as a
+hard target on top; a crop marked blank is left out.
+
+The student is a TrOCR checkpoint (default microsoft/trocr-small-handwritten,
+~60M parameters against ~560M for trocr-large), so the pipeline loads it
+like any other checkpoint: as TROCR_HANDWRITTEN_MODEL, as the small half of
+TROCR_CASCADE_MODEL, with TROCR_QUANTIZE=int8, or exported to ONNX with
+export_trocr_onnx.py. The run ends by timing teacher and student per cell
+on CPU.
+
+Steps before running this:
+  1. python scripts/build_dataset.py
+  2. python scripts/finetune_trocr.py     (the teacher)
+  3. cd backend && source venv/bin/activate
+     python scripts/distill_trocr.py [--epochs 20] [--batch-size 16]
+
+Teacher targets are cached in data/trocr-student/teacher_targets.json,
+so a second run with the same teacher skips the teacher pass.
+Best student saved to data/trocr-student/final/
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from transformers import TrOCRProcessor, VisionEncoderDecoderModel, get_cosine_schedule_with_warmup
+
+from app.ocr.handwriting import _checkpoint_slug
+from scripts.finetune_trocr import CROPS_DIR, DATA_ROOT, TARGET_H, _cer
+
+# Config
+
+TEACHER_MODEL = os.getenv("TROCR_HANDWRITTEN_MODEL", "microsoft/trocr-large-handwritten")
+FINETUNED_DIR = DATA_ROOT / "trocr-finetuned" / "final"
+STUDENT_MODEL = "microsoft/trocr-small-handwritten"
+OUTPUT_DIR    = DATA_ROOT / "trocr-student"
+MAX_LENGTH    = 64
+
+
+# Crops: every PNG of the chosen column, with the human label where one exists.
+
+def _load_crops(crops_dir: Path, col_filter: Optional[str], trust_txt: bool) -> List[Tuple[Path, Optional[str]]]:
+    """(image_path, label or None) for every crop; blanks marked in label_helper.py are skipped.
+
+    A label counts only if label_helper.py recorded the crop as reviewed,
+    since an unreviewed .txt is just build_dataset.py's first TrOCR guess.
+    trust_txt=True takes every non-empty .txt as a label (e.g. after
+    extract_labels_from_db.py wrote them).
+    """
+    progress_file = crops_dir / ".label_progress.json"
+    reviewed = set(json.loads(progress_file.read_text())) if progress_file.exists() else set()
+
+    crops: List[Tuple[Path, Optional[str]]] = []
+    for img_path in sorted(crops_dir.rglob("*.png")):
+        if col_filter and f"_{col_filter}" not in img_path.stem:
+            continue
+        txt_path = img_path.with_suffix(".txt")
+        text = txt_path.read_text(encoding="utf-8").strip() if txt_path.exists() else ""
+        is_reviewed = str(txt_path) in reviewed
+        if is_reviewed and not text:
+            continue
+        crops.append((img_path, text if text and (is_reviewed or trust_txt) else None))
+    return crops
+
+
+def _load_image(img_path: Path) -> Image.Image:
+    """The crop resized to TrOCR input height, as finetune_trocr.py feeds it."""
+    pil_img = Image.open(img_path).convert("RGB")
+    w, h = pil_img.size
+    if h > 0:
+        scale   = TARGET_H / h
+        pil_img = pil_img.resize((max(1, int(w * scale)), TARGET_H), Image.LANCZOS)
+    return pil_img
+
+
+def _augment(img: Image.Image) -> Image.Image:
+    """Random rotation, brightness and blur, as in finetune_trocr.py."""
+    from PIL import ImageEnhance, ImageFilter
+
+    if random.random() < 0.5:
+        img = img.rotate(random.uniform(-3, 3), fillcolor=255, expand=False)
+    if random.random() < 0.5:
+        img = ImageEnhance.Brightness(img).enhance(random.uniform(0.8, 1.2))
+    if random.random() < 0.3:
+        img = img.filter(ImageFilter.GaussianBlur(radius=0.5))
+    return img
+
+
+# Teacher pass: n-best readings of every crop, cached per teacher checkpoint.
+
+def teacher_targets(
+    teacher: VisionEncoderDecoderModel,
+    processor: TrOCRProcessor,
+    crops: List[Tuple[Path, Optional[str]]],
+    n_best: int,
+    temperature: float,
+    cache_path: Path,
+    teacher_id: str,
+    batch_size: int,
+) -> Dict[str, List[Tuple[str, float]]]:
+    """For each crop, up to n_best (>= 1) (text, weight) pairs whose weights sum to 1.
+
+    Weights are a softmax over the beam scores (length-normalised log-probs)
+    divided by `temperature`; a higher temperature spreads weight onto the
+    runner-up readings.
+    """
+    cache: Dict[str, object] = {}
+    if cache_path.exists():
+        cache = json.loads(cache_path.read_text(encoding="utf-8"))
+    key = f"{teacher_id}:n{n_best}:t{temperature:g}"
+    targets: Dict[str, List[Tuple[str, float]]] = {
+        path: [tuple(t) for t in entries] for path, entries in cache.get(key, {}).items()
+    }
+    todo = [img_path for img_path, _ in crops if str(img_path) not in targets]
+    if not todo:
+        return targets
+
+    print(f"  Teacher reading {len(todo)} crops ({len(targets)} cached)")
+    teacher.eval()
+    for start in range(0, len(todo), batch_size):
+        chunk = todo[start:start + batch_size]
+        pixel_values = processor(images=[_load_image(p) for p in chunk], return_tensors="pt").pixel_values
+        with torch.no_grad():
+            out = teacher.generate(
+                pixel_values.to(teacher.device),
+                max_new_tokens=MAX_LENGTH,
+                num_beams=n_best,
+                num_return_sequences=n_best,
+                output_scores=True,
+                return_dict_in_generate=True,
+            )
+        texts  = processor.batch_decode(out.sequences, skip_special_tokens=True)
+        # Greedy decoding (n_best=1) returns no sequence scores; one reading gets all the weight.
+        scores = (out.sequences_scores.view(len(chunk), -1).float().cpu() if n_best > 1
+                  else torch.zeros(len(chunk), 1))
+        for i, img_path in enumerate(chunk):
+            weights = torch.softmax(scores[i] / temperature, dim=0).tolist()
+            merged: Dict[str, float] = {}
+            for text, weight in zip(texts[i * n_best:(i + 1) * n_best], weights):
+                merged[text.strip()] = merged.get(text.strip(), 0.0) + weight
+            targets[str(img_path)] = sorted(merged.items(), key=lambda kv: -kv[1])
+        print(f"    [{min(start + batch_size, len(todo))}/{len(todo)}]")
+
+    cache[key] = targets
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_path.write_text(json.dumps(cache, ensure_ascii=False), encoding="utf-8")
+    return targets
+
+
+# Student training data: pixel values for student (and teacher, for the
+# token-level term) plus the weighted target texts.
+
+class DistillDataset(Dataset):
+    def __init__(
+        self,
+        crops: List[Tuple[Path, Optional[str]]],
+        targets: Dict[str, List[Tuple[str, float]]],
+        student_processor: TrOCRProcessor,
+        teacher_processor: Optional[TrOCRProcessor],
+        label_weight: float,
+        augment: bool = False,
+    ):
+        self.crops             = crops
+        self.targets           = targets
+        self.student_processor = student_processor
+        self.teacher_processor = teacher_processor
+        self.label_weight      = label_weight
+        self.augment           = augment
+
+    def __len__(self) -> int:
+        return len(self.crops)
+
+    def __getitem__(self, idx: int) -> dict:
+        img_path, label = self.crops[idx]
+        pil_img = _load_image(img_path)
+        if self.augment:
+            pil_img = _augment(pil_img)
+
+        soft = self.targets[str(img_path)]
+        if label is not None:
+            # A human label takes label_weight of the total; the teacher the rest.
+            texts   = [label] + [text for text, _ in soft]
+            weights = [self.label_weight] + [w * (1.0 - self.label_weight) for _, w in soft]
+        else:
+            texts   = [text for text, _ in soft]
+            weights = [w for _, w in soft]
+
+        item = {
+            "pixel_values": self.student_processor(images=pil_img, return_tensors="pt").pixel_values[0],
+            "texts":        texts,
+            "weights":      weights,
+            "best":         soft[0][0],
+        }
+        if self.teacher_processor is not None:
+            item["teacher_pixel_values"] = self.teacher_processor(images=pil_img, return_tensors="pt").pixel_values[0]
+        return item
+
+
+def _collate(batch: List[dict]) -> dict:
+    out = {
+        "pixel_values": torch.stack([b["pixel_values"] for b in batch]),
+        "texts":        [b["texts"] for b in batch],
+        "weights":      [b["weights"] for b in batch],
+        "best":         [b["best"] for b in batch],
+    }
+    if "teacher_pixel_values" in batch[0]:
+        out["teacher_pixel_values"] = torch.stack([b["teacher_pixel_values"] for b in batch])
+    return out
+
+
+def _tokenize(processor: TrOCRProcessor, texts: List[str], device) -> torch.Tensor:
+    """Label ids padded with -100, each ending in EOS so the student learns
+    where to stop (and an empty reading is a valid target)."""
+    tok = processor.tokenizer
+    eos_id = tok.sep_token_id if tok.sep_token_id is not None else tok.eos_token_id
+    rows = []
+    for ids in tok(texts, max_length=MAX_LENGTH, truncation=True).input_ids:
+        if not ids or ids[-1] != eos_id:
+            ids = ids[:MAX_LENGTH - 1] + [eos_id]
+        rows.append(ids)
+    labels = torch.full((len(rows), max(len(r) for r in rows)), -100, dtype=torch.long)
+    for i, ids in enumerate(rows):
+        labels[i, :len(ids)] = torch.tensor(ids)
+    return labels.to(device)
+
+
+def distillation_loss(
+    student: VisionEncoderDecoderModel,
+    processor: TrOCRProcessor,
+    batch: dict,
+    teacher: Optional[VisionEncoderDecoderModel],
+    kl_weight: float,
+    kl_temperature: float,
+) -> torch.Tensor:
+    """Weighted cross-entropy over every target text, plus the token-level KL
+    towards the teacher when `teacher` is given (shared tokenizer only)."""
+    device = student.device
+    pixel_values = batch["pixel_values"].to(device)
+    encoder_hidden = student.encoder(pixel_values=pixel_values).last_hidden_state
+
+    # One row per (crop, target text); each crop is encoded once.
+    owner   = [i for i, texts in enumerate(batch["texts"]) for _ in texts]
+    texts   = [text for texts in batch["texts"] for text in texts]
+    weights = torch.tensor([w for ws in batch["weights"] for w in ws], device=device)
+    labels  = _tokenize(processor, texts, device)
+    logits  = student(encoder_outputs=(encoder_hidden[owner],), labels=labels).logits
+
+    token_nll = F.cross_entropy(logits.transpose(1, 2), labels, ignore_index=-100, reduction="none")
+    per_text  = token_nll.sum(1) / (labels != -100).sum(1).clamp(min=1)
+    loss = (per_text * weights).sum() / len(batch["texts"])
+
+    if teacher is not None and kl_weight > 0:
+        best = _tokenize(processor, batch["best"], device)
+        with torch.no_grad():
+            teacher_logits = teacher(pixel_values=batch["teacher_pixel_values"].to(device), labels=best).logits
+        student_logits = student(encoder_outputs=(encoder_hidden,), labels=best).logits
+        mask = (best != -100).unsqueeze(-1)
+        t = kl_temperature
+        kl = F.kl_div(
+            F.log_softmax(student_logits / t, dim=-1),
+            F.log_softmax(teacher_logits / t, dim=-1),
+            log_target=True,
+            reduction="none",
+        )
+        loss = loss + kl_weight * (t * t) * (kl * mask).sum() / mask.sum().clamp(min=1)
+    return loss
+
+
+def evaluate(student, processor, crops, targets, batch_size: int) -> Dict[str, float]:
+    """Mean CER of greedy student reads against the human label, else the teacher's best reading."""
+    student.eval()
+    cers, exact = [], 0
+    for start in range(0, len(crops), batch_size):
+        chunk = crops[start:start + batch_size]
+        pixel_values = processor(images=[_load_image(p) for p, _ in chunk], return_tensors="pt").pixel_values
+        with torch.no_grad():
+            ids = student.generate(pixel_values.to(student.device), max_new_tokens=MAX_LENGTH, num_beams=1)
+        for (img_path, label), pred in zip(chunk, processor.batch_decode(ids, skip_special_tokens=True)):
+            ref = label if label is not None else targets[str(img_path)][0][0]
+            cers.append(_cer(pred.strip().lower(), ref.strip().lower()))
+            exact += pred.strip().lower() == ref.strip().lower()
+    student.train()
+    return {"cer": round(float(np.mean(cers)), 4), "word_acc": round(exact / max(len(crops), 1), 4)}
+
+
+def cpu_ms_per_cell(model, processor, crops, n: int = 20) -> float:
+    """Mean greedy-decode time per cell on CPU, one cell at a time as the pipeline's slowest path."""
+    model = model.to("cpu").eval()
+    times = []
+    for i, (img_path, _) in enumerate(crops[:n + 1]):
+        pixel_values = processor(images=_load_image(img_path), return_tensors="pt").pixel_values
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            model.generate(pixel_values, max_new_tokens=MAX_LENGTH, num_beams=1)
+        if i:  # the first read warms up and is not counted
+            times.append(time.perf_counter() - t0)
+    return round(float(np.mean(times)) * 1000, 1) if times else 0.0
+
+
+def _same_tokenizer(a: TrOCRProcessor, b: TrOCRProcessor) -> bool:
+    return a.tokenizer.get_vocab() == b.tokenizer.get_vocab()
+
+
+def _configure_decoding(model: VisionEncoderDecoderModel, processor: TrOCRProcessor) -> None:
+    """Token ids as finetune_trocr.py sets them; greedy decoding, since beams
+    would spend the speed the student is for."""
+    tok = processor.tokenizer
+    start_id = tok.cls_token_id if tok.cls_token_id is not None else tok.bos_token_id
+    eos_id   = tok.sep_token_id if tok.sep_token_id is not None else tok.eos_token_id
+    for cfg in (model.config, model.generation_config):
+        cfg.decoder_start_token_id = start_id
+        cfg.pad_token_id           = tok.pad_token_id
+        cfg.eos_token_id           = eos_id
+    model.generation_config.num_beams = 1
+    model.generation_config.max_length = MAX_LENGTH
+
+
+# Training entry point.
+
+def main():
+    parser = argparse.ArgumentParser(description="Distil the fine-tuned TrOCR into a compact student")
+    parser.add_argument("--crops-dir",   default=None)
+    parser.add_argument("--output-dir",  default=None)
+    parser.add_argument("--teacher",     default=None,
+                        help="Teacher checkpoint (default: data/trocr-finetuned/final, else TROCR_HANDWRITTEN_MODEL)")
+    parser.add_argument("--student",     default=STUDENT_MODEL,
+                        help="Checkpoint the student starts from")
+    parser.add_argument("--epochs",      type=int,   default=20)
+    parser.add_argument("--batch-size",  type=int,   default=16)
+    parser.add_argument("--lr",          type=float, default=1e-4)
+    parser.add_argument("--col",         default="description",
+                        help="Column to train on: description | amount | all")
+    parser.add_argument("--n-best",      type=int,   default=4,
+                        help="Teacher hypotheses per crop used as soft targets")
+    parser.add_argument("--seq-temperature", type=float, default=1.0,
+                        help="Temperature on the teacher's beam scores")
+    parser.add_argument("--kl-weight",   type=float, default=1.0,
+                        help="Weight of the token-level KL term (shared tokenizer only)")
+    parser.add_argument("--kl-temperature", type=float, default=2.0)
+    parser.add_argument("--label-weight", type=float, default=0.5,
+                        help="Share of a reviewed crop's target taken by its human label")
+    parser.add_argument("--trust-txt",   action="store_true",
+                        help="Use every non-empty .txt as a label, not only crops reviewed in label_helper.py")
+    parser.add_argument("--no-augment",  action="store_true")
+    args = parser.parse_args()
+    if args.n_best < 1:
+        parser.error("--n-best must be at least 1")
+
+    crops_dir  = Path(args.crops_dir)  if args.crops_dir  else CROPS_DIR
+    output_dir = Path(args.output_dir) if args.output_dir else OUTPUT_DIR
+    teacher_name = args.teacher or (str(FINETUNED_DIR) if FINETUNED_DIR.exists() else TEACHER_MODEL)
+
+    if torch.cuda.is_available():
+        device = "cuda"
+    elif torch.backends.mps.is_available():
+        device = "mps"
+    else:
+        device = "cpu"
+        print("No GPU found - distilling on CPU (will be slow)")
+
+    col_filter = None if args.col == "all" else args.col
+    crops = _load_crops(crops_dir, col_filter, args.trust_txt)
+    if not crops:
+        print(f"\nNo crops found in {crops_dir}. Run build_dataset.py first.")
+        sys.exit(1)
+    n_labelled = sum(label is not None for _, label in crops)
+    print(f"Found {len(crops)} crops (column: {args.col}), {n_labelled} with a human label")
+
+    print(f"\nLoading teacher: {teacher_name}")
+    teacher_processor = TrOCRProcessor.from_pretrained(teacher_name)
+    teacher = VisionEncoderDecoderModel.from_pretrained(teacher_name).to(device).eval()
+    targets = teacher_targets(
+        teacher, teacher_processor, crops, args.n_best, args.seq_temperature,
+        output_dir / "teacher_targets.json", _checkpoint_slug(teacher_name), args.batch_size,
+    )
+
+    print(f"\nLoading student: {args.student}")
+    processor = TrOCRProcessor.from_pretrained(args.student)
+    student   = VisionEncoderDecoderModel.from_pretrained(args.student).to(device)
+    _configure_decoding(student, processor)
+    token_kd = args.kl_weight > 0 and _same_tokenizer(processor, teacher_processor)
+    if not token_kd:
+        # Without a shared vocabulary only the sequence-level targets apply.
+        teacher = teacher.to("cpu")
+        if args.kl_weight > 0:
+            print("Student and teacher tokenizers differ: distilling from the teacher's n-best readings only")
+
+    # Hold out 15% of the labelled crops (all crops if none are labelled).
+    random.seed(42)
+    held_from = [c for c in crops if c[1] is not None] or crops
+    eval_crops = random.sample(held_from, max(1, int(len(held_from) * 0.15)))
+    eval_set   = set(p for p, _ in eval_crops)
+    train_crops = [c for c in crops if c[0] not in eval_set]
+
+    train_ds = DistillDataset(
+        train_crops, targets, processor, teacher_processor if token_kd else None,
+        args.label_weight, augment=not args.no_augment,
+    )
+    loader = DataLoader(train_ds, batch_size=args.batch_size, shuffle=True, collate_fn=_collate, num_workers=0)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, weight_decay=0.01)
+    total_steps = max(1, args.epochs * len(loader))
+    scheduler = get_cosine_schedule_with_warmup(optimizer, int(0.1 * total_steps), total_steps)
+
+    print(f"Train: {len(train_crops)}  |  Eval: {len(eval_crops)}")
+    print(f"Epochs: {args.epochs}  |  Batch: {args.batch_size}  |  LR: {args.lr}")
+    print(f"Targets: {args.n_best}-best teacher readings"
+          f"{' + token-level KL' if token_kd else ''}"
+          f"{' + human labels' if n_labelled else ''}")
+
+    final_dir = output_dir / "final"
+    history, best_cer = [], math.inf
+    student.train()
+    for epoch in range(1, args.epochs + 1):
+        losses = []
+        for batch in loader:
+            loss = distillation_loss(
+                student, processor, batch, teacher if token_kd else None, args.kl_weight, args.kl_temperature,
+            )
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(student.parameters(), 1.0)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            losses.append(loss.item())
+
+        metrics = evaluate(student, processor, eval_crops, targets, args.batch_size)
+        history.append({"epoch": epoch, "loss": round(float(np.mean(losses)), 4), **metrics})
+        print(f"  epoch {epoch:>3}  loss {history[-1]['loss']:.4f}  eval CER {metrics['cer']:.4f}")
+        if metrics["cer"] < best_cer:
+            best_cer = metrics["cer"]
+            student.save_pretrained(final_dir)
+            processor.save_pretrained(final_dir)
+
+    # CPU cost per cell of the teacher and the best student.
+    best_student = VisionEncoderDecoderModel.from_pretrained(final_dir)
+    teacher_ms = cpu_ms_per_cell(teacher, teacher_processor, eval_crops)
+    student_ms = cpu_ms_per_cell(best_student, processor, eval_crops)
+
+    stats = {
+        "teacher": teacher_name, "student_init": args.student,
+        "train_samples": len(train_crops), "eval_samples": len(eval_crops),
+        "labelled_samples": n_labelled, "token_level_kd": token_kd,
+        "n_best": args.n_best, "epochs": args.epochs, "batch_size": args.batch_size, "lr": args.lr,
+        "best_eval_cer": best_cer, "history": history,
+        "teacher_params_m": round(sum(p.numel() for p in teacher.parameters()) / 1e6, 1),
+        "student_params_m": round(sum(p.numel() for p in best_student.parameters()) / 1e6, 1),
+        "teacher_cpu_ms_per_cell": teacher_ms, "student_cpu_ms_per_cell": student_ms,
+    }
+    (output_dir / "distill_stats.json").write_text(json.dumps(stats, indent=2), encoding="utf-8")
+
+    print(f"\n{'='*60}")
+    print("Distillation complete!")
+    print(f"  Student:         {final_dir}")
+    print(f"  Best eval CER:   {best_cer:.4f}")
+    print(f"  Parameters:      {stats['teacher_params_m']}M -> {stats['student_params_m']}M")
+    if student_ms:
+        print(f"  CPU ms per cell: {teacher_ms} -> {student_ms}  ({teacher_ms / student_ms:.1f}x faster)")
+    print()
+    print("To serve the student (alone, or in front of the teacher):")
+    print(f"  export TROCR_HANDWRITTEN_MODEL={final_dir}")
+    print(f"  export TROCR_CASCADE_MODEL={final_dir}")
+    print()
+    print("To compare it with the teacher on the labelled crops:")
+    print(f"  python scripts/evaluate_pipeline.py --cascade {final_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,12 +13,15 @@ Usage:
     cd backend && source venv/bin/activate
     python scripts/evaluate_pipeline.py
     python scripts/evaluate_pipeline.py --save-json
+    python scripts/evaluate_pipeline.py --compare-int8   # fp32 vs int8 CER + latency
+    python scripts/evaluate_pipeline.py --cascade microsoft/trocr-base-handwritten
 """
 
 import argparse
 import json
 import os
 import sys
+import time
 from pathlib import Path
 from typing import List, Tuple
 
@@ -77,31 +80,52 @@ def load_corrected_pairs(crops_dir: Path, col: str = "description") -> List[Tupl
     return pairs
 
 
-def evaluate_model(model_name: str, pairs: List[Tuple[Path, str]], target_h: int = 64) -> dict:
-    """Run a model on all crops and compute CER/WER vs ground truth."""
+def _load_crop(img_path: Path, target_h: int) -> Image.Image:
+    pil_img = Image.open(img_path).convert("RGB")
+    w, h = pil_img.size
+    if h > 0:
+        scale   = target_h / h
+        pil_img = pil_img.resize((max(1, int(w*scale)), target_h), Image.LANCZOS)
+    return pil_img
+
+
+def evaluate_model(
+    model_name: str,
+    pairs: List[Tuple[Path, str]],
+    target_h: int = 64,
+    quantize: bool = False,
+) -> dict:
+    """Run a model on all crops and compute CER/WER vs ground truth.
+
+    quantize=True loads the model the way the pipeline does with
+    TROCR_QUANTIZE=int8 (dynamic int8 Linear layers, cached on disk).
+    """
     from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 
-    print(f"\n  Loading: {model_name}")
+    print(f"\n  Loading: {model_name}{' (int8)' if quantize else ''}")
     processor = TrOCRProcessor.from_pretrained(model_name)
-    model     = VisionEncoderDecoderModel.from_pretrained(model_name)
+    if quantize:
+        from app.ocr.handwriting import _load_quantized
+        model = _load_quantized(model_name)
+    else:
+        model = VisionEncoderDecoderModel.from_pretrained(model_name)
     model.eval()
 
     cer_scores  = []
     wer_scores  = []
+    latencies   = []
     exact_match = 0
     examples    = []
 
     for i, (img_path, ground_truth) in enumerate(pairs):
-        pil_img = Image.open(img_path).convert("RGB")
-        w, h = pil_img.size
-        if h > 0:
-            scale   = target_h / h
-            pil_img = pil_img.resize((max(1, int(w*scale)), target_h), Image.LANCZOS)
+        pil_img = _load_crop(img_path, target_h)
 
         pixel_values = processor(images=pil_img, return_tensors="pt").pixel_values
         import torch
+        t0 = time.perf_counter()
         with torch.no_grad():
             ids = model.generate(pixel_values, max_new_tokens=64)
+        latencies.append(time.perf_counter() - t0)
         pred = processor.batch_decode(ids, skip_special_tokens=True)[0].strip()
 
         cer = _cer(pred, ground_truth)
@@ -125,16 +149,109 @@ def evaluate_model(model_name: str, pairs: List[Tuple[Path, str]], target_h: int
     import numpy as np
     return {
         "model":       model_name,
+        "quantized":   quantize,
         "n_samples":   len(pairs),
         "mean_cer":    round(float(np.mean(cer_scores)),  4),
         "median_cer":  round(float(np.median(cer_scores)), 4),
         "mean_wer":    round(float(np.mean(wer_scores)),  4),
         "exact_match": round(exact_match / len(pairs),    4),
         "word_acc":    round(exact_match / len(pairs) * 100, 1),
+        "mean_latency_ms": round(float(np.mean(latencies)) * 1000, 1),
+        "p95_latency_ms":  round(float(np.percentile(latencies, 95)) * 1000, 1),
         "examples":    examples,
     }
 
 
+def compare_quantized(model_name: str, pairs: List[Tuple[Path, str]]) -> dict:
+    """Evaluate the same checkpoint in fp32 and int8 and print them side by side."""
+    fp32 = evaluate_model(model_name, pairs)
+    int8 = evaluate_model(model_name, pairs, quantize=True)
+
+    print(f"\n{'='*60}")
+    print(f"  FP32 vs INT8  ({model_name})")
+    print(f"{'='*60}")
+    print(f"  {'':<18}{'fp32':>12}{'int8':>12}")
+    for key, label in (
+        ("mean_cer",        "Mean CER"),
+        ("mean_wer",        "Mean WER"),
+        ("word_acc",        "Exact match %"),
+        ("mean_latency_ms", "Mean ms/crop"),
+        ("p95_latency_ms",  "p95 ms/crop"),
+    ):
+        print(f"  {label:<18}{fp32[key]:>12}{int8[key]:>12}")
+    speedup = fp32["mean_latency_ms"] / int8["mean_latency_ms"] if int8["mean_latency_ms"] else 0.0
+    print(f"  Speedup:          {speedup:.2f}x")
+    return {"fp32": fp32, "int8": int8, "speedup": round(speedup, 2)}
+
+
+def _reads_with_confidence(model_name: str, pairs: List[Tuple[Path, str]], target_h: int = 64) -> List[Tuple[str, float, float]]:
+    """(prediction, confidence, seconds) per crop, loaded and scored the way the
+    pipeline does (TROCR_ENGINE, TROCR_QUANTIZE and the same 0-1 confidence)."""
+    from app.ocr.handwriting import _load_checkpoint, _ocr_batch_with_confidence
+
+    print(f"\n  Loading: {model_name}")
+    processor, model = _load_checkpoint(model_name)
+    reads = []
+    for i, (img_path, _) in enumerate(pairs):
+        pil_img = _load_crop(img_path, target_h)
+        t0 = time.perf_counter()
+        (pred, conf), = _ocr_batch_with_confidence(processor, model, [pil_img], max_new_tokens=64)
+        reads.append((pred, conf, time.perf_counter() - t0))
+        if (i + 1) % 50 == 0:
+            print(f"    [{i+1}/{len(pairs)}]")
+    return reads
+
+
+def evaluate_cascade(
+    small_name: str,
+    large_name: str,
+    pairs: List[Tuple[Path, str]],
+    thresholds: List[float],
+) -> dict:
+    """Escalation rate, CER and latency of TROCR_CASCADE_MODEL=small_name at each threshold.
+
+    Both models read every crop once; a threshold's numbers are then what
+    the cascade would give: the small read where its confidence reaches the
+    threshold, else the large read, with the small model's time always paid
+    and the large model's only for escalated crops.
+    """
+    import numpy as np
+
+    small = _reads_with_confidence(small_name, pairs)
+    large = _reads_with_confidence(large_name, pairs)
+    truths = [truth for _, truth in pairs]
+
+    def summary(label: str, escalated: List[bool], only_large: bool = False) -> dict:
+        preds, latencies = [], []
+        for (s_pred, _, s_sec), (l_pred, _, l_sec), up in zip(small, large, escalated):
+            preds.append(l_pred if up else s_pred)
+            latencies.append(l_sec if only_large else s_sec + (l_sec if up else 0.0))
+        cers = [_cer(pred, truth) for pred, truth in zip(preds, truths)]
+        exact = sum(pred.strip().lower() == truth.strip().lower() for pred, truth in zip(preds, truths))
+        return {
+            "threshold":       label,
+            "escalation_rate": round(sum(escalated) / len(pairs), 4),
+            "mean_cer":        round(float(np.mean(cers)), 4),
+            "word_acc":        round(exact / len(pairs) * 100, 1),
+            "mean_latency_ms": round(float(np.mean(latencies)) * 1000, 1),
+            "p95_latency_ms":  round(float(np.percentile(latencies, 95)) * 1000, 1),
+        }
+
+    rows = [summary("small only", [False] * len(pairs))]
+    for t in thresholds:
+        rows.append(summary(f"{t:g}", [conf < t for _, conf, _ in small]))
+    rows.append(summary("large only", [True] * len(pairs), only_large=True))
+
+    print(f"\n{'='*72}")
+    print(f"  CASCADE  {small_name} -> {large_name}")
+    print(f"{'='*72}")
+    print(f"  {'Threshold':<12}{'Escalated %':>12}{'Mean CER':>10}{'Exact %':>9}{'Mean ms':>10}{'p95 ms':>10}")
+    for row in rows:
+        print(f"  {row['threshold']:<12}{row['escalation_rate']*100:>12.1f}{row['mean_cer']:>10.3f}"
+              f"{row['word_acc']:>9}{row['mean_latency_ms']:>10}{row['p95_latency_ms']:>10}")
+    return {"small": small_name, "large": large_name, "n_samples": len(pairs), "operating_points": rows}
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--crops-dir",  default=None)
@@ -144,6 +261,14 @@ def main():
     parser.add_argument("--save-json",  action="store_true")
     parser.add_argument("--skip-base",  action="store_true",
                         help="Skip base model evaluation (faster if you already have results)")
+    parser.add_argument("--compare-int8", action="store_true",
+                        help="Compare fp32 vs int8-quantised inference (CER and latency) "
+                             "on the fine-tuned model, or the base model if none exists")
+    parser.add_argument("--cascade", default=None, metavar="SMALL_MODEL",
+                        help="Evaluate TROCR_CASCADE_MODEL=SMALL_MODEL in front of the fine-tuned "
+                             "model (or the base model): escalation rate, CER and latency per threshold")
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.85,0.9,0.95",
+                        help="Comma-separated TROCR_CASCADE_THRESHOLD values for --cascade")
     args = parser.parse_args()
 
     crops_dir   = Path(args.crops_dir)  if args.crops_dir  else CROPS_DIR
@@ -163,6 +288,29 @@ def main():
 
     results = {}
 
+    if args.cascade:
+        target = str(finetuned) if finetuned.exists() else base_model
+        thresholds = [float(t) for t in args.thresholds.split(",") if t.strip()]
+        results["cascade"] = evaluate_cascade(args.cascade, target, pairs, thresholds)
+        if args.save_json:
+            out = OUTPUT_DIR / "cascade_results.json"
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+            print(f"\nResults saved to: {out}")
+        print()
+        return
+
+    if args.compare_int8:
+        target = str(finetuned) if finetuned.exists() else base_model
+        results["quantization"] = compare_quantized(target, pairs)
+        if args.save_json:
+            out = OUTPUT_DIR / "quantization_results.json"
+            out.parent.mkdir(parents=True, exist_ok=True)
+            out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+            print(f"\nResults saved to: {out}")
+        print()
+        return
+
     # Base model
     if not args.skip_base:
         print("\n[1/2] Evaluating BASE model (no fine-tuning)...")
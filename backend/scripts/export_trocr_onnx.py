@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Export a TrOCR checkpoint to ONNX for the onnxruntime engine.
+
+Writes three graphs plus the processor files into one directory:
+    encoder_model.onnx            pixel_values -> encoder_hidden_states
+    decoder_model.onnx            first step; returns self- and cross-attention KV
+    decoder_with_past_model.onnx  one token per step, reusing the cached KV
+
+Works for hub checkpoints and for the output of finetune_trocr.py.
+
+Usage:
+    cd backend && source venv/bin/activate
+    python scripts/export_trocr_onnx.py                                   # TROCR_HANDWRITTEN_MODEL
+    python scripts/export_trocr_onnx.py --model ../data/trocr-finetuned/final
+    python scripts/export_trocr_onnx.py --model microsoft/trocr-large-handwritten --verify
+
+Serve it with:
+    export TROCR_ENGINE=onnx
+    export TROCR_ONNX_DIR=/path/to/data/trocr-onnx/<name>
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+import torch
+from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+from transformers.cache_utils import EncoderDecoderCache
+
+from app.ocr.onnx_engine import (
+    DECODER_FILE,
+    DECODER_WITH_PAST_FILE,
+    ENCODER_FILE,
+    ONNX_CONFIG_FILE,
+    OnnxTrOCR,
+    OnnxTrOCRProcessor,
+)
+
+DEFAULT_MODEL = os.getenv("TROCR_HANDWRITTEN_MODEL", "microsoft/trocr-large-handwritten")
+DATA_ROOT     = Path(__file__).resolve().parents[2] / "data"
+OUTPUT_ROOT   = DATA_ROOT / "trocr-onnx"
+
+
+# Thin wrappers that give each graph flat tensor inputs/outputs; the HF
+# modules take and return Cache objects, which ONNX cannot represent.
+
+class _Encoder(torch.nn.Module):
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.encoder = model.encoder
+        self.enc_to_dec_proj = getattr(model, "enc_to_dec_proj", None)
+
+    def forward(self, pixel_values):
+        hidden = self.encoder(pixel_values=pixel_values).last_hidden_state
+        if self.enc_to_dec_proj is not None:
+            hidden = self.enc_to_dec_proj(hidden)
+        return hidden
+
+
+class _Decoder(torch.nn.Module):
+    def __init__(self, model: VisionEncoderDecoderModel):
+        super().__init__()
+        self.decoder = model.decoder
+
+    def forward(self, input_ids, encoder_hidden_states):
+        out = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            use_cache=True,
+            return_dict=True,
+        )
+        flat = []
+        for layer in out.past_key_values.to_legacy_cache():
+            flat.extend(layer)
+        return (out.logits, *flat)
+
+
+class _DecoderWithPast(torch.nn.Module):
+    def __init__(self, model: VisionEncoderDecoderModel, num_layers: int):
+        super().__init__()
+        self.decoder = model.decoder
+        self.num_layers = num_layers
+
+    def forward(self, input_ids, encoder_hidden_states, *past):
+        legacy = tuple(tuple(past[4 * i:4 * i + 4]) for i in range(self.num_layers))
+        out = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            past_key_values=EncoderDecoderCache.from_legacy_cache(legacy),
+            use_cache=True,
+            return_dict=True,
+        )
+        flat = []
+        for layer in out.past_key_values.to_legacy_cache():
+            flat.extend(layer[:2])
+        return (out.logits, *flat)
+
+
+def _past_names(prefix: str, num_layers: int, cross: bool = True):
+    names = []
+    for i in range(num_layers):
+        names += [f"{prefix}.{i}.decoder.key", f"{prefix}.{i}.decoder.value"]
+        if cross:
+            names += [f"{prefix}.{i}.encoder.key", f"{prefix}.{i}.encoder.value"]
+    return names
+
+
+def export(model_name: str, output_dir: Path, opset: int = 17) -> None:
+    print(f"Loading {model_name}")
+    processor = TrOCRProcessor.from_pretrained(model_name)
+    model = VisionEncoderDecoderModel.from_pretrained(model_name).eval()
+    model.config.use_cache = True
+    model.decoder.config.use_cache = True
+    num_layers = model.decoder.config.decoder_layers
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    size = processor.image_processor.size
+    pixel_values = torch.zeros(2, 3, size["height"], size["width"])
+    start_id = model.config.decoder_start_token_id
+    input_ids = torch.full((2, 1), start_id, dtype=torch.long)
+
+    with torch.no_grad():
+        encoder = _Encoder(model)
+        encoder_hidden = encoder(pixel_values)
+        print(f"Exporting {ENCODER_FILE}")
+        torch.onnx.export(
+            encoder, (pixel_values,), str(output_dir / ENCODER_FILE),
+            input_names=["pixel_values"],
+            output_names=["encoder_hidden_states"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "encoder_hidden_states": {0: "batch"}},
+            opset_version=opset,
+            dynamo=False,
+        )
+
+        decoder = _Decoder(model)
+        first = decoder(input_ids, encoder_hidden)
+        present = _past_names("present", num_layers)
+        print(f"Exporting {DECODER_FILE}")
+        torch.onnx.export(
+            decoder, (input_ids, encoder_hidden), str(output_dir / DECODER_FILE),
+            input_names=["input_ids", "encoder_hidden_states"],
+            output_names=["logits", *present],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "encoder_hidden_states": {0: "batch", 1: "encoder_seq"},
+                "logits": {0: "batch", 1: "seq"},
+                **{n: {0: "batch", 2: "encoder_seq" if ".encoder." in n else "seq"} for n in present},
+            },
+            opset_version=opset,
+            dynamo=False,
+        )
+
+        with_past = _DecoderWithPast(model, num_layers)
+        past_names = _past_names("past_key_values", num_layers)
+        present_self = _past_names("present", num_layers, cross=False)
+        print(f"Exporting {DECODER_WITH_PAST_FILE}")
+        torch.onnx.export(
+            with_past, (input_ids, encoder_hidden, *first[1:]),
+            str(output_dir / DECODER_WITH_PAST_FILE),
+            input_names=["input_ids", "encoder_hidden_states", *past_names],
+            output_names=["logits", *present_self],
+            dynamic_axes={
+                "input_ids": {0: "batch"},
+                "encoder_hidden_states": {0: "batch", 1: "encoder_seq"},
+                "logits": {0: "batch"},
+                **{n: {0: "batch", 2: "encoder_seq" if ".encoder." in n else "past_seq"} for n in past_names},
+                **{n: {0: "batch", 2: "total_seq"} for n in present_self},
+            },
+            opset_version=opset,
+            dynamo=False,
+        )
+
+    processor.save_pretrained(output_dir)
+    eos = model.generation_config.eos_token_id
+    eos = eos[0] if isinstance(eos, (list, tuple)) else eos
+    # Some checkpoints leave pad unset; finished rows are padded with EOS then.
+    pad = model.generation_config.pad_token_id
+    if pad is None:
+        pad = model.config.pad_token_id if model.config.pad_token_id is not None else eos
+    (output_dir / ONNX_CONFIG_FILE).write_text(json.dumps({
+        "source_model": model_name,
+        "num_layers": num_layers,
+        "decoder_start_token_id": start_id,
+        "eos_token_id": eos,
+        "pad_token_id": pad,
+        "opset": opset,
+    }, indent=2), encoding="utf-8")
+
+
+def verify(model_name: str, output_dir: Path, n: int = 4, max_new_tokens: int = 32) -> bool:
+    """Decode random crops with both engines and compare text and confidence."""
+    from PIL import Image
+    from app.ocr.handwriting import _ocr_batch_with_confidence
+
+    processor = TrOCRProcessor.from_pretrained(model_name)
+    model = VisionEncoderDecoderModel.from_pretrained(model_name).eval()
+    onnx_processor = OnnxTrOCRProcessor(str(output_dir))
+    onnx_model = OnnxTrOCR(str(output_dir))
+
+    rng = np.random.default_rng(0)
+    imgs = [Image.fromarray(rng.integers(0, 255, (64, 256, 3), dtype=np.uint8)) for _ in range(n)]
+    torch_reads = _ocr_batch_with_confidence(processor, model, imgs, max_new_tokens)
+    onnx_reads = _ocr_batch_with_confidence(onnx_processor, onnx_model, imgs, max_new_tokens)
+
+    ok = True
+    for (t_text, t_conf), (o_text, o_conf) in zip(torch_reads, onnx_reads):
+        match = t_text == o_text and abs(t_conf - o_conf) < 1e-3
+        ok &= match
+        print(f"  {'OK  ' if match else 'DIFF'} torch={t_text!r} ({t_conf:.4f})  onnx={o_text!r} ({o_conf:.4f})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export TrOCR to ONNX for onnxruntime serving")
+    parser.add_argument("--model", default=DEFAULT_MODEL,
+                        help="Hub id or local checkpoint (e.g. data/trocr-finetuned/final)")
+    parser.add_argument("--output-dir", default=None,
+                        help="Default: data/trocr-onnx/<model name>")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--verify", action="store_true",
+                        help="Compare torch and onnxruntime reads on random crops after export")
+    args = parser.parse_args()
+
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", args.model.strip("/\\"))
+    output_dir = Path(args.output_dir) if args.output_dir else OUTPUT_ROOT / slug
+
+    export(args.model, output_dir, opset=args.opset)
+    print(f"\nONNX model written to {output_dir}")
+
+    if args.verify:
+        print("\nVerifying against the PyTorch model...")
+        if not verify(args.model, output_dir):
+            print("Engines disagree - do not serve this export.")
+            sys.exit(1)
+        print("Engines agree.")
+
+    print("\nTo serve it:")
+    print("  export TROCR_ENGINE=onnx")
+    print(f"  export TROCR_ONNX_DIR={output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Tests for the cross-request micro-batcher used in front of TrOCR."""
+
+import threading
+
+import pytest
+
+from app.ocr.batching import MicroBatcher
+
+
+def _echo_batcher(calls, **kwargs):
+    def run_batch(key, items):
+        calls.append((key, list(items)))
+        return [f"{key}:{item}" for item in items]
+    return MicroBatcher(run_batch, **kwargs)
+
+
+def test_results_come_back_in_submission_order():
+    calls = []
+    batcher = _echo_batcher(calls, max_batch_size=8, max_wait_ms=20)
+    try:
+        futures = batcher.submit("m", ["a", "b", "c"])
+        assert [f.result(timeout=2) for f in futures] == ["m:a", "m:b", "m:c"]
+    finally:
+        batcher.shutdown()
+
+
+def test_concurrent_callers_share_one_batch():
+    calls = []
+    batcher = _echo_batcher(calls, max_batch_size=16, max_wait_ms=200)
+    results = {}
+
+    def caller(name):
+        futures = batcher.submit("m", [f"{name}{i}" for i in range(3)])
+        results[name] = [f.result(timeout=5) for f in futures]
+
+    threads = [threading.Thread(target=caller, args=(n,)) for n in ("x", "y")]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        batcher.shutdown()
+
+    assert results["x"] == ["m:x0", "m:x1", "m:x2"]
+    assert results["y"] == ["m:y0", "m:y1", "m:y2"]
+    assert len(calls) == 1 and len(calls[0][1]) == 6
+
+
+def test_batches_never_exceed_max_size():
+    calls = []
+    batcher = _echo_batcher(calls, max_batch_size=2, max_wait_ms=50)
+    try:
+        futures = batcher.submit("m", list("abcde"))
+        [f.result(timeout=2) for f in futures]
+    finally:
+        batcher.shutdown()
+    assert all(len(items) <= 2 for _, items in calls)
+
+
+def test_items_with_different_keys_are_not_mixed():
+    calls = []
+    batcher = _echo_batcher(calls, max_batch_size=8, max_wait_ms=100)
+    try:
+        futures = batcher.submit("small", ["a"]) + batcher.submit("large", ["b"])
+        assert [f.result(timeout=2) for f in futures] == ["small:a", "large:b"]
+    finally:
+        batcher.shutdown()
+    assert sorted(key for key, _ in calls) == ["large", "small"]
+
+
+def test_batch_failure_is_raised_to_every_caller():
+    def run_batch(key, items):
+        raise RuntimeError("model exploded")
+
+    batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=10)
+    try:
+        futures = batcher.submit("m", ["a", "b"])
+        for fut in futures:
+            with pytest.raises(RuntimeError):
+                fut.result(timeout=2)
+    finally:
+        batcher.shutdown()
+
+
+def test_short_batch_fails_every_caller_instead_of_hanging():
+    batcher = MicroBatcher(lambda key, items: items[1:], max_batch_size=4, max_wait_ms=10)
+    try:
+        futures = batcher.submit("m", ["a", "b", "c"])
+        for fut in futures:
+            with pytest.raises(RuntimeError, match=r"result\(s\) for"):
+                fut.result(timeout=2)
+    finally:
+        batcher.shutdown()
@@ -0,0 +1,100 @@
+"""Tests for the synthetic AGW receipt generator and benchmark scoring."""
+
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.ocr.handwriting import _pil_to_cv_bgr
+from app.ocr import timing
+from app.ocr.region_detector import LAYOUT_CACHE, TEMPLATE, _fill_rows, analysis_copy, detect_regions, get_column_bounds
+from benchmarks.metrics import score_receipt, summarise
+from benchmarks.synth import PAGE, render_receipt
+
+
+def test_rendering_is_deterministic():
+    assert render_receipt(7) == render_receipt(7)
+    assert render_receipt(7)[1] != render_receipt(8)[1]
+
+
+def test_unskewed_page_matches_template_geometry():
+    image_bytes, truth = render_receipt(3, max_skew_deg=0)
+    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    assert img.size == (PAGE.width, PAGE.height)
+
+    regions = detect_regions(_pil_to_cv_bgr(img))
+    assert abs(regions["table_start_y"] - PAGE.table_start_y) <= 3
+    pitches = [b - a for a, b in zip(regions["row_ys"], regions["row_ys"][1:])]
+    assert all(abs(p - PAGE.row_pitch) <= 3 for p in pitches)
+    assert len(truth["line_items"]) <= len(regions["row_ys"]) - 1
+
+
+def test_rows_found_on_downscaled_copy_map_back_to_full_resolution():
+    image_bytes, truth = render_receipt(3, max_skew_deg=0, long_edge=4032)
+    gray = cv2.cvtColor(np.asarray(Image.open(io.BytesIO(image_bytes)).convert("RGB")), cv2.COLOR_RGB2GRAY)
+    assert max(gray.shape) == 4032
+
+    small, scale = analysis_copy(gray, 1600)
+    assert max(small.shape) == 1600 and scale == 1600 / 4032
+    assert analysis_copy(small, 1600)[0] is small
+
+    regions = detect_regions(gray, (small, scale))
+    layout = truth["layout"]
+    assert abs(regions["table_start_y"] - layout["table_start_y"]) <= 4
+    expected = [layout["table_start_y"] + k * layout["row_pitch"] for k in range(len(regions["row_ys"]))]
+    assert max(abs(y - e) for y, e in zip(regions["row_ys"], expected)) <= 5
+
+
+def test_vertical_rules_snap_the_column_bounds():
+    image_bytes, _ = render_receipt(4, max_skew_deg=0)
+    gray = cv2.cvtColor(np.asarray(Image.open(io.BytesIO(image_bytes)).convert("RGB")), cv2.COLOR_RGB2GRAY)
+    w = gray.shape[1]
+
+    regions = detect_regions(gray)
+    fractions = (TEMPLATE.col_row_num_end, TEMPLATE.col_quantity_end,
+                 TEMPLATE.col_description_end, TEMPLATE.col_unit_price_end)
+    assert len(regions["column_xs"]) == len(fractions)
+    assert all(abs(x - int(w * f)) <= 3 for x, f in zip(regions["column_xs"], fractions))
+
+    shifted = [x + 20 for x in regions["column_xs"]]
+    bounds = get_column_bounds(w, shifted)
+    assert bounds["quantity"] == (shifted[0], shifted[1])
+    assert bounds["amount"] == (shifted[3], w)
+    # Rules too far from the template edges are ignored.
+    assert get_column_bounds(w, [w // 2]) == get_column_bounds(w)
+
+
+def test_repeat_layout_is_served_from_the_cache():
+    LAYOUT_CACHE.clear()
+    image_bytes, _ = render_receipt(6, max_skew_deg=0)
+    gray = cv2.cvtColor(np.asarray(Image.open(io.BytesIO(image_bytes)).convert("RGB")), cv2.COLOR_RGB2GRAY)
+
+    with timing.collect() as first:
+        fitted = detect_regions(gray)
+    with timing.collect() as second:
+        cached = detect_regions(gray)
+    assert "layout_cache_hits" not in first.counts
+    assert second.counts["layout_cache_hits"] == 1
+    assert cached == fitted
+    cached["row_ys"].append(0)
+    assert detect_regions(gray) == fitted
+
+
+def test_row_grid_snaps_to_detected_rules_and_fills_gaps():
+    detected = [500, 545, 591, 680, 725, 1410]
+    rows = _fill_rows(detected, 500, 1850)
+    assert len(rows) == TEMPLATE.expected_table_rows + 1
+    assert rows[:6] == [500, 545, 591, 635, 680, 725]
+    assert 1410 not in rows and 1400 in rows
+
+
+def test_scoring_counts_fields_and_rows():
+    _, truth = render_receipt(5)
+    perfect = score_receipt(truth, truth)
+    assert all(perfect["fields"].values())
+
+    damaged = {**truth, "vat": "", "line_items": truth["line_items"][1:]}
+    summary = summarise([score_receipt(damaged, truth)])
+    assert summary["vat"] == 0.0 and summary["invoice_number"] == 1.0
+    assert summary["rows_found"] < 1.0
@@ -46,6 +46,16 @@ def test_qmark_strips_for_update_for_sqlite():
         conn.close()
 
 
+def test_qmark_strips_skip_locked_for_sqlite():
+    conn = sqlite3.connect(":memory:")
+    try:
+        sql = "SELECT id FROM t WHERE s = %s LIMIT 1 FOR UPDATE SKIP LOCKED"
+        out = qmark(sql, conn)
+        assert "SKIP LOCKED" not in out and "FOR UPDATE" not in out
+    finally:
+        conn.close()
+
+
 def test_is_sqlite_conn_detects_sqlite_connection():
     conn = sqlite3.connect(":memory:")
     try:
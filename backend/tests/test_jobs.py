@@ -0,0 +1,75 @@
+"""Tests for the durable OCR job queue on the SQLite backend."""
+
+import sqlite3
+
+import pytest
+
+from app import jobs
+from app.database import SQLITE_SCHEMA_PATH, dict_factory
+
+
+@pytest.fixture
+def conn():
+    c = sqlite3.connect(":memory:")
+    c.row_factory = dict_factory
+    c.executescript(SQLITE_SCHEMA_PATH.read_text(encoding="utf-8"))
+    yield c
+    c.close()
+
+
+def test_claimed_job_is_not_handed_out_twice(conn):
+    cur = conn.cursor()
+    job_id = jobs.enqueue_job(cur, conn, b"image")
+    claimed = jobs.claim_next_job(cur, conn, "runner-a")
+    assert claimed["id"] == job_id and claimed["image_bytes"] == b"image"
+    assert jobs.claim_next_job(cur, conn, "runner-b") is None
+    assert jobs.get_job(cur, conn, job_id)["status"] == "running"
+
+
+def test_completed_job_points_at_submission_and_drops_image(conn):
+    cur = conn.cursor()
+    job_id = jobs.enqueue_job(cur, conn, b"image")
+    jobs.claim_next_job(cur, conn, "runner-a")
+    assert jobs.complete_job(cur, conn, job_id, "runner-a")
+    cur.execute("INSERT INTO submissions (id, image_url) VALUES ('sub-1', 'uploaded_file')")
+    jobs.set_job_submission(cur, conn, job_id, "sub-1")
+
+    job = jobs.get_job(cur, conn, job_id)
+    assert job["status"] == "done" and job["submission_id"] == "sub-1"
+    cur.execute("SELECT image_bytes FROM ocr_jobs WHERE id = ?", (job_id,))
+    assert cur.fetchone()["image_bytes"] is None
+
+
+def test_stale_claim_is_reclaimed_then_failed_after_max_attempts(conn, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", -60)
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+    cur = conn.cursor()
+    job_id = jobs.enqueue_job(cur, conn, b"image")
+
+    assert jobs.claim_next_job(cur, conn, "runner-a")["attempts"] == 1
+    assert jobs.claim_next_job(cur, conn, "runner-b")["attempts"] == 2
+    assert jobs.claim_next_job(cur, conn, "runner-c") is None
+    assert jobs.get_job(cur, conn, job_id)["status"] == "failed"
+
+
+def test_released_job_can_be_claimed_again_without_spending_an_attempt(conn):
+    cur = conn.cursor()
+    job_id = jobs.enqueue_job(cur, conn, b"image")
+    jobs.claim_next_job(cur, conn, "runner-a")
+    assert jobs.release_job(cur, conn, job_id, "runner-a", undo_attempt=True)
+    assert jobs.claim_next_job(cur, conn, "runner-b")["attempts"] == 1
+
+
+def test_runner_that_lost_its_claim_cannot_settle_the_job(conn, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_STALE_SECONDS", -60)
+    cur = conn.cursor()
+    job_id = jobs.enqueue_job(cur, conn, b"image")
+    jobs.claim_next_job(cur, conn, "runner-a")
+    jobs.claim_next_job(cur, conn, "runner-b")
+
+    assert not jobs.complete_job(cur, conn, job_id, "runner-a")
+    assert not jobs.release_job(cur, conn, job_id, "runner-a")
+    assert jobs.complete_job(cur, conn, job_id, "runner-b")
+    # A late failure from the first runner does not undo the finished job.
+    assert not jobs.fail_job(cur, conn, job_id, "runner-a", "OCR pipeline failed")
+    assert jobs.get_job(cur, conn, job_id)["status"] == "done"
@@ -0,0 +1,91 @@
+"""Tests for hot-swapping the TrOCR checkpoint while pages are being read."""
+
+import threading
+
+import pytest
+
+from app.ocr.model_registry import ModelRegistry, ModelSwapInProgress
+
+
+def _registry(loaded, gate=None):
+    def load(name):
+        if gate is not None and name != "base":
+            gate.wait(5)
+        if name == "broken":
+            raise OSError("no weights in broken")
+        loaded.append(name)
+        return f"{name}-processor", f"{name}-model"
+
+    return ModelRegistry(load, lambda processor, model: None, lambda: "base")
+
+
+def test_first_lease_loads_the_default_checkpoint():
+    loaded = []
+    registry = _registry(loaded)
+    assert registry.active is None
+    with registry.lease() as hw:
+        assert hw.models() == ("base-processor", "base-model")
+        assert hw.name == "base"
+    assert loaded == ["base"] and registry.active == "base"
+
+
+def test_page_in_flight_keeps_its_checkpoint_until_it_finishes():
+    registry = _registry([])
+    with registry.lease() as old_page:
+        old_page.models()
+        old = registry._active
+        registry.swap("finetuned", wait=True)
+        assert registry.active == "finetuned"
+        with registry.lease() as new_page:
+            assert new_page.models() == ("finetuned-processor", "finetuned-model")
+        assert old_page.models() == ("base-processor", "base-model")
+        assert old.models is not None
+    # The last page on the old checkpoint is done, so it is dropped.
+    assert old.models is None
+
+
+def test_swap_loads_in_the_background_while_the_old_checkpoint_serves():
+    gate = threading.Event()
+    registry = _registry([], gate)
+    registry.models()
+    registry.swap("finetuned")
+    assert registry.status()["loading"] == "finetuned"
+    with pytest.raises(ModelSwapInProgress):
+        registry.swap("other")
+    with registry.lease() as hw:
+        assert hw.models() == ("base-processor", "base-model")
+    gate.set()
+    registry._loader.join(5)
+    assert registry.active == "finetuned" and registry.status()["loading"] is None
+
+
+def test_failed_swap_keeps_serving_the_old_checkpoint():
+    registry = _registry([])
+    registry.models()
+    registry.swap("broken", wait=True)
+    assert registry.active == "base" and registry.requested == "base"
+    assert registry.last_error == "OSError: no weights in broken"
+
+
+def test_failed_swap_before_the_first_load_still_serves_the_default():
+    loaded = []
+    registry = _registry(loaded)
+    registry.swap("broken", wait=True)
+    assert registry.status()["requested"] == "base"
+    with registry.lease() as hw:
+        assert hw.models() == ("base-processor", "base-model")
+    assert loaded == ["base"]
+
+
+def test_models_survive_a_swap_that_retires_them_mid_call():
+    registry = _registry([])
+    registry.models()
+    pin = registry._pin
+
+    def pin_then_swap():
+        entry = pin()
+        registry.swap("finetuned", wait=True)
+        return entry
+
+    registry._pin = pin_then_swap
+    assert registry.models() == ("base-processor", "base-model")
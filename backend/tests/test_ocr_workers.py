@@ -0,0 +1,102 @@
+"""Tests for the pool that keeps OCR off the event loop."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.ocr import handwriting, workers
+from app.ocr.workers import OcrQueueFull, OcrWorkerPool, _resolve_worker_count
+
+
+def test_auto_worker_count_is_at_least_one():
+    assert _resolve_worker_count("auto") >= 1
+    assert _resolve_worker_count("0") == 0
+    assert _resolve_worker_count("3") == 3
+
+
+def test_thread_mode_runs_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    pool = OcrWorkerPool(workers=0, max_pending=2, target=lambda data: {"thread": threading.get_ident()})
+    result = asyncio.run(pool.run(b"img"))
+    assert result["thread"] != loop_thread
+    assert pool.pending == 0
+
+
+def test_full_queue_is_rejected():
+    release = threading.Event()
+    pool = OcrWorkerPool(workers=0, max_pending=1, target=lambda data: release.wait(5))
+
+    async def scenario():
+        first = asyncio.ensure_future(pool.run(b"a"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(OcrQueueFull):
+            await pool.run(b"b")
+        release.set()
+        return await first
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_process_mode_runs_in_worker(monkeypatch):
+    monkeypatch.setenv("SKIP_OCR_WARMUP", "1")
+    pool = OcrWorkerPool(workers=1, max_pending=2, target=len)
+    pool.start()
+    try:
+        assert asyncio.run(pool.run(b"12345")) == 5
+        assert pool.ready
+    finally:
+        pool.shutdown()
+    assert not pool.ready
+
+
+def test_thread_mode_is_ready_only_after_warm_up(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(workers, "_warm_up", lambda: release.wait(5))
+    pool = OcrWorkerPool(workers=0)
+    pool.start()
+    assert not pool.ready
+    release.set()
+    pool._warmup_thread.join(5)
+    assert pool.ready and pool.warmup_errors == []
+
+
+def test_failed_warm_up_keeps_the_pool_not_ready(monkeypatch):
+    def broken():
+        raise OSError("easyocr weights missing")
+
+    monkeypatch.setattr(workers, "_warm_up", broken)
+    pool = OcrWorkerPool(workers=0)
+    pool.start()
+    pool._warmup_thread.join(5)
+    assert not pool.ready
+    assert pool.warmup_errors == ["OSError: easyocr weights missing"]
+
+
+def test_model_request_reaches_every_worker(monkeypatch, tmp_path):
+    monkeypatch.setenv("SKIP_OCR_WARMUP", "1")
+    monkeypatch.setattr(handwriting, "_registry", None)
+    pool = OcrWorkerPool(workers=1, max_pending=2, target=len)
+    pool.start()
+    try:
+        assert asyncio.run(pool.run(b"12345")) == 5
+        # An empty directory is no checkpoint: the worker tries it, fails
+        # and keeps serving the one it had.
+        default = pool.model_status()["requested"]
+        pool.request_model(str(tmp_path))
+        status = pool.model_status()
+        assert status["loading"] == str(tmp_path) and status["workers_switched"] == 0
+        deadline = time.monotonic() + 120
+        while pool.model_status()["workers_failed"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        status = pool.model_status()
+        assert status["workers_failed"] == 1 and status["loading"] is None
+        # The failed checkpoint is never adopted, so a restarted pool (and
+        # the result cache) stay on the old one.
+        assert status["requested"] == default
+        pool.shutdown()
+        pool.start()
+        assert pool._model_request.served_name() is None
+    finally:
+        pool.shutdown()
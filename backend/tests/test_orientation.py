@@ -0,0 +1,41 @@
+"""Tests for the quarter-turn orientation check."""
+
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from app.ocr import receipt_pipeline
+from app.ocr.orientation import detect_orientation
+from benchmarks.synth import render_receipt
+
+
+def _gray_page(seed: int = 2, **kwargs) -> np.ndarray:
+    image_bytes, _ = render_receipt(seed, **kwargs)
+    return np.asarray(Image.open(io.BytesIO(image_bytes)).convert("L"))
+
+
+def test_every_quarter_turn_is_undone():
+    page = _gray_page(max_skew_deg=0)
+    for turns in range(4):
+        assert detect_orientation(np.rot90(page, turns)) == (4 - turns) % 4
+
+
+def test_turned_photos_come_out_of_page_preparation_upright():
+    rgb = np.dstack([_gray_page(seed=4)] * 3)
+    upright = receipt_pipeline._prepare_page(rgb)[3][0]
+    for turns in (1, 2, 3):
+        _, gray, _, (analysis, _) = receipt_pipeline._prepare_page(np.rot90(rgb, turns))
+        assert gray.shape == rgb.shape[:2]
+        assert detect_orientation(analysis) == 0
+        assert analysis.shape == upright.shape
+
+
+def test_pages_without_table_rules_are_left_alone():
+    letter = np.full((2200, 1560), 255, np.uint8)
+    for y in range(100, 2100, 40):
+        cv2.putText(letter, "Dear Sir, thank you for your order", (60, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, 20, 2)
+    assert detect_orientation(letter) == 0
+    assert detect_orientation(np.full((2200, 1560), 241, np.uint8)) == 0
@@ -0,0 +1,87 @@
+"""Tests for the OCR pre-flight checks."""
+
+import io
+import pickle
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.ocr import receipt_pipeline
+from app.ocr.preflight import PreflightRejected, check_page
+from benchmarks.synth import render_receipt
+
+
+def _gray_page(seed: int = 2, **kwargs) -> np.ndarray:
+    image_bytes, _ = render_receipt(seed, max_skew_deg=0, **kwargs)
+    return np.asarray(Image.open(io.BytesIO(image_bytes)).convert("L"))
+
+
+def test_clean_page_passes():
+    report = check_page(_gray_page())
+    assert report["ok"] and report["reasons"] == []
+    assert report["metrics"]["table_rules"] >= 30
+
+
+def test_blurry_dark_and_blank_pages_are_caught():
+    page = _gray_page()
+    assert check_page(cv2.GaussianBlur(page, (0, 0), 4))["reasons"] == ["blurry"]
+    assert check_page((page * 0.15).astype(np.uint8))["reasons"] == ["too_dark"]
+    blank = np.full_like(page, 241)
+    assert check_page(blank)["reasons"] == ["low_contrast", "no_table_rules"]
+
+
+def test_sideways_page_and_other_documents_are_told_apart():
+    page = _gray_page()
+    sideways = np.full((page.shape[1] * 3 // 2, page.shape[0]), 241, np.uint8)
+    sideways[:page.shape[1]] = np.rot90(page)
+    assert check_page(sideways)["reasons"] == ["rotated"]
+
+    letter = np.full_like(page, 255)
+    for y in range(100, letter.shape[0] - 100, 40):
+        cv2.putText(letter, "Dear Sir, thank you for your order", (60, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, 20, 2)
+    assert check_page(letter)["reasons"] == ["no_table_rules"]
+
+
+def test_table_is_found_on_a_tilted_page():
+    page = _gray_page()
+    h, w = page.shape
+    for angle in (2.0, -5.0, 10.0):
+        rotation = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        tilted = cv2.warpAffine(page, rotation, (w, h), borderValue=241)
+        report = check_page(tilted)
+        assert report["ok"], angle
+        assert report["metrics"]["table_rules"] >= 30
+
+
+def test_only_unreadable_photos_are_rejected():
+    page = _gray_page()
+    assert check_page(cv2.GaussianBlur(page, (0, 0), 4))["reject"]
+    # Missing table rules are flagged for the reviewer, not refused.
+    letter = np.full_like(page, 255)
+    for y in range(100, letter.shape[0] - 100, 40):
+        cv2.putText(letter, "Dear Sir, thank you for your order", (60, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, 20, 2)
+    report = check_page(letter)
+    assert report["reasons"] == ["no_table_rules"] and not report["reject"]
+
+
+def test_rejection_survives_a_process_boundary_with_its_reasons():
+    exc = pickle.loads(pickle.dumps(PreflightRejected(["blurry", "no_table_rules"])))
+    assert exc.reasons == ["blurry", "no_table_rules"]
+    assert str(exc) == "Image rejected before OCR: the photo is too blurry; no AGW invoice table was found"
+
+
+def test_rejected_page_never_loads_a_model(monkeypatch):
+    def no_models():
+        raise AssertionError("model loaded for a rejected page")
+
+    monkeypatch.setattr(receipt_pipeline, "PREFLIGHT_MODE", "reject")
+    monkeypatch.setattr(receipt_pipeline, "get_hw_registry", no_models)
+    buf = io.BytesIO()
+    Image.new("RGB", (1200, 1700), (245, 240, 240)).save(buf, format="JPEG")
+    with pytest.raises(PreflightRejected) as info:
+        receipt_pipeline.process_receipt(buf.getvalue())
+    assert info.value.reasons == ["low_contrast", "no_table_rules"]
@@ -1,6 +1,10 @@
-"""Tests for the amount-parsing helper in the OCR pipeline."""
+"""Tests for the amount-parsing and cell-reading helpers in the OCR pipeline."""
 
-from app.ocr.receipt_pipeline import _parse_amount_easyocr
+import numpy as np
+
+from app.ocr import receipt_pipeline, timing
+from app.ocr.receipt_pipeline import _parse_amount_easyocr, _parse_footer_amount
+from app.ocr.region_detector import PageGeometry, analysis_copy
 
 
 def test_parse_amount_clean_two_groups():
@@ -25,3 +29,155 @@ def test_parse_amount_strips_stray_punctuation():
 
 def test_parse_amount_corrects_digit_lookalikes():
     assert _parse_amount_easyocr("S0 00") == "50.00"
+
+
+def test_parse_footer_amount_splits_pounds_and_pence():
+    assert _parse_footer_amount("245 50") == "245.50"
+
+
+def test_parse_footer_amount_drops_box_border_one():
+    assert _parse_footer_amount("1245") == "245.00"
+
+
+def test_parse_footer_amount_ignores_single_digit_noise():
+    assert _parse_footer_amount("a 7 b") == ""
+
+
+class _ShadeReader:
+    """Stands in for easyocr.Reader: "reads" each box as its pixel shade, in reverse order."""
+
+    def recognize(self, canvas, horizontal_list, free_list, **kwargs):
+        results = []
+        for x1, x2, y1, y2 in horizontal_list:
+            shade = int(canvas[y1:y2, x1:x2].mean())
+            results.append(([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], f" {shade} ", 0.9))
+        return results[::-1]
+
+
+def test_easyocr_recognize_cells_maps_reads_back_to_crops(monkeypatch):
+    monkeypatch.setattr(receipt_pipeline, "_get_easyocr", lambda: _ShadeReader())
+    crops = [np.full(shape, shade, dtype=np.uint8) for shape, shade in (((20, 40), 10), ((30, 90), 70), ((12, 25), 130))]
+    assert receipt_pipeline._easyocr_recognize_cells(crops) == ["10", "70", "130"]
+
+
+def test_easyocr_recognize_cells_skips_reader_for_no_crops(monkeypatch):
+    monkeypatch.setattr(receipt_pipeline, "_get_easyocr", lambda: None)
+    assert receipt_pipeline._easyocr_recognize_cells([]) == []
+
+
+def test_warm_up_reads_a_cell_with_every_engine(monkeypatch):
+    seen = []
+
+    class _Reader(_ShadeReader):
+        def readtext(self, arr, **kwargs):
+            seen.append(("readtext", arr.shape))
+            return ["12.50"]
+
+    def fake_trocr(processor, model, imgs, max_new_tokens):
+        seen.append(("trocr", len(imgs)))
+        return [("12.50", 0.9)] * len(imgs)
+
+    monkeypatch.setattr(receipt_pipeline, "_load_handwritten", lambda: ("processor", "model"))
+    monkeypatch.setattr(receipt_pipeline, "_ocr_batch_with_confidence", fake_trocr)
+    monkeypatch.setattr(receipt_pipeline, "_get_easyocr", lambda: _Reader())
+    monkeypatch.setattr(receipt_pipeline.tesseract_engine, "image_to_string",
+                        lambda img, psm: seen.append(("tesseract", psm)) or "12.50")
+    seconds = receipt_pipeline.warm_up()
+    assert set(seconds) == {"trocr", "easyocr", "tesseract"}
+    assert [name for name, _ in seen] == ["trocr", "readtext", "tesseract"]
+
+
+def test_cascade_escalates_only_the_crops_the_small_model_doubts(monkeypatch):
+    cells = [np.full((64, 200), 255, dtype=np.uint8) for _ in range(4)]
+    small_confidence = [0.95, 0.4, 0.99, 0.7]
+    calls = []
+
+    def fake_trocr(processor, model, imgs, max_new_tokens):
+        calls.append((model, len(imgs)))
+        if model == "small":
+            return [(f"small-{i}", conf) for i, conf in enumerate(small_confidence)]
+        return [("large", 0.9)] * len(imgs)
+
+    monkeypatch.setattr(receipt_pipeline, "_ocr_batch_with_confidence", fake_trocr)
+    with timing.collect() as timer:
+        reads = receipt_pipeline._trocr_cascade(cells, "processor", "large", ("processor", "small"), threshold=0.8)
+    assert [text for text, _ in reads] == ["small-0", "large", "small-2", "large"]
+    assert calls == [("small", 4), ("large", 2)]
+    assert timer.counts["trocr_escalated"] == 2
+    assert set(timer.engines) == {"trocr_cascade", "trocr"}
+
+
+def test_crop_cell_is_a_padded_view_clamped_to_the_page():
+    page = np.zeros((100, 200), dtype=np.uint8)
+    cell = receipt_pipeline._crop_cell(page, 1, 10, 50, 98)
+    assert cell.shape == (93, 53)
+    assert np.shares_memory(cell, page)
+
+
+def test_page_crop_matches_the_same_region_of_the_warped_page():
+    photo = np.random.default_rng(0).integers(0, 256, (300, 200, 3), dtype=np.uint8)
+    page = PageGeometry(200, 300, angle=2.5)
+    crop = page.crop(photo, 40, 60, 150, 120)
+    expected = page.warp(photo)[60:120, 40:150]
+    assert crop.shape == expected.shape
+    assert np.abs(crop.astype(int) - expected).max() <= 1
+
+    level = PageGeometry(200, 300)
+    assert np.shares_memory(level.crop(photo, 40, 60, 150, 120), photo)
+
+
+def test_grid_removal_keeps_handwriting_and_drops_rules():
+    page = np.full((300, 400), 255, dtype=np.uint8)
+    page[100:102, :] = 0
+    page[:, 200:202] = 0
+    page[140:160, 50:60] = 0
+    cleaned = receipt_pipeline.remove_grid_lines(page)
+    assert cleaned[101, 300] == 255 and cleaned[250, 201] == 255
+    assert cleaned[150, 55] == 0
+
+
+def test_band_line_mask_matches_the_whole_page_mask():
+    page = np.full((1200, 800), 255, dtype=np.uint8)
+    page[300:1000:50, :] = 0
+    page[300:1000, 100:102] = 0
+    page[420:440, 300:306] = 0
+    analysis = analysis_copy(page, 600)
+    whole = receipt_pipeline._grid_line_mask(analysis, (800, 1200))
+    band = receipt_pipeline._grid_line_mask(analysis, (800, 1200), 410, 700)
+    assert band.shape == (290, 800)
+    assert np.abs(band.astype(int) - whole[410:700]).max() <= 1
+    assert band[140, 500] > 0 and band[20, 303] == 0
+
+
+def _table_page():
+    """A grid-free 6-row table: 50 px rows starting at y=100 on a 1000 px wide page."""
+    page = np.full((500, 1000), 255, dtype=np.uint8)
+    row_pairs = [(100 + 50 * k, 150 + 50 * k) for k in range(6)]
+    return page, row_pairs
+
+
+def test_table_occupancy_marks_written_rows_and_inked_numeric_cells():
+    page, row_pairs = _table_page()
+    # Row 2: three handwritten strokes in the description, a digit in quantity.
+    for x in (300, 340, 380):
+        page[160:190, x:x + 4] = 0
+    page[165:185, 80:86] = 0
+    # Row 4: only an amount.
+    page[265:285, 900:930] = 0
+    # Row 5: a descender from the row above - short and near the top.
+    page[300:306, 400:420] = 0
+
+    occupied = receipt_pipeline._table_occupancy(page, row_pairs, receipt_pipeline.get_column_bounds(1000))
+    assert occupied[:, 0].tolist() == [False, True, False, False, False, False]
+    assert occupied[:, 1].tolist() == [False, True, False, False, False, False]
+    assert occupied[:, 2].tolist() == [False, False, False, True, False, False]
+
+
+def test_table_occupancy_splits_strokes_at_row_separators():
+    page, row_pairs = _table_page()
+    # One long stroke per column position running through rows 1 and 2.
+    for x in (300, 340, 380):
+        page[110:190, x:x + 4] = 0
+    occupied = receipt_pipeline._table_occupancy(page, row_pairs, receipt_pipeline.get_column_bounds(1000))
+    assert occupied[:2, 0].tolist() == [True, True]
+    assert not occupied[2:, 0].any()
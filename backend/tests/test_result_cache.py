@@ -0,0 +1,47 @@
+"""Tests for the content-addressed OCR result cache."""
+
+import dataclasses
+import os
+
+from app.ocr import receipt_pipeline
+from app.ocr.result_cache import OcrResultCache, pipeline_fingerprint
+
+
+def test_round_trip_and_miss(tmp_path):
+    cache = OcrResultCache(tmp_path, max_entries=4, fingerprint="fp")
+    key = cache.key_for(b"image-a")
+    assert cache.get(key) is None
+    cache.put(key, {"invoice_number": "123"})
+    assert cache.get(key) == {"invoice_number": "123"}
+
+
+def test_key_depends_on_fingerprint(tmp_path):
+    a = OcrResultCache(tmp_path, max_entries=4, fingerprint="model-1")
+    b = OcrResultCache(tmp_path, max_entries=4, fingerprint="model-2")
+    assert a.key_for(b"same bytes") != b.key_for(b"same bytes")
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = OcrResultCache(tmp_path, max_entries=2, fingerprint="fp")
+    keys = [cache.key_for(bytes([i])) for i in range(3)]
+    cache.put(keys[0], {"n": 0})
+    cache.put(keys[1], {"n": 1})
+    # Age both entries, then touch the first one so the second is the LRU.
+    for i, key in enumerate(keys[:2]):
+        os.utime(tmp_path / f"{key}.json", (1000 + i, 1000 + i))
+    cache.get(keys[0])
+    cache.put(keys[2], {"n": 2})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == {"n": 0} and cache.get(keys[2]) == {"n": 2}
+
+
+def test_fingerprint_changes_with_template_and_model(monkeypatch):
+    base = pipeline_fingerprint()
+    monkeypatch.setattr(
+        receipt_pipeline, "TEMPLATE",
+        dataclasses.replace(receipt_pipeline.TEMPLATE, max_table_rows=30),
+    )
+    moved = pipeline_fingerprint()
+    assert moved != base
+    monkeypatch.setattr("app.ocr.handwriting.TROCR_HANDWRITTEN_MODEL", "someone/other-trocr")
+    assert pipeline_fingerprint() not in (base, moved)
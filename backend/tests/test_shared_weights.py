@@ -0,0 +1,52 @@
+"""Tests for weights mapped from a shared file, and per-process memory reporting."""
+
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.ocr.shared_weights import share_weights
+from app.ocr.workers import OcrWorkerPool, process_memory
+
+
+def _net() -> "torch.nn.Module":
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 4))
+
+
+def test_a_fresh_model_adopts_the_exported_weights(tmp_path):
+    path = tmp_path / "net.shared.pt"
+    first = _net()
+    x = torch.rand(3, 8)
+    expected = first(x)
+    share_weights(first, path)
+    assert path.exists()
+
+    second = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 4))
+    mapped = share_weights(second, path)
+    assert mapped >= sum(p.numel() * 4 for p in second.parameters())
+    assert torch.equal(second(x), expected)
+
+
+def test_quantised_layers_keep_their_packed_weights(tmp_path):
+    net = torch.ao.quantization.quantize_dynamic(_net(), {torch.nn.Linear}, dtype=torch.qint8)
+    # Every Linear is packed, so nothing plain is left to map.
+    assert share_weights(net, tmp_path / "int8.shared.pt") == 0
+    assert net(torch.rand(2, 8)).shape == (2, 4)
+
+
+def test_mismatched_file_is_refused(tmp_path):
+    path = tmp_path / "net.shared.pt"
+    share_weights(_net(), path)
+    with pytest.raises(RuntimeError, match="does not match"):
+        share_weights(torch.nn.Linear(8, 16), path)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc")
+def test_memory_report_covers_the_api_process():
+    usage = process_memory(os.getpid())
+    assert usage["rss_mb"] > 0 and usage["pss_mb"] <= usage["rss_mb"]
+    report = OcrWorkerPool(workers=0).memory()
+    assert report["workers"] == [] and report["total_rss_mb"] == report["api"]["rss_mb"]
@@ -0,0 +1,66 @@
+"""Tests for the OCR stage scheduler."""
+
+import threading
+import time
+
+import pytest
+
+from app.ocr import stages, timing
+from app.ocr.stages import Stage, run_stages
+
+
+def test_stages_get_their_dependencies_and_time_into_the_upload_timer():
+    with timing.collect() as timer:
+        results = run_stages([
+            Stage("rows", lambda: [1, 2, 3]),
+            Stage("header", lambda: "AGW"),
+            Stage("total", lambda rows, header: f"{header}:{sum(rows)}", deps=("rows", "header")),
+        ], workers=4)
+    assert results == {"rows": [1, 2, 3], "header": "AGW", "total": "AGW:6"}
+    assert set(timer.as_dict()["stages"]) == {"rows", "header", "total"}
+
+
+def test_independent_stages_overlap_within_engine_limits(monkeypatch):
+    monkeypatch.setattr(stages, "ENGINE_LIMITS", {"tesseract": 2, "easyocr": 1})
+    monkeypatch.setattr(stages, "_SLOTS", {})
+    active = {"tesseract": 0, "easyocr": 0}
+    peak = dict(active)
+    lock = threading.Lock()
+
+    def read(engine):
+        def fn():
+            with lock:
+                active[engine] += 1
+                peak[engine] = max(peak[engine], active[engine])
+            time.sleep(0.05)
+            with lock:
+                active[engine] -= 1
+        return fn
+
+    graph = [Stage(f"tess{i}", read("tesseract"), engine="tesseract") for i in range(2)]
+    graph += [Stage(f"easy{i}", read("easyocr"), engine="easyocr") for i in range(2)]
+    t0 = time.perf_counter()
+    run_stages(graph, workers=4)
+    elapsed = time.perf_counter() - t0
+    assert peak == {"tesseract": 2, "easyocr": 1}
+    # Both EasyOCR reads in turn, with the Tesseract reads alongside.
+    assert elapsed < 0.15
+
+
+def test_a_failing_stage_stops_its_dependants():
+    ran = []
+
+    def boom():
+        raise RuntimeError("tesseract crashed")
+
+    with pytest.raises(RuntimeError, match="tesseract crashed"):
+        run_stages([
+            Stage("footer", boom),
+            Stage("totals", lambda footer: ran.append(footer), deps=("footer",)),
+        ], workers=2)
+    assert ran == []
+
+
+def test_dependencies_must_be_declared_first():
+    with pytest.raises(ValueError, match="later stages"):
+        run_stages([Stage("trocr", lambda crops: crops, deps=("crops",)), Stage("crops", list)])
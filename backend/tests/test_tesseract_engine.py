@@ -0,0 +1,98 @@
+"""Tests for the pooled Tesseract C API engine, with a fake libtesseract."""
+
+import ctypes
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytesseract
+
+from app.ocr import tesseract_engine
+from app.ocr.tesseract_engine import TesseractApi, TesseractPool
+
+
+class _FakeLib(SimpleNamespace):
+    """Records the C calls TesseractApi makes and answers with fixed text."""
+
+    def __init__(self, text: bytes = b"NET TOTAL\n"):
+        super().__init__(calls=[], images=[], deleted=[])
+        self._text = ctypes.create_string_buffer(text)
+
+    def TessBaseAPICreate(self):
+        return 1234
+
+    def TessBaseAPIInit2(self, handle, datapath, lang, oem):
+        self.calls.append(("init", lang, oem))
+        return 0
+
+    def TessBaseAPISetPageSegMode(self, handle, psm):
+        self.calls.append(("psm", psm))
+
+    def TessBaseAPISetImage(self, handle, data, w, h, bpp, bpl):
+        self.images.append((w, h, bpp, bpl))
+
+    def TessBaseAPIGetUTF8Text(self, handle):
+        return ctypes.addressof(self._text)
+
+    def TessDeleteText(self, ptr):
+        self.deleted.append(ptr)
+
+    def TessBaseAPIClear(self, handle):
+        self.calls.append(("clear",))
+
+
+def test_api_reads_the_array_buffer_and_frees_the_text():
+    lib = _FakeLib()
+    api = TesseractApi(lib)
+    region = np.zeros((40, 100, 3), np.uint8)[:, 10:90]  # a non-contiguous view
+
+    assert api.read(region, psm=3) == "NET TOTAL\n"
+    assert lib.images == [(80, 40, 3, 240)]
+    assert ("init", b"eng", 3) in lib.calls and ("psm", 3) in lib.calls
+    assert lib.deleted == [ctypes.addressof(lib._text)]
+    assert lib.calls[-1] == ("clear",)
+    assert api.read(np.zeros((0, 5), np.uint8), psm=6) == ""
+
+
+def test_pool_reuses_handles_and_never_exceeds_its_size():
+    created = []
+    in_use = []
+    peak = [0]
+    lock = threading.Lock()
+
+    class _SlowApi:
+        def read(self, img, psm):
+            with lock:
+                in_use.append(self)
+                peak[0] = max(peak[0], len(in_use))
+            time.sleep(0.01)
+            with lock:
+                in_use.remove(self)
+            return str(psm)
+
+    def factory():
+        created.append(_SlowApi())
+        return created[-1]
+
+    pool = TesseractPool(factory, size=2)
+    threads = [threading.Thread(target=pool.read, args=(None, 6)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(created) == 2 and peak[0] == 2
+    assert pool.read(None, 3) == "3"
+
+
+def test_cli_engine_goes_through_pytesseract(monkeypatch):
+    seen = {}
+
+    def fake_image_to_string(img, config=""):
+        seen["size"], seen["config"] = img.size, config
+        return "VAT\n"
+
+    monkeypatch.setattr(tesseract_engine, "TESSERACT_ENGINE", "cli")
+    monkeypatch.setattr(pytesseract, "image_to_string", fake_image_to_string)
+    assert tesseract_engine.image_to_string(np.zeros((20, 30), np.uint8), psm=6) == "VAT\n"
+    assert seen == {"size": (30, 20), "config": "--psm 6 --oem 3"}
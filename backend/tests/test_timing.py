@@ -0,0 +1,44 @@
+"""Tests for the OCR stage timer and the process-wide timing histogram."""
+
+from app.ocr import timing
+
+
+def test_collect_records_splits_engines_and_counts():
+    with timing.collect() as timer:
+        timing.split("decode")
+        with timing.engine("tesseract"):
+            pass
+        with timing.engine("tesseract"):
+            pass
+        timing.count("rows_blank")
+        timing.count("rows_blank")
+        timing.split("header_ocr")
+    out = timer.as_dict()
+    assert set(out["stages"]) == {"decode", "header_ocr"}
+    assert out["engines"]["tesseract"]["calls"] == 2
+    assert out["counts"] == {"rows_blank": 2}
+    assert out["total_ms"] >= 0
+
+
+def test_helpers_are_no_ops_outside_collect():
+    timing.split("decode")
+    timing.count("rows_blank")
+    with timing.engine("trocr"):
+        pass
+
+
+def test_histogram_aggregates_uploads():
+    hist = timing.TimingHistogram()
+    for total in (40.0, 300.0):
+        hist.observe({
+            "total_ms": total,
+            "stages": {"trocr": total / 2},
+            "engines": {"trocr": {"ms": total / 2, "calls": 1}},
+            "counts": {"trocr_crops": 10},
+        })
+    snap = hist.snapshot()
+    assert snap["uploads"] == 2
+    assert snap["series"]["total"]["count"] == 2
+    assert snap["series"]["total"]["max_ms"] == 300.0
+    assert snap["series"]["total"]["p50_ms_le"] == 50.0
+    assert snap["counts"] == {"trocr_calls": 2, "trocr_crops": 20}
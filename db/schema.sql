@@ -97,4 +97,22 @@ CREATE TABLE IF NOT EXISTS audit_log (
 );
 
 CREATE INDEX IF NOT EXISTS idx_audit_log_user ON audit_log(user_id);
-CREATE INDEX IF NOT EXISTS idx_audit_log_created ON audit_log(created_at DESC);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_audit_log_created ON audit_log(created_at DESC);
+
+-- Durable queue behind 202-style uploads. The image is kept in the row until
+-- the job finishes so queued work survives a restart; workers claim rows with
+-- FOR UPDATE SKIP LOCKED so several API processes can share the queue.
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    status TEXT NOT NULL CHECK (status IN ('queued', 'running', 'done', 'failed')) DEFAULT 'queued',
+    image_bytes BYTEA,
+    submission_id UUID REFERENCES submissions(id) ON DELETE SET NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT NOW(),
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ocr_jobs_status_created ON ocr_jobs(status, created_at);